@@ -4,6 +4,7 @@ Blueprint pour les routes d'administration de Hall - Flask Gateway.
 """
 
 import os
+from typing import Dict, Any
 
 from flask import (
     Blueprint, render_template, request, redirect, url_for, flash, session
@@ -14,15 +15,55 @@ from config import load_config, TESTING_SERVER_IP
 from database import (
     get_db, get_recent_logs, get_all_activity, get_all_testing_projects,
     get_testing_access_logs, get_testing_project, create_testing_project,
-    update_testing_project, delete_testing_project
+    update_testing_project, delete_testing_project, purge_testing_cache, log_action
 )
 from functions import require_admin_login
-from wol import ping_server
+from netprobe import ping_many
+from boot_telemetry import boot_telemetry
+from prober import status_prober
+from response_cache import response_cache
+from upstream_pool import upstream_pool
+from wake_state import wake_states
+from wol import request_shutdown
 
 
 admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
 
 
+def _logs_page(fetch, limit: int, filter_arg: str):
+    """
+    Page de journaux pour les vues admin (pagination par clé via ?before=<id>,
+    filtre optionnel via ?<filter_arg>=<nom>).
+    Retourne (logs, id de départ de la page suivante ou None).
+    """
+    before = request.args.get("before", type=int)
+    logs = fetch(limit + 1, before, request.args.get(filter_arg) or None)
+    next_before = logs[limit - 1]["id"] if len(logs) > limit else None
+    return logs[:limit], next_before
+
+
+def _domains_online(domains_config: Dict[str, Any], timeout: float = 1.0) -> Dict[str, bool]:
+    """
+    État en ligne de chaque domaine pour le tableau de bord.
+    Les résultats encore valides du sondeur partagé sont réutilisés ; les
+    autres IPs sont sondées toutes ensemble, avec un délai global `timeout`.
+    """
+    online: Dict[str, bool] = {}
+    to_probe: Dict[str, list] = {}
+    for name, conf in domains_config.items():
+        cached = status_prober.fresh(name)
+        if cached is not None:
+            online[name] = cached.server_online
+        else:
+            to_probe.setdefault(conf.get("server", {}).get("ip"), []).append(name)
+
+    results = ping_many([ip for ip in to_probe if ip], timeout)
+    for ip, names in to_probe.items():
+        for name in names:
+            online[name] = results.get(ip, False)
+    return online
+
+
 @admin_bp.route("/login", methods=["GET", "POST"])
 def admin_login():
     """Page de login admin."""
@@ -54,23 +95,23 @@ def admin():
     config = load_config()
     domains_config = config.get("domains", {})
 
-    logs = get_recent_logs(100)
+    logs, next_before = _logs_page(get_recent_logs, 100, "domain")
     activity = get_all_activity()
 
-    # Enrichir avec les statuts
-    domains_status = {}
-    for name, conf in domains_config.items():
-        server = conf.get("server", {})
-        domains_status[name] = {
-            "config": conf,
-            "online": ping_server(server.get("ip"), 1)
-        }
+    # Enrichir avec les statuts (sondes en parallèle)
+    online = _domains_online(domains_config)
+    domains_status = {
+        name: {"config": conf, "online": online[name]}
+        for name, conf in domains_config.items()
+    }
 
     return render_template(
         "admin.html",
         logs=logs,
+        next_before=next_before,
         activity=activity,
         domains=domains_status,
+        boot_stats=boot_telemetry.stats(),
         config=config
     )
 
@@ -84,13 +125,16 @@ def admin():
 def admin_testing():
     """Page d'administration des projets testing."""
     projects = get_all_testing_projects()
-    logs = get_testing_access_logs(50)
+    logs, next_before = _logs_page(get_testing_access_logs, 50, "project")
 
     return render_template(
         "admin_testing.html",
         projects=projects,
         logs=logs,
-        testing_server_ip=TESTING_SERVER_IP
+        next_before=next_before,
+        testing_server_ip=TESTING_SERVER_IP,
+        pool_stats=upstream_pool.stats(),
+        cache_stats=response_cache.stats()
     )
 
 
@@ -105,6 +149,7 @@ def admin_testing_add():
         password = request.form.get("password", "")
         description = request.form.get("description", "").strip()
         health_check_path = request.form.get("health_check_path", "/health").strip()
+        cache_enabled = request.form.get("response_cache") == "on"
 
         # Validation
         if not name or not display_name or not port or not password:
@@ -130,7 +175,8 @@ def admin_testing_add():
 
         # Créer le projet
         password_hash = generate_password_hash(password)
-        if create_testing_project(name, display_name, port_int, password_hash, description, health_check_path):
+        if create_testing_project(name, display_name, port_int, password_hash, description, health_check_path,
+                                  cache_enabled):
             flash(f"Projet '{display_name}' créé avec succès", "success")
         else:
             flash("Erreur lors de la création du projet", "error")
@@ -156,6 +202,7 @@ def admin_testing_edit(name: str):
         description = request.form.get("description", "").strip()
         health_check_path = request.form.get("health_check_path", "/health").strip()
         active = request.form.get("active") == "on"
+        cache_enabled = request.form.get("response_cache") == "on"
 
         # Validation
         if not display_name or not port:
@@ -171,7 +218,8 @@ def admin_testing_edit(name: str):
             return redirect(url_for("admin_bp.admin_testing_edit", name=name))
 
         password_hash = generate_password_hash(password) if password else None
-        update_testing_project(name, display_name, port_int, description, health_check_path, active, password_hash)
+        update_testing_project(name, display_name, port_int, description, health_check_path, active, password_hash,
+                               cache_enabled)
 
         flash(f"Projet '{display_name}' mis à jour", "success")
         return redirect(url_for("admin_bp.admin_testing"))
@@ -188,6 +236,16 @@ def admin_testing_delete(name: str):
     return redirect(url_for("admin_bp.admin_testing"))
 
 
+@admin_bp.route("/testing/purge-cache/<name>", methods=["POST"])
+@require_admin_login
+def admin_testing_purge_cache(name: str):
+    """Vider le cache des réponses d'un projet testing (après un redéploiement)."""
+    purged = response_cache.purge(name)
+    purge_testing_cache(name)
+    flash(f"Cache du projet '{name}' vidé ({purged} réponses dans ce worker, autres workers sous peu)", "success")
+    return redirect(url_for("admin_bp.admin_testing"))
+
+
 @admin_bp.route("/shutdown/<domain>", methods=["POST"])
 @require_admin_login
 def shutdown_server(domain):
@@ -198,24 +256,11 @@ def shutdown_server(domain):
     if not conf or not conf.get("shutdown_endpoint"):
         flash("Aucun endpoint d'extinction configuré pour ce domaine.", "error")
         return redirect(url_for("admin_bp.admin"))
-    endpoint = conf["shutdown_endpoint"]
-    url = endpoint.get("url")
-    method = endpoint.get("method", "POST").upper()
-    port = endpoint.get("port")
-    try:
-        import requests
-        req_url = url
-        if port and ":" not in url:
-            # Ajoute le port si non présent dans l'URL
-            from urllib.parse import urlparse, urlunparse
-            parts = list(urlparse(url))
-            parts[1] = f"{parts[1].split(':')[0]}:{port}"
-            req_url = urlunparse(parts)
-        resp = requests.request(method, req_url, timeout=5)
-        if resp.status_code in (200, 202, 204):
-            flash(f"Extinction demandée pour {domain} (code {resp.status_code})", "success")
-        else:
-            flash(f"Erreur lors de l'extinction ({resp.status_code}): {resp.text}", "error")
-    except Exception as e:
-        flash(f"Erreur lors de la requête d'extinction: {e}", "error")
+    success, detail = request_shutdown(conf["shutdown_endpoint"])
+    log_action(domain, "shutdown", "success" if success else "failed", detail)
+    if success:
+        wake_states.shut_down(domain)
+        flash(f"Extinction demandée pour {domain} ({detail})", "success")
+    else:
+        flash(f"Erreur lors de l'extinction : {detail}", "error")
     return redirect(url_for("admin_bp.admin"))
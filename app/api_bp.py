@@ -3,23 +3,41 @@ api_bp.py
 Blueprint pour les routes API et utilitaires de Hall - Flask Gateway.
 """
 
-from flask import Blueprint, render_template, jsonify, request, current_app
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+from flask import (
+    Flask, Blueprint, Response, render_template, jsonify, current_app, request, session, abort
+)
 
-from config import load_config, get_domain_config, get_global_config
-from database import update_activity, update_wol_activity
+from config import (
+    load_config, current_config, get_domain_settings, DomainSettings, SSE_MAX_STREAMS, to_plain
+)
+from database import update_activity, update_wol_activity, log_action
 from functions import (
     require_domain_access, should_be_awake, get_domain_from_host,
     require_admin_login
 )
-from wol import send_wol, ping_server, check_health
+from wol import send_wol
+from prober import status_prober, ProbeResult
+from boot_telemetry import boot_telemetry
+from metrics import WOL_SENT
+from wake_state import wake_states, WAKING, IDLE
 from logging_utils import log_event
+from assets import page_cache
 
 
 api_bp = Blueprint('api_bp', __name__)
 
 
-# Création du décorateur avec la fonction get_domain_config
-domain_access = require_domain_access(get_domain_config)
+# Création du décorateur avec la fonction get_domain_settings
+domain_access = require_domain_access(get_domain_settings)
+
+# Chaque flux SSE occupe un thread du worker : leur nombre est borné
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
 
 
 @api_bp.route("/")
@@ -27,108 +45,220 @@ def index():
     """Page d'accueil ou page d'attente si domaine virtuel détecté."""
     # Si un domaine virtuel est détecté via le Host header
     domain = get_domain_from_host()
-    if domain and get_domain_config(domain):
+    if domain and get_domain_settings(domain):
         return domain_page(domain)
     
-    # Sinon, afficher la page d'accueil normale
-    config = load_config()
-    domains = list(config.get("domains", {}).keys())
-    return render_template("index.html", domains=domains)
+    # Sinon, afficher la page d'accueil normale (rendue une fois par version de configuration)
+    config = current_config()
+    return page_cache.response(
+        "index", config.version,
+        lambda: render_template("index.html", domains=list(config.domains.keys()))
+    )
 
 
 @api_bp.route("/<domain>")
 @domain_access
 def domain_page(domain: str):
     """Page d'attente pour un domaine."""
-    domain_config = get_domain_config(domain)
-    global_config = get_global_config()
+    config = current_config()
+    global_config = config.global_config
 
     update_activity(domain)
     log_event(current_app, f"Accès au domaine {domain}", domain=domain)
 
-    return render_template(
+    # Ne dépend que de la configuration : rendue une fois par version du snapshot
+    return page_cache.response(f"waiting:{domain}", config.version, lambda: render_template(
         "waiting.html",
         domain=domain,
-        config=domain_config,
+        config=config.domain(domain).raw,
         polling_interval=global_config.get("polling_interval_seconds", 3)
-    )
-
-
-@api_bp.route("/api/status/<domain>")
-@domain_access
-def api_status(domain: str):
-    """API pour vérifier le statut d'un domaine."""
-    domain_config = get_domain_config(domain)
-    global_config = get_global_config()
-
-    if not domain_config:
-        return jsonify({"error": "Domaine non configuré"}), 404
-
-    server = domain_config.get("server", {})
-    redirect_config = domain_config.get("redirect", {})
+    ))
 
-    # Vérifications
-    server_online = ping_server(
-        server.get("ip"),
-        global_config.get("ping_timeout_seconds", 2)
-    )
 
-    service_ready = False
-    if server_online and redirect_config.get("health_check"):
-        service_ready = check_health(
-            redirect_config.get("url"),
-            redirect_config.get("health_check"),
-            global_config.get("health_check_timeout_seconds", 5)
-        )
+def build_status_payload(settings: DomainSettings, status: ProbeResult) -> Dict[str, Any]:
+    """Construit la réponse de /api/status (partagée avec le mode ASGI)."""
+    server_online = status.server_online
+    service_ready = status.service_ready
 
     # Politique
-    should_wake, wake_reason = should_be_awake(domain, domain_config)
+    should_wake, wake_reason = should_be_awake(settings)
 
-    return jsonify({
-        "domain": domain,
+    return {
+        "domain": settings.name,
         "server_online": server_online,
         "service_ready": service_ready,
         "ready": server_online and service_ready,
-        "redirect_url": redirect_config.get("url") if service_ready else None,
+        "redirect_url": settings.redirect_url if service_ready else None,
         "policy": {
-            "type": domain_config.get("policy", {}).get("type"),
+            "type": settings.raw.get("policy", {}).get("type"),
             "should_be_awake": should_wake,
             "reason": wake_reason
         }
-    })
+    }
 
 
-@api_bp.route("/api/wake/<domain>", methods=["POST"])
-@domain_access
-def api_wake(domain: str):
-    """API pour réveiller le serveur d'un domaine."""
-    domain_config = get_domain_config(domain)
+def status_state(payload: Dict[str, Any]) -> str:
+    """Étape du démarrage : offline → booting (ping OK) → ready (service prêt)."""
+    if payload["ready"] and payload["redirect_url"]:
+        return "ready"
+    if payload["server_online"]:
+        return "booting"
+    return "offline"
+
+
+def format_sse(event: str, data: Dict[str, Any], retry_ms: Optional[int] = None) -> str:
+    """Formate un message Server-Sent Events."""
+    message = f"event: {event}\n"
+    if retry_ms is not None:
+        message += f"retry: {retry_ms}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def sse_settings(global_config: Dict[str, Any]) -> Tuple[float, float]:
+    """Retourne (durée max d'un flux, intervalle de keep-alive) en secondes."""
+    return (
+        float(global_config.get("sse_max_duration_seconds", 300)),
+        float(global_config.get("sse_keepalive_seconds", 15)),
+    )
 
-    if not domain_config:
-        return jsonify({"success": False, "message": "Domaine non configuré"}), 404
-    policy = domain_config.get("policy", {})
 
-    if not policy.get("wol_enabled", True):
-        return jsonify({"success": False, "message": "WoL désactivé pour ce domaine"}), 400
+def wake_domain(app: Flask, settings: DomainSettings,
+                client_ip: Optional[str] = None) -> Tuple[Dict[str, Any], int]:
+    """
+    Réveille le serveur d'un domaine (partagé avec le mode ASGI).
+    Un seul WoL par réveil, tous workers confondus : si un réveil est déjà
+    en cours (ou le serveur en ligne), l'état courant est renvoyé sans envoi.
+    Retourne (réponse JSON, code HTTP).
+    """
+    domain = settings.name
 
-    server = domain_config.get("server", {})
-    mac = server.get("mac")
+    if not settings.wol_enabled:
+        return {"success": False, "message": "WoL désactivé pour ce domaine"}, 400
+
+    mac = settings.mac
 
     if not mac:
-        return jsonify({"success": False, "message": "MAC non configurée"}), 400
+        return {"success": False, "message": "MAC non configurée"}, 400
 
-    success = send_wol(current_app, mac, domain=domain)
     update_activity(domain)
-    log_event(current_app, f"[WOL] Domaine: {domain} | MAC: {mac} | Success: {success}", domain=domain)
+    claimed, wake = wake_states.claim(domain)
+    if not claimed:
+        WOL_SENT.labels(domain, "deduplicated").inc()
+        return {
+            "success": True,
+            "sent": False,
+            "state": wake["state"],
+            "message": "Réveil déjà en cours" if wake["state"] == WAKING else "Serveur déjà en ligne"
+        }, 200
+
+    success = send_wol(app, mac, domain=domain)
+    log_event(app, f"[WOL] Domaine: {domain} | MAC: {mac} | Success: {success}", domain=domain)
+    log_action(domain, "wol", "success" if success else "failed", f"MAC {mac}", client_ip)
 
     # Incrémenter le compteur de boot
     if success:
         update_wol_activity(domain)
+        boot_telemetry.wol_sent(domain)
+    else:
+        # Un nouvel essai doit rester possible
+        wake_states.release(domain)
 
-    return jsonify({
+    return {
         "success": success,
+        "sent": success,
+        "state": WAKING if success else IDLE,
         "message": "WoL envoyé" if success else "Échec WoL"
-    })
+    }, 200
+
+
+@api_bp.route("/api/status/<domain>")
+@domain_access
+def api_status(domain: str):
+    """API pour vérifier le statut d'un domaine."""
+    settings = get_domain_settings(domain)
+
+    if not settings:
+        return jsonify({"error": "Domaine non configuré"}), 404
+
+    # Vérifications (depuis le cache du sondeur partagé)
+    status = status_prober.get_status(domain)
+
+    return jsonify(build_status_payload(settings, status))
+
+
+@api_bp.route("/api/status/<domain>/stream")
+@domain_access
+def api_status_stream(domain: str):
+    """
+    Flux SSE des transitions de statut d'un domaine.
+    Un événement `status` est émis à chaque changement d'étape ; le flux se
+    ferme une fois le service prêt, ou après sse_max_duration_seconds (le
+    navigateur se reconnecte alors automatiquement). Au-delà de
+    SSE_MAX_STREAMS flux par worker, la page d'attente repasse en polling.
+    """
+    # Plus de place : le navigateur ferme le flux et repasse en polling
+    if not _sse_slots.acquire(blocking=False):
+        return jsonify({"error": "Trop de flux ouverts, utiliser le polling"}), 503
+
+    try:
+        return _status_stream_response(domain)
+    except BaseException:
+        # Réponse non créée : call_on_close ne libérera jamais la place
+        _sse_slots.release()
+        raise
+
+
+def _status_stream_response(domain: str) -> Response:
+    """Réponse SSE de api_status_stream (place déjà prise, rendue à la fermeture)."""
+    config = current_config()
+    settings = config.domain(domain)
+    global_config = config.global_config
+    max_duration, keepalive = sse_settings(global_config)
+    retry_ms = int(global_config.get("polling_interval_seconds", 3) * 1000)
+
+    def generate():
+        deadline = time.monotonic() + max_duration
+        last_state = None
+        version = -1
+        while time.monotonic() < deadline:
+            status_prober.touch(domain)
+            if version != status_prober.version(domain) or last_state is None:
+                status = status_prober.get_status(domain)
+                version = status_prober.version(domain)
+                payload = build_status_payload(settings, status)
+                state = status_state(payload)
+                if state != last_state:
+                    payload["state"] = state
+                    yield format_sse("status", payload, retry_ms if last_state is None else None)
+                    last_state = state
+                    if state == "ready":
+                        return
+            new_version = status_prober.wait_for_change(
+                domain, version, min(keepalive, max(deadline - time.monotonic(), 0))
+            )
+            if new_version == version:
+                yield ": keep-alive\n\n"
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(_sse_slots.release)
+    return response
+
+
+@api_bp.route("/api/wake/<domain>", methods=["POST"])
+@domain_access
+def api_wake(domain: str):
+    """API pour réveiller le serveur d'un domaine."""
+    settings = get_domain_settings(domain)
+
+    if not settings:
+        return jsonify({"success": False, "message": "Domaine non configuré"}), 404
+
+    payload, status_code = wake_domain(current_app._get_current_object(), settings)
+    return jsonify(payload), status_code
 
 
 @api_bp.route("/api/activity/<domain>", methods=["POST"])
@@ -149,16 +279,55 @@ def api_config():
         "domains": {
             name: {
                 "description": d.get("description"),
-                "policy": d.get("policy"),
+                "policy": to_plain(d.get("policy")),
                 "server": {"ip": d["server"]["ip"]}
             }
             for name, d in config.get("domains", {}).items()
         },
-        "global": config.get("global", {})
+        "global": to_plain(config.get("global", {}))
     }
     return jsonify(safe_config)
 
 
+@api_bp.route("/api/schedule/<domain>")
+@require_admin_login
+def api_schedule(domain: str):
+    """API pour consulter le planning compilé d'un domaine et ses prochaines transitions."""
+    settings = get_domain_settings(domain)
+    if not settings:
+        return jsonify({"error": "Domaine non configuré"}), 404
+    schedule = settings.schedule
+    if schedule is None:
+        return jsonify({"domain": domain, "policy": settings.policy_type, "schedule": None})
+
+    from prewake import prewake_scheduler
+    now = datetime.now(schedule.timezone)
+    next_start = schedule.next_start(now)
+    next_end = schedule.next_end(now)
+    prewake_at = prewake_scheduler.planned(domain)
+    return jsonify({
+        "domain": domain,
+        "policy": settings.policy_type,
+        "timezone": str(schedule.timezone),
+        "active": schedule.is_active(now),
+        "next_start": next_start.isoformat() if next_start else None,
+        "next_end": next_end.isoformat() if next_end else None,
+        "prewake_at": prewake_at.isoformat() if prewake_at else None,
+        "week": {
+            day.isoformat(): schedule.windows_for(day)
+            for day in (now.date() + timedelta(days=offset) for offset in range(7))
+        },
+    })
+
+
+@api_bp.route("/api/boot/stats")
+@api_bp.route("/api/boot/stats/<domain>")
+@require_admin_login
+def api_boot_stats(domain: Optional[str] = None):
+    """API des temps de démarrage mesurés (secondes depuis le WoL : p50/p95/p99 par phase)."""
+    return jsonify(boot_telemetry.stats(domain))
+
+
 @api_bp.route("/api/reload", methods=["POST"])
 @require_admin_login
 def api_reload():
@@ -170,6 +339,37 @@ def api_reload():
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@api_bp.route("/api/proxy/stats")
+@require_admin_login
+def api_proxy_stats():
+    """API pour consulter les statistiques du pool proxy et du cache des réponses (worker courant)."""
+    from upstream_pool import upstream_pool
+    from response_cache import response_cache
+    return jsonify({**upstream_pool.stats(), "response_cache": response_cache.stats()})
+
+
+@api_bp.route("/api/db/stats")
+@require_admin_login
+def api_db_stats():
+    """API pour consulter la durée des requêtes SQL et les écritures différées (worker courant)."""
+    from database import get_query_stats, audit_writer
+    from logging_utils import log_pipeline
+    return jsonify({
+        "queries": get_query_stats(),
+        "audit_writer": audit_writer.stats(),
+        "log_pipeline": log_pipeline.stats(),
+    })
+
+
+@api_bp.route("/metrics")
+def api_metrics():
+    """Métriques Prometheus de tous les workers (session admin ou IP de METRICS_ALLOWED_IPS)."""
+    from metrics import metrics_allowed, render_metrics
+    if not metrics_allowed(request.remote_addr, bool(session.get("admin_authenticated"))):
+        abort(403, description="Accès non autorisé")
+    return render_metrics()
+
+
 @api_bp.route("/api/testing/status/<name>")
 def api_testing_status(name: str):
     """API pour vérifier le statut d'un projet testing."""
@@ -11,10 +11,14 @@ import os
 from flask import Flask
 
 from logging_utils import setup_logging
-from database import init_db
+from assets import init_assets
+from metrics import init_metrics
+from database import init_db, start_log_retention
 from api_bp import api_bp
 from admin_bp import admin_bp
 from testing_bp import testing_bp
+from prewake import prewake_scheduler
+from reaper import idle_reaper
 
 
 def create_app():
@@ -25,6 +29,12 @@ def create_app():
     # Configuration du logging
     setup_logging(app)
 
+    # Métriques Prometheus (requêtes, rendu des templates)
+    init_metrics(app)
+
+    # Fichiers statiques en mémoire (noms à empreinte, versions compressées)
+    init_assets(app)
+
     # Enregistrement des blueprints
     app.register_blueprint(api_bp)          # Routes / et /api/*
     app.register_blueprint(admin_bp)        # Routes /admin/*
@@ -34,6 +44,15 @@ def create_app():
     with app.app_context():
         init_db()
 
+    # Purge périodique des anciens journaux
+    start_log_retention()
+
+    # Réveil anticipé des domaines planifiés
+    prewake_scheduler.start(app)
+
+    # Extinction des serveurs inactifs
+    idle_reaper.start(app)
+
     return app
 
 
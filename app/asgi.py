@@ -0,0 +1,566 @@
+"""
+asgi.py
+Point d'entrée ASGI de Hall - Flask Gateway (mode asynchrone).
+Les chemins chauds sont servis directement en asyncio : proxy testing,
+/api/status (et son flux SSE), /api/wake et /api/activity. Toutes les autres routes, ainsi que
+les cas d'erreur ou de redirection de ces chemins (domaine inconnu, IP
+refusée, projet non authentifié...), sont délégués à l'application Flask
+via un adaptateur WSGI, qui produit exactement les mêmes réponses.
+
+Lancement : HALL_SERVER_MODE=async gunicorn -c gunicorn.conf.py
+"""
+
+import asyncio
+import re
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import (
+    HTTPException, ServiceUnavailable, GatewayTimeout, InternalServerError, BadGateway
+)
+
+from app import app as flask_app
+from assets import static_assets
+from api_bp import (
+    build_status_payload, wake_domain, status_state, format_sse, sse_settings
+)
+from config import (
+    checked_snapshot, get_snapshot, ConfigSnapshot, DomainSettings, TESTING_SERVER_IP, PROXY_CHUNK_SIZE
+)
+from database import update_activity, get_testing_project, log_testing_access
+from functions import check_ip_allowed
+from logging_utils import log_event
+from metrics import PROBE_LATENCY, record_request, record_upstream
+from netprobe import async_ping_many
+from prober import status_prober, ProbeResult
+from response_cache import response_cache, CachedResponse
+from testing_bp import HOP_BY_HOP_HEADERS
+from upstream_pool import async_upstream_pool
+from wol import async_check_health
+
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_STATUS_PATH = re.compile(r"^/api/status/([^/]+)$")
+_STREAM_PATH = re.compile(r"^/api/status/([^/]+)/stream$")
+_WAKE_PATH = re.compile(r"^/api/wake/([^/]+)$")
+_ACTIVITY_PATH = re.compile(r"^/api/activity/([^/]+)$")
+_TESTING_PATH = re.compile(r"^/testing/([^/]+)/(.*)$")
+_STATIC_PATH = re.compile(r"^/static/(.+)$")
+
+# Endpoint Flask équivalent de chaque chemin chaud (libellé des métriques)
+_ENDPOINTS = {
+    _STATUS_PATH: "api_bp.api_status",
+    _STREAM_PATH: "api_bp.api_status_stream",
+    _WAKE_PATH: "api_bp.api_wake",
+    _ACTIVITY_PATH: "api_bp.api_activity",
+    _TESTING_PATH: "testing_bp.testing_proxy",
+    _STATIC_PATH: "static",
+}
+
+# En-têtes ajoutés par uvicorn lui-même : ceux de l'upstream ne sont pas relayés
+_SERVER_HEADERS = {"date", "server"}
+
+
+def _flask_wsgi(environ: Dict[str, Any], start_response: Callable) -> Any:
+    # asgiref fournit un wsgi.errors binaire, où le handler de log Flask ne peut écrire
+    environ["wsgi.errors"] = sys.stderr
+    return flask_app(environ, start_response)
+
+
+# Application Flask pour toutes les routes non asynchrones
+_wsgi_app = WsgiToAsgi(_flask_wsgi)
+
+# Client httpx partagé pour les health checks (créé dans la boucle du worker)
+_health_client: Optional[httpx.AsyncClient] = None
+
+# Intervalle de vérification (en mémoire) des changements d'état pour les flux SSE
+_SSE_CHECK_INTERVAL = 0.25
+
+# Sondes asynchrones en cours, par domaine (single-flight)
+_inflight: Dict[str, "asyncio.Future[ProbeResult]"] = {}
+
+
+# ============================================
+# UTILITAIRES ASGI
+# ============================================
+
+def _client_ip(scope: Scope) -> Optional[str]:
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def _header(scope: Scope, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def _send_json(send: Send, payload: Dict[str, Any], status: int = 200):
+    """Envoie une réponse JSON identique à celle de jsonify()."""
+    body = f"{flask_app.json.dumps(payload, separators=(',', ':'))}\n".encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_error(send: Send, error: HTTPException):
+    """Envoie la même page d'erreur que abort() côté Flask."""
+    body = error.get_body().encode()
+    await send({
+        "type": "http.response.start",
+        "status": error.code,
+        "headers": [
+            (b"content-type", b"text/html; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _allowed_domain(scope: Scope, config: ConfigSnapshot, domain: str) -> Optional[DomainSettings]:
+    """
+    Réglages du domaine si l'accès est autorisé, sinon None : la requête
+    est alors déléguée à Flask (404/403 et journalisation habituels).
+    """
+    settings = config.domain(domain)
+    if not settings or not check_ip_allowed(settings, _client_ip(scope)):
+        return None
+    return settings
+
+
+# ============================================
+# STATUT, RÉVEIL, ACTIVITÉ
+# ============================================
+
+def _get_health_client() -> httpx.AsyncClient:
+    global _health_client
+    if _health_client is None:
+        _health_client = httpx.AsyncClient(verify=False)
+    return _health_client
+
+
+async def _probe(settings: DomainSettings, global_config: Dict[str, Any]) -> ProbeResult:
+    """Ping et health check non bloquants d'un domaine."""
+    ip = settings.server_ip
+
+    server_online = False
+    if ip:
+        with PROBE_LATENCY.labels(settings.name, "ping").time():
+            reachable = await async_ping_many([ip], global_config.get("ping_timeout_seconds", 2))
+        server_online = reachable.get(ip, False)
+
+    service_ready = False
+    if server_online and settings.health_check:
+        with PROBE_LATENCY.labels(settings.name, "health").time():
+            service_ready = await async_check_health(
+                _get_health_client(),
+                settings.redirect_url,
+                settings.health_check,
+                global_config.get("health_check_timeout_seconds", 5)
+            )
+
+    result = ProbeResult(server_online, service_ready, time.monotonic())
+    # Le store notifie les observateurs (cache partagé, télémétrie SQLite) : hors de la boucle
+    await asyncio.to_thread(status_prober.store, settings.name, result)
+    return result
+
+
+async def _get_status(settings: DomainSettings, global_config: Dict[str, Any]) -> ProbeResult:
+    """Statut depuis le cache partagé, ou une seule sonde asynchrone par domaine."""
+    domain = settings.name
+    status_prober.touch(domain)
+    result = status_prober.fresh(domain)
+    if result is not None:
+        return result
+
+    future = _inflight.get(domain)
+    if future is None:
+        future = asyncio.ensure_future(_probe(settings, global_config))
+        _inflight[domain] = future
+        future.add_done_callback(lambda f: _inflight.pop(domain, None))
+    return await asyncio.shield(future)
+
+
+async def _status_payload(settings: DomainSettings, status: ProbeResult) -> Dict[str, Any]:
+    # should_be_awake peut lire SQLite (dernière activité) : hors de la boucle
+    return await asyncio.to_thread(build_status_payload, settings, status)
+
+
+async def _api_status(send: Send, config: ConfigSnapshot, settings: DomainSettings):
+    status = await _get_status(settings, config.global_config)
+    await _send_json(send, await _status_payload(settings, status))
+
+
+async def _api_status_stream(receive: Receive, send: Send, config: ConfigSnapshot,
+                             settings: DomainSettings):
+    """Flux SSE des transitions de statut (équivalent de api_status_stream)."""
+    domain = settings.name
+    global_config = config.global_config
+    max_duration, keepalive = sse_settings(global_config)
+    retry_ms = int(global_config.get("polling_interval_seconds", 3) * 1000)
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    try:
+        deadline = time.monotonic() + max_duration
+        last_state = None
+        version = -1
+        idle = 0.0
+        while not disconnected.is_set() and time.monotonic() < deadline:
+            status_prober.touch(domain)
+            if version != status_prober.version(domain) or last_state is None:
+                status = await _get_status(settings, global_config)
+                version = status_prober.version(domain)
+                payload = await _status_payload(settings, status)
+                state = status_state(payload)
+                if state != last_state:
+                    payload["state"] = state
+                    message = format_sse("status", payload, retry_ms if last_state is None else None)
+                    await send({"type": "http.response.body", "body": message.encode(), "more_body": True})
+                    last_state = state
+                    idle = 0.0
+                    if state == "ready":
+                        break
+            elif idle >= keepalive:
+                await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+                idle = 0.0
+            try:
+                await asyncio.wait_for(disconnected.wait(), _SSE_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                idle += _SSE_CHECK_INTERVAL
+    finally:
+        watcher.cancel()
+        if not disconnected.is_set():
+            await send({"type": "http.response.body", "body": b""})
+
+
+async def _api_wake(scope: Scope, send: Send, settings: DomainSettings):
+    payload, status_code = await asyncio.to_thread(
+        wake_domain, flask_app, settings, _client_ip(scope)
+    )
+    await _send_json(send, payload, status_code)
+
+
+async def _api_activity(send: Send, domain: str):
+    await asyncio.to_thread(update_activity, domain)
+    await _send_json(send, {"success": True, "message": "Activité enregistrée"})
+
+
+# ============================================
+# PROXY TESTING
+# ============================================
+
+def _session(scope: Scope) -> Dict[str, Any]:
+    """Session Flask de la requête, ouverte par l'interface de session de l'application."""
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "PATH_INFO": scope["path"],
+        "SERVER_NAME": "",
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "HTTP_COOKIE": _header(scope, b"cookie"),
+        "HTTP_HOST": _header(scope, b"host"),
+    }
+    session = flask_app.session_interface.open_session(flask_app, flask_app.request_class(environ))
+    return session if session is not None else {}
+
+
+def _flask_hooks_only_metrics() -> bool:
+    """
+    Aucun before_request Flask autre que la mesure des requêtes (faite ici
+    par _timed_send) : sinon le proxy passe par Flask pour les exécuter.
+    """
+    for key in (None, "testing_bp"):
+        if any(hook.__module__ != "metrics" for hook in flask_app.before_request_funcs.get(key, ())):
+            return False
+    return True
+
+
+def _proxy_headers(scope: Scope, project_name: str) -> List[Tuple[str, str]]:
+    headers = [
+        (key.decode("latin-1"), value.decode("latin-1"))
+        for key, value in scope["headers"]
+        if key.decode("latin-1") not in HOP_BY_HOP_HEADERS | {"host", "cookie"}
+    ]
+    headers.append(("X-Forwarded-For", _client_ip(scope) or ""))
+    headers.append(("X-Forwarded-Proto", scope.get("scheme", "http")))
+    headers.append(("X-Project-Name", project_name))
+    return headers
+
+
+async def _send_cached(scope: Scope, send: Send, entry: CachedResponse, state: str):
+    """Réponse depuis le cache du proxy (304 si le client a déjà cette version)."""
+    headers = entry.served_headers(time.time(), state)
+    not_modified = entry.not_modified_for(_header(scope, b"if-none-match"))
+    await send({
+        "type": "http.response.start",
+        "status": 304 if not_modified else entry.status,
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+            if not (not_modified and name.lower() == "content-length")
+        ],
+    })
+    await send({"type": "http.response.body", "body": b"" if not_modified else entry.body})
+
+
+async def _testing_proxy(scope: Scope, receive: Receive, send: Send,
+                         project_name: str, path: str) -> bool:
+    """
+    Relaie la requête vers le projet testing, corps en flux dans les deux sens.
+    Retourne False si la requête doit être traitée par Flask.
+    """
+    if path in ("login", "logout") or not TESTING_SERVER_IP or not _flask_hooks_only_metrics():
+        return False
+    # Le registre peut se recharger depuis SQLite : hors de la boucle
+    project = await asyncio.to_thread(get_testing_project, project_name)
+    if not project or not _session(scope).get(f"testing_auth_{project_name}"):
+        return False
+
+    target_url = f"http://{TESTING_SERVER_IP}:{project['port']}/{path}"
+    if scope.get("query_string"):
+        target_url += f"?{scope['query_string'].decode('latin-1')}"
+
+    content_length = _header(scope, b"content-length").strip()
+    has_body = (content_length.isdigit() and int(content_length) > 0) \
+        or "chunked" in _header(scope, b"transfer-encoding").lower()
+
+    async def request_body():
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            yield message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+    headers = _proxy_headers(scope, project_name)
+    # Cache des réponses GET (si activé pour le projet)
+    cached = response_cache.begin(project, scope["method"], target_url, headers)
+    if cached is not None:
+        entry = cached.hit(time.time())
+        if entry is not None:
+            await _send_cached(scope, send, entry, "HIT")
+            return True
+        headers = cached.upstream_headers(headers)
+
+    client_ip = _client_ip(scope)
+    port = project["port"]
+    started = time.perf_counter()
+    try:
+        upstream_request = async_upstream_pool.build_request(
+            port,
+            method=scope["method"],
+            url=target_url,
+            headers=headers,
+            content=request_body() if has_body else None,
+        )
+        resp = await async_upstream_pool.send(port, upstream_request, stream=True)
+    except httpx.ConnectError:
+        record_upstream(project_name, "connect_error", started)
+        log_testing_access(project_name, "proxy_error_connect", client_ip)
+        log_event(flask_app, f"Erreur connexion proxy vers {project_name}", level="error", domain="testing")
+        await _send_error(send, ServiceUnavailable("Service temporairement indisponible"))
+        return True
+    except httpx.TimeoutException:
+        record_upstream(project_name, "timeout", started)
+        log_testing_access(project_name, "proxy_error_timeout", client_ip)
+        log_event(flask_app, f"Timeout proxy vers {project_name}", level="error", domain="testing")
+        await _send_error(send, GatewayTimeout("Le service met trop de temps à répondre"))
+        return True
+    except Exception as e:
+        record_upstream(project_name, "error", started)
+        flask_app.logger.error(f"Erreur proxy vers {project_name}: {e}")
+        await _send_error(send, InternalServerError("Erreur interne"))
+        return True
+    record_upstream(project_name, str(resp.status_code), started)
+
+    response_headers = [
+        (name, value) for name, value in resp.headers.multi_items()
+        if name.lower() not in HOP_BY_HOP_HEADERS | _SERVER_HEADERS
+    ]
+    if cached is not None:
+        entry = cached.revalidated(resp.status_code, response_headers)
+        if entry is not None:
+            await resp.aclose()
+            await _send_cached(scope, send, entry, "REVALIDATED")
+            return True
+        if cached.answer_from_cache(resp.status_code, response_headers):
+            # Le navigateur a peut-être déjà cette version : corps lu en entier
+            # (taille connue et bornée) pour remplir le cache, puis réponse depuis la copie
+            try:
+                content = b"".join([chunk async for chunk in resp.aiter_raw(PROXY_CHUNK_SIZE)])
+            except httpx.HTTPError as e:
+                flask_app.logger.error(f"Lecture proxy interrompue pour {project_name}: {e}")
+                await _send_error(send, BadGateway("Réponse du service incomplète"))
+                return True
+            finally:
+                await resp.aclose()
+            entry = cached.store(resp.status_code, response_headers, content)
+            if entry is not None:
+                await _send_cached(scope, send, entry, "MISS")
+                return True
+            await send({
+                "type": "http.response.start",
+                "status": resp.status_code,
+                "headers": [
+                    (name.encode("latin-1"), value.encode("latin-1")) for name, value in response_headers
+                ] + [(b"x-hall-cache", b"MISS")],
+            })
+            await send({"type": "http.response.body", "body": content})
+            return True
+    # Corps copié au passage pour le cache (abandonné au-delà de la taille max)
+    body = bytearray() if cached is not None and cached.storable(resp.status_code, response_headers) else None
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": resp.status_code,
+            "headers": [
+                (name.encode("latin-1"), value.encode("latin-1")) for name, value in response_headers
+            ] + ([(b"x-hall-cache", b"MISS")] if cached is not None else []),
+        })
+        async for chunk in resp.aiter_raw(PROXY_CHUNK_SIZE):
+            if body is not None:
+                body += chunk
+                if len(body) > response_cache.max_entry_bytes:
+                    body = None
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        if body is not None:
+            cached.store(resp.status_code, response_headers, bytes(body))
+    except httpx.HTTPError as e:
+        flask_app.logger.error(f"Flux proxy interrompu pour {project_name}: {e}")
+    finally:
+        # Rend la connexion au pool (keep-alive)
+        await resp.aclose()
+    return True
+
+
+async def _static(scope: Scope, send: Send, filename: str) -> bool:
+    """Fichier statique depuis la mémoire (voir assets.py) ; False s'il est inconnu."""
+    result = static_assets.serve(
+        filename, _header(scope, b"accept-encoding"), _header(scope, b"if-none-match")
+    )
+    if result is None:
+        return False
+    status, headers, body = result
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body if scope["method"] == "GET" else b""})
+    return True
+
+
+# ============================================
+# APPLICATION ASGI
+# ============================================
+
+def _timed_send(send: Send, pattern: "re.Pattern[str]", method: str) -> Send:
+    """Enveloppe `send` : la requête est mesurée à l'envoi des en-têtes de réponse."""
+    started = time.perf_counter()
+
+    async def timed(message: Dict[str, Any]):
+        if message["type"] == "http.response.start":
+            record_request(_ENDPOINTS[pattern], method, message["status"], started)
+        await send(message)
+    return timed
+
+
+async def _dispatch(scope: Scope, receive: Receive, send: Send) -> bool:
+    """Sert les chemins chauds ; retourne False pour déléguer à Flask."""
+    path = scope["path"]
+    method = scope["method"]
+
+    match = _STATIC_PATH.match(path)
+    if match and method in ("GET", "HEAD"):
+        return await _static(scope, _timed_send(send, _STATIC_PATH, method), match.group(1))
+
+    match = _TESTING_PATH.match(path)
+    if match:
+        send = _timed_send(send, _TESTING_PATH, method)
+        return await _testing_proxy(scope, receive, send, match.group(1), match.group(2))
+
+    for pattern, expected_method in (
+        (_STATUS_PATH, "GET"), (_STREAM_PATH, "GET"),
+        (_WAKE_PATH, "POST"), (_ACTIVITY_PATH, "POST")
+    ):
+        match = pattern.match(path)
+        if match is None:
+            continue
+        if method != expected_method:
+            return False
+        domain = match.group(1)
+        # Un seul snapshot de configuration pour toute la requête
+        config = checked_snapshot() or await asyncio.to_thread(get_snapshot)
+        settings = _allowed_domain(scope, config, domain)
+        if settings is None:
+            return False
+        send = _timed_send(send, pattern, method)
+        if pattern is _STATUS_PATH:
+            await _api_status(send, config, settings)
+        elif pattern is _STREAM_PATH:
+            await _api_status_stream(receive, send, config, settings)
+        elif pattern is _WAKE_PATH:
+            await _api_wake(scope, send, settings)
+        else:
+            await _api_activity(send, domain)
+        return True
+
+    return False
+
+
+async def _lifespan(receive: Receive, send: Send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_upstream_pool.aclose()
+            if _health_client is not None:
+                await _health_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send):
+    """Application ASGI : chemins chauds en asyncio, le reste via Flask."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if not await _dispatch(scope, receive, send):
+        await _wsgi_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=5000)
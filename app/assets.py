@@ -0,0 +1,225 @@
+"""
+assets.py
+Fichiers statiques et pages rendues servis depuis la mémoire pour Hall - Flask Gateway.
+
+- Au démarrage, chaque fichier de static/ est lu, nommé d'après son contenu
+  (css/base.css → css/base.<empreinte>.css) et compressé (gzip, et brotli si
+  le module est installé). url_for('static', ...) produit le nom à empreinte :
+  ces URL changent à chaque modification et sont mises en cache sans
+  revalidation (Cache-Control: immutable).
+- Les pages qui ne dépendent que de la configuration (page d'attente, accueil)
+  sont rendues une fois par version du snapshot puis resservies telles quelles.
+
+Les réponses portent un ETag ; If-None-Match donne un 304.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from flask import Flask, Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli optionnel : gzip seul
+    brotli = None
+
+
+# Durée de cache des fichiers à empreinte (secondes)
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+# Taille minimale compressée (en dessous, la version brute suffit)
+ASSET_COMPRESS_MIN_BYTES = int(os.environ.get("ASSET_COMPRESS_MIN_BYTES", "512"))
+
+_COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml)|image/svg\+xml)")
+_FINGERPRINT = re.compile(r"^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$")
+# Suffixe d'ETag par encodage
+_ETAG_SUFFIX = {"identity": "", "gzip": "-gz", "br": "-br"}
+
+# Statut, en-têtes, corps
+StaticResponse = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+@dataclass(frozen=True)
+class Asset:
+    """Contenu en mémoire et ses variantes compressées."""
+    content_type: str
+    digest: str
+    variants: Mapping[str, bytes]  # encodage → corps
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}{_ETAG_SUFFIX[encoding]}"'
+
+
+def make_asset(body: bytes, content_type: str, fast: bool = False) -> Asset:
+    """
+    Construit un Asset et ses variantes compressées.
+    `fast` : niveaux de compression modérés (pages rendues à la volée).
+    """
+    variants = {"identity": body}
+    if _COMPRESSIBLE.match(content_type) and len(body) >= ASSET_COMPRESS_MIN_BYTES:
+        compressed = gzip.compress(body, compresslevel=6 if fast else 9, mtime=0)
+        if len(compressed) < len(body):
+            variants["gzip"] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=5 if fast else 11)
+            if len(compressed) < len(body):
+                variants["br"] = compressed
+    return Asset(content_type, hashlib.sha256(body).hexdigest()[:12], variants)
+
+
+def negotiate(asset: Asset, accept_encoding: Optional[str]) -> str:
+    """Meilleur encodage disponible accepté par le client (br, puis gzip)."""
+    if len(asset.variants) == 1 or not accept_encoding:
+        return "identity"
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in accept_encoding.split(",")
+        if not part.replace(" ", "").endswith(";q=0")
+    }
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and encoding in accepted:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def serve_asset(asset: Asset, cache_control: str, accept_encoding: Optional[str],
+                if_none_match: Optional[str]) -> StaticResponse:
+    """Réponse (statut, en-têtes, corps) pour un Asset, avec 304 si l'ETag correspond."""
+    encoding = negotiate(asset, accept_encoding)
+    etag = asset.etag(encoding)
+    headers = [("ETag", etag), ("Cache-Control", cache_control)]
+    if len(asset.variants) > 1:
+        headers.append(("Vary", "Accept-Encoding"))
+    if _etag_matches(if_none_match, etag):
+        return 304, headers, b""
+
+    body = asset.variants[encoding]
+    headers.append(("Content-Type", asset.content_type))
+    headers.append(("Content-Length", str(len(body))))
+    if encoding != "identity":
+        headers.append(("Content-Encoding", encoding))
+    return 200, headers, body
+
+
+class AssetPipeline:
+    """Fichiers statiques chargés en mémoire, à noms à empreinte."""
+
+    def __init__(self, root: str, max_age: int):
+        self.root = root
+        self.max_age = max_age
+        # Nom d'origine → nom à empreinte, et nom servi → Asset
+        self._urls: Dict[str, str] = {}
+        self._assets: Dict[str, Asset] = {}
+
+    def build(self):
+        """Lit, empreinte et compresse tous les fichiers de `root`."""
+        urls: Dict[str, str] = {}
+        assets: Dict[str, Asset] = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                filename = os.path.relpath(path, self.root).replace(os.sep, "/")
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                with open(path, "rb") as f:
+                    asset = make_asset(f.read(), content_type)
+                stem, ext = os.path.splitext(filename)
+                fingerprinted = f"{stem}.{asset.digest}{ext}"
+                urls[filename] = fingerprinted
+                assets[filename] = assets[fingerprinted] = asset
+        self._urls, self._assets = urls, assets
+
+    def url_name(self, filename: str) -> str:
+        """Nom à utiliser dans les URL (à empreinte si le fichier est connu)."""
+        return self._urls.get(filename, filename)
+
+    def serve(self, filename: str, accept_encoding: Optional[str],
+              if_none_match: Optional[str]) -> Optional[StaticResponse]:
+        """Réponse pour un fichier statique, ou None s'il n'est pas en mémoire."""
+        asset = self._assets.get(filename)
+        if asset is None:
+            return None
+        match = _FINGERPRINT.match(filename)
+        if match is not None and match.group("digest") == asset.digest:
+            cache_control = f"public, max-age={self.max_age}, immutable"
+        else:
+            # Nom d'origine : le contenu peut changer au prochain déploiement
+            cache_control = "no-cache"
+        return serve_asset(asset, cache_control, accept_encoding, if_none_match)
+
+    def stats(self) -> Dict[str, int]:
+        """Taille des fichiers en mémoire, par encodage (octets)."""
+        totals: Dict[str, int] = {}
+        for filename, fingerprinted in self._urls.items():
+            for encoding, body in self._assets[fingerprinted].variants.items():
+                totals[encoding] = totals.get(encoding, 0) + len(body)
+        return {"files": len(self._urls), **totals}
+
+
+class PageCache:
+    """Pages rendues gardées par clé, tant que la version de configuration ne change pas."""
+
+    def __init__(self):
+        self._pages: Dict[str, Tuple[int, Asset]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, version: int, render: Callable[[], str]) -> Asset:
+        """Page en cache pour (clé, version), rendue par `render` si absente."""
+        cached = self._pages.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        asset = make_asset(render().encode("utf-8"), "text/html; charset=utf-8", fast=True)
+        with self._lock:
+            current = self._pages.get(key)
+            if current is None or current[0] <= version:
+                self._pages[key] = (version, asset)
+        return asset
+
+    def response(self, key: str, version: int, render: Callable[[], str]) -> Response:
+        """Réponse Flask pour une page en cache (revalidée par ETag à chaque visite)."""
+        status, headers, body = serve_asset(
+            self.get(key, version, render), "no-cache",
+            request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match")
+        )
+        return Response(body, status=status, headers=headers)
+
+
+# Fichiers statiques de l'application et pages rendues
+static_assets = AssetPipeline(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"), STATIC_MAX_AGE)
+page_cache = PageCache()
+
+
+def init_assets(app: Flask):
+    """Charge les fichiers statiques et remplace la route /static de Flask."""
+    static_assets.build()
+    fallback = app.view_functions["static"]
+
+    @app.url_defaults
+    def _fingerprint_static(endpoint: str, values: Dict[str, str]):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = static_assets.url_name(values["filename"])
+
+    def serve_static(filename: str):
+        result = static_assets.serve(
+            filename, request.headers.get("Accept-Encoding"), request.headers.get("If-None-Match")
+        )
+        if result is None:
+            return fallback(filename=filename)
+        status, headers, body = result
+        return Response(body, status=status, headers=headers)
+
+    app.view_functions["static"] = serve_static
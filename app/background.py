@@ -0,0 +1,90 @@
+"""
+background.py
+Tâches périodiques d'arrière-plan pour Hall - Flask Gateway.
+Chaque worker gunicorn démarre la tâche, mais un verrou fichier (flock)
+garantit qu'un seul worker à la fois l'exécute ; si ce worker s'arrête,
+le verrou est libéré par le noyau et un autre prend le relais.
+"""
+
+import fcntl
+import os
+import threading
+from typing import Callable, Optional
+
+
+class LeaderLock:
+    """Verrou exclusif non bloquant sur un fichier, gardé tant que le processus vit."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._pid = os.getpid()
+
+    def acquire(self) -> bool:
+        """Tente de prendre le verrou. Retourne True si ce processus est leader."""
+        if self._pid != os.getpid():
+            # Un descripteur hérité du parent ne vaut pas verrou pour l'enfant
+            self._fd = None
+            self._pid = os.getpid()
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Libère le verrou s'il est détenu."""
+        if self._fd is not None and self._pid == os.getpid():
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+
+class PeriodicTask:
+    """
+    Exécute `func` toutes les `interval` secondes dans un thread du worker,
+    uniquement si le verrou `lock_path` est obtenu (un seul worker actif).
+    """
+
+    def __init__(self, name: str, interval: float, func: Callable[[], object],
+                 lock_path: Optional[str] = None):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.lock = LeaderLock(lock_path) if lock_path else None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    def start(self):
+        """Démarre le thread (idempotent, sûr après un fork)."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+            self._stop = threading.Event()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                if self.lock is None or self.lock.acquire():
+                    self.func()
+            except Exception:
+                # Nouvel essai au prochain intervalle
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        """Arrête le thread et libère le verrou."""
+        self._stop.set()
+        if self.lock is not None:
+            self.lock.release()
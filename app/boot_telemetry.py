@@ -0,0 +1,185 @@
+"""
+boot_telemetry.py
+Mesure du temps de démarrage des serveurs pour Hall - Flask Gateway.
+Chaque réveil ouvre une trace (boot_events : WoL envoyé, premier ping,
+premier health check OK) ; les sondes du StatusProber la complètent. Les
+durées sont aussi cumulées dans des histogrammes compacts par domaine
+(boot_histograms, seaux logarithmiques), d'où sont tirés p50/p95/p99 sans
+parcourir les traces.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+from database import get_db
+from prober import status_prober, ProbeResult
+
+
+# Durée max d'une trace de démarrage (secondes) : au-delà, le réveil est considéré échoué
+BOOT_TRACE_TIMEOUT = float(os.environ.get("BOOT_TRACE_TIMEOUT", "1800"))
+
+# Seaux géométriques : la borne haute du seau n est BUCKET_BASE ** n (erreur relative ≤ 10 %)
+BUCKET_BASE = 1.1
+
+# Phases mesurées depuis l'envoi du WoL
+PHASES = ("ping", "healthy")
+
+
+def bucket_of(seconds: float) -> int:
+    """Seau d'une durée (le seau 0 regroupe tout ce qui est ≤ 1 s)."""
+    return max(0, math.ceil(math.log(max(seconds, 1.0), BUCKET_BASE) - 1e-9))
+
+
+def bucket_upper(bucket: int) -> float:
+    """Borne haute d'un seau, en secondes."""
+    return BUCKET_BASE ** bucket
+
+
+def percentile(histogram: Dict[int, int], q: float) -> Optional[float]:
+    """Quantile `q` (0..1) d'un histogramme {seau: effectif}, ou None s'il est vide."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for bucket in sorted(histogram):
+        cumulative += histogram[bucket]
+        if cumulative >= rank:
+            return round(bucket_upper(bucket), 1)
+    return round(bucket_upper(max(histogram)), 1)
+
+
+class BootTelemetry:
+    """
+    Enregistreur des traces de démarrage.
+
+    Les traces ouvertes sont gardées en cache et relues en base au plus une
+    fois par `refresh_interval` secondes, pour voir celles ouvertes par les
+    autres workers. Une phase n'est comptée qu'une fois (UPDATE conditionnel),
+    quel que soit le worker qui l'observe.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 trace_timeout: float, refresh_interval: float = 1.0):
+        self._connect = connect
+        self.trace_timeout = trace_timeout
+        self.refresh_interval = refresh_interval
+        self._open: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def wol_sent(self, domain: str):
+        """Ouvre une trace après un WoL (sauf si une trace récente est déjà en cours)."""
+        known = status_prober.fresh(domain)
+        if known is not None and known.server_online:
+            # Serveur déjà allumé : le démarrage n'est pas mesurable (ping immédiat)
+            return
+
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            row = conn.execute("""
+                SELECT id FROM boot_events
+                WHERE domain = ? AND healthy_at IS NULL AND wol_at > ?
+                ORDER BY wol_at DESC LIMIT 1
+            """, (domain, now - self.trace_timeout)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO boot_events (domain, wol_at) VALUES (?, ?)", (domain, now))
+        self._loaded_at = 0.0
+
+        # Les sondes doivent continuer pendant le démarrage, même sans visiteur,
+        # jusqu'au service prêt (fin de la trace)
+        status_prober.watch(domain, self.trace_timeout, until=lambda result: result.service_ready)
+
+    def _open_traces(self) -> Dict[str, Dict[str, Any]]:
+        if time.monotonic() - self._loaded_at < self.refresh_interval:
+            return self._open
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.refresh_interval:
+                return self._open
+            rows = self._connect().execute("""
+                SELECT id, domain, wol_at, ping_at FROM boot_events
+                WHERE healthy_at IS NULL AND wol_at > ?
+                ORDER BY wol_at
+            """, (time.time() - self.trace_timeout,)).fetchall()
+            self._open = {row["domain"]: dict(row) for row in rows}
+            self._loaded_at = time.monotonic()
+            return self._open
+
+    def observe(self, domain: str, result: ProbeResult):
+        """Complète la trace ouverte d'un domaine avec le résultat d'une sonde."""
+        if not result.server_online:
+            return
+        trace = self._open_traces().get(domain)
+        if trace is None:
+            return
+
+        now = time.time()
+        phases = []
+        if trace["ping_at"] is None:
+            phases.append("ping")
+        if result.service_ready:
+            phases.append("healthy")
+        if phases:
+            self._record(trace, phases, now)
+
+    def _record(self, trace: Dict[str, Any], phases: List[str], now: float):
+        conn = self._connect()
+        with conn:
+            for phase in phases:
+                cursor = conn.execute(
+                    f"UPDATE boot_events SET {phase}_at = ? WHERE id = ? AND {phase}_at IS NULL",
+                    (now, trace["id"])
+                )
+                if cursor.rowcount:
+                    conn.execute("""
+                        INSERT INTO boot_histograms (domain, phase, bucket, count) VALUES (?, ?, ?, 1)
+                        ON CONFLICT(domain, phase, bucket) DO UPDATE SET count = count + 1
+                    """, (trace["domain"], phase, bucket_of(now - trace["wol_at"])))
+        trace["ping_at"] = trace["ping_at"] or now
+        if "healthy" in phases:
+            with self._lock:
+                self._open.pop(trace["domain"], None)
+
+    def histograms(self, domain: Optional[str] = None) -> Dict[str, Dict[str, Dict[int, int]]]:
+        """Histogrammes {domaine: {phase: {seau: effectif}}}."""
+        conn = self._connect()
+        if domain is None:
+            rows = conn.execute("SELECT domain, phase, bucket, count FROM boot_histograms").fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT domain, phase, bucket, count FROM boot_histograms WHERE domain = ?", (domain,)
+            ).fetchall()
+        result: Dict[str, Dict[str, Dict[int, int]]] = {}
+        for row in rows:
+            result.setdefault(row["domain"], {}).setdefault(row["phase"], {})[row["bucket"]] = row["count"]
+        return result
+
+    def stats(self, domain: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """p50/p95/p99 (secondes depuis le WoL) par domaine et par phase."""
+        return {
+            name: {
+                phase: {
+                    "count": sum(histogram.values()),
+                    "p50": percentile(histogram, 0.50),
+                    "p95": percentile(histogram, 0.95),
+                    "p99": percentile(histogram, 0.99),
+                }
+                for phase, histogram in phases.items()
+            }
+            for name, phases in self.histograms(domain).items()
+        }
+
+    def estimate(self, domain: str, q: float = 0.95) -> Optional[float]:
+        """Temps de démarrage jusqu'au service prêt (quantile q), ou None sans mesure."""
+        histogram = self.histograms(domain).get(domain, {}).get("healthy", {})
+        return percentile(histogram, q)
+
+
+# Enregistreur partagé, alimenté par les sondes du StatusProber
+boot_telemetry = BootTelemetry(get_db, BOOT_TRACE_TIMEOUT)
+status_prober.observers.append(boot_telemetry.observe)
@@ -1,53 +1,286 @@
 """
 config.py
 Gestion de la configuration pour Hall - Flask Gateway.
-Chargement et cache du fichier domains.json.
+Chargement et cache du fichier domains.json, compilé en un snapshot immuable
+(listes d'IPs et plannings pré-compilés).
+
+Un fichier illisible garde le snapshot précédent ; un domaine invalide
+(planning, IP...) garde ses réglages précédents, ou est écarté s'il n'en a
+pas. L'erreur est loggée et listée dans `ConfigSnapshot.errors`.
 """
 
 import os
 import json
-from typing import Dict, Any, Optional
-from pathlib import Path
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional
+
+from flask import g, has_app_context
+
+from ipmatch import IPMatcher
+from schedule import CompiledSchedule, compile_schedule
+from shared_state import shared_state
 
 
 # Variables d'environnement
 CONFIG_PATH = os.environ.get("CONFIG_PATH", "/app/config/domains.json")
 TESTING_SERVER_IP = os.environ.get("TESTING_SERVER_IP", "")
 PROXY_TIMEOUT = 30.0
+PROXY_CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", str(64 * 1024)))
+PROXY_MAX_CONNECTIONS = int(os.environ.get("PROXY_MAX_CONNECTIONS", "20"))
+PROXY_MAX_KEEPALIVE = int(os.environ.get("PROXY_MAX_KEEPALIVE", "10"))
+PROXY_KEEPALIVE_EXPIRY = float(os.environ.get("PROXY_KEEPALIVE_EXPIRY", "30"))
+# Flux SSE simultanés par worker en mode sync (chacun occupe un thread) :
+# par défaut tous les threads du worker (HALL_THREADS) sauf deux, gardés
+# pour les requêtes courtes (wake, activité, polling)
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS") or max(int(os.environ.get("HALL_THREADS", "8")) - 2, 1))
+
+# Intervalle minimal entre deux vérifications de la date de modification de domains.json
+CONFIG_CHECK_INTERVAL = float(os.environ.get("CONFIG_CHECK_INTERVAL", "1"))
+
+# Délai d'inactivité par défaut selon le type de politique (minutes)
+_DEFAULT_IDLE_TIMEOUT = {"scheduled": 60, "on_demand": 20}
+
+# Logger de l'application Flask (app.py) : les erreurs de configuration y sont écrites
+logger = logging.getLogger("app")
+
+
+# ============================================
+# CONFIGURATION COMPILÉE
+# ============================================
+
+@dataclass(frozen=True)
+class DomainSettings:
+    """Réglages typés d'un domaine, calculés une fois par version du fichier."""
+    name: str
+    raw: Mapping[str, Any]  # Section brute du domaine (lecture seule)
+    policy_type: str
+    idle_timeout_minutes: int
+    wol_enabled: bool
+    prewake: bool  # Réveil anticipé avant chaque plage (scheduled)
+    prewake_lead_minutes: Optional[int]  # None : valeur globale
+    auto_shutdown: bool  # Extinction automatique après inactivité (voir reaper.py)
+    shutdown_endpoint: Optional[Mapping[str, Any]]
+    server_ip: Optional[str]
+    mac: Optional[str]
+    redirect_url: Optional[str]
+    health_check: Optional[str]
+    allowed_ips: Optional[IPMatcher]  # None : toutes les IPs sont autorisées
+    denied_ips: Optional[IPMatcher]  # Prioritaire sur allowed_ips
+    schedule: Optional[CompiledSchedule]
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Configuration compilée et immuable (une instance par version du fichier).
+    `version` change à chaque rechargement et peut servir de clé de cache.
+    """
+    version: int
+    raw: Mapping[str, Any]  # Contenu brut de domains.json (lecture seule)
+    global_config: Mapping[str, Any]
+    domains: Mapping[str, DomainSettings]
+    errors: Mapping[str, str]  # Domaine → erreur de compilation (réglages précédents gardés)
+
+    def domain(self, name: str) -> Optional[DomainSettings]:
+        """Réglages d'un domaine, ou None s'il n'est pas configuré."""
+        return self.domains.get(name)
+
+
+def _freeze(value: Any) -> Any:
+    """Copie en lecture seule d'une valeur JSON (dict → MappingProxyType, list → tuple)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def to_plain(value: Any) -> Any:
+    """Copie modifiable (dict, list) d'une valeur du snapshot, par exemple pour jsonify."""
+    if isinstance(value, Mapping):
+        return {key: to_plain(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [to_plain(item) for item in value]
+    return value
+
+
+def _compile_ips(prefixes: Optional[List[str]]) -> Optional[IPMatcher]:
+    """
+    Compile une liste d'IPs / CIDR (None si la liste est absente ou vide).
+
+    :raises ValueError: si une entrée est invalide (le domaine est alors rejeté)
+    """
+    if not prefixes:
+        return None
+    matcher = IPMatcher(prefixes)
+    if matcher.invalid:
+        raise ValueError(f"IP / CIDR invalide(s): {', '.join(map(repr, matcher.invalid))}")
+    return matcher
+
+
+def _compile_domain(name: str, raw: Mapping[str, Any]) -> DomainSettings:
+    policy = raw.get("policy", {})
+    policy_type = policy.get("type", "on_demand")
+    redirect_config = raw.get("redirect", {})
+    server = raw.get("server", {})
+    security = raw.get("security", {})
+
+    schedule = None
+    if policy_type == "scheduled":
+        schedule = compile_schedule(policy.get("schedule", {}))
+
+    return DomainSettings(
+        name=name,
+        raw=raw,
+        policy_type=policy_type,
+        idle_timeout_minutes=policy.get(
+            "idle_timeout_minutes", _DEFAULT_IDLE_TIMEOUT.get(policy_type, 20)
+        ),
+        wol_enabled=policy.get("wol_enabled", True),
+        prewake=policy.get("prewake", True),
+        prewake_lead_minutes=policy.get("prewake_lead_minutes"),
+        auto_shutdown=policy.get("auto_shutdown", False),
+        shutdown_endpoint=raw.get("shutdown_endpoint") or None,
+        server_ip=server.get("ip"),
+        mac=server.get("mac"),
+        redirect_url=redirect_config.get("url"),
+        health_check=redirect_config.get("health_check"),
+        allowed_ips=_compile_ips(security.get("allowed_ips")),
+        denied_ips=_compile_ips(security.get("denied_ips")),
+        schedule=schedule,
+    )
+
+
+def compile_config(raw: Dict[str, Any], version: int,
+                   previous: Optional[ConfigSnapshot] = None) -> ConfigSnapshot:
+    """
+    Construit le snapshot compilé d'un contenu de domains.json.
+    Chaque domaine est compilé séparément : en cas d'erreur, il garde ses
+    réglages de `previous` (ou est écarté) sans affecter les autres.
+    """
+    frozen = _freeze(raw)
+    domains: Dict[str, DomainSettings] = {}
+    errors: Dict[str, str] = {}
+    for name, domain_raw in frozen.get("domains", {}).items():
+        try:
+            domains[name] = _compile_domain(name, domain_raw)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+            kept = previous.domain(name) if previous is not None else None
+            if kept is not None:
+                domains[name] = kept
+            logger.error(
+                f"Configuration invalide pour {name} ({errors[name]}) : "
+                + ("réglages précédents conservés" if kept is not None else "domaine ignoré")
+            )
+    return ConfigSnapshot(
+        version=version,
+        raw=frozen,
+        global_config=frozen.get("global", MappingProxyType({})),
+        domains=MappingProxyType(domains),
+        errors=MappingProxyType(errors),
+    )
+
+
+# Snapshot courant et état de la vérification du fichier
+_snapshot: Optional[ConfigSnapshot] = None
+_config_mtime: Optional[int] = None
+_checked_at = 0.0
+# Génération partagée vue au dernier chargement (voir shared_state.py)
+_generation = 0
+_snapshot_lock = threading.Lock()
+
+
+def checked_snapshot() -> Optional[ConfigSnapshot]:
+    """
+    Snapshot courant s'il a été vérifié il y a moins de CONFIG_CHECK_INTERVAL
+    secondes, sans aucun accès disque ; None s'il faut passer par get_snapshot().
+    """
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _checked_at < CONFIG_CHECK_INTERVAL:
+        return snapshot
+    return None
+
+
+def get_snapshot(force_reload: bool = False) -> ConfigSnapshot:
+    """
+    Retourne le snapshot de configuration courant.
+    Le fichier n'est stat() qu'au plus une fois par CONFIG_CHECK_INTERVAL
+    secondes, et recompilé seulement si sa date de modification a changé.
+    Un rechargement forcé incrémente la génération partagée : les autres
+    workers rechargent à leur prochaine vérification.
+    """
+    global _snapshot, _config_mtime, _checked_at, _generation
+
+    snapshot = checked_snapshot()
+    if not force_reload and snapshot is not None:
+        return snapshot
+
+    with _snapshot_lock:
+        try:
+            current_mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Configuration non trouvée: {CONFIG_PATH}") from None
 
-# Cache de la configuration
-_config_cache: Dict[str, Any] | None = None
-_config_mtime: float | None = None
+        if force_reload:
+            _generation = shared_state.bump_config_generation()
+        else:
+            generation = shared_state.config_generation()
+            force_reload = generation != _generation
+            _generation = generation
 
+        if force_reload or _snapshot is None or _config_mtime != current_mtime:
+            try:
+                with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+            except (OSError, ValueError) as e:
+                if _snapshot is None:
+                    raise
+                # Fichier en cours d'écriture ou invalide : le snapshot précédent reste en place
+                logger.error(f"Configuration illisible ({CONFIG_PATH}: {e}) : configuration précédente conservée")
+            else:
+                version = _snapshot.version + 1 if _snapshot is not None else 1
+                _snapshot = compile_config(raw, version, _snapshot)
+            _config_mtime = current_mtime
+        _checked_at = time.monotonic()
+        return _snapshot
 
-def load_config(force_reload: bool = False) -> Dict[str, Any]:
-    """Charge la configuration depuis le fichier JSON avec cache."""
-    global _config_cache, _config_mtime
 
-    config_path = Path(CONFIG_PATH)
-    if not config_path.exists():
-        raise FileNotFoundError(f"Configuration non trouvée: {CONFIG_PATH}")
+def current_config() -> ConfigSnapshot:
+    """
+    Snapshot utilisé par la requête en cours : lu une seule fois par requête
+    (mis en cache dans flask.g), pour que toute la requête voie la même version.
+    """
+    if not has_app_context():
+        return get_snapshot()
+    snapshot = g.get("hall_config")
+    if snapshot is None:
+        snapshot = g.hall_config = get_snapshot()
+    return snapshot
 
-    current_mtime = config_path.stat().st_mtime
 
-    if force_reload or _config_cache is None or _config_mtime != current_mtime:
-        with open(config_path, "r", encoding="utf-8") as f:
-            _config_cache = json.load(f)
-        _config_mtime = current_mtime
+def load_config(force_reload: bool = False) -> Mapping[str, Any]:
+    """Charge la configuration depuis le fichier JSON avec cache (contenu brut, lecture seule)."""
+    if force_reload:
+        return get_snapshot(force_reload=True).raw
+    return current_config().raw
 
-    if _config_cache is None:
-        raise ValueError("Échec du chargement de la configuration")
 
-    return _config_cache
+def get_domain_settings(domain: str) -> Optional[DomainSettings]:
+    """Récupère les réglages compilés d'un domaine."""
+    return current_config().domain(domain)
 
 
-def get_domain_config(domain: str) -> Optional[Dict[str, Any]]:
+def get_domain_config(domain: str) -> Optional[Mapping[str, Any]]:
     """Récupère la configuration d'un domaine."""
-    config = load_config()
-    return config.get("domains", {}).get(domain)
+    settings = current_config().domain(domain)
+    return settings.raw if settings else None
 
 
-def get_global_config() -> Dict[str, Any]:
+def get_global_config() -> Mapping[str, Any]:
     """Récupère la configuration globale."""
-    config = load_config()
-    return config.get("global", {})
+    return current_config().global_config
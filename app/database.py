@@ -3,30 +3,172 @@ database.py
 Fonctions liées à la base de données SQLite pour Hall - Flask Gateway.
 """
 
+import atexit
 import os
 import sqlite3
+import threading
+import time
 from typing import Dict, Any, List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-from flask import request
+from flask import request, has_request_context
+
+from background import PeriodicTask
+from db_writers import ActivityRecorder, AuditLogWriter
+from metrics import DB_QUERY_LATENCY, query_label
+from project_registry import ProjectRegistry, bump_generation
+from shared_state import shared_state
 
 
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "/data/hall.db")
 
-# Cache de l'activité
-_activity_cache: Dict[str, datetime] = {}
+# Réglages SQLite
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+# Intervalle d'écriture différée de l'activité (secondes)
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", "5"))
+
+# Pipeline d'écriture des journaux
+AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "1"))
+
+# Rétention des journaux (0 = conservation illimitée)
+LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", "90"))
+LOG_RETENTION_BATCH = int(os.environ.get("LOG_RETENTION_BATCH", "1000"))
+LOG_RETENTION_INTERVAL = float(os.environ.get("LOG_RETENTION_INTERVAL", "3600"))
+
+# Intervalle de vérification de la génération des projets testing (secondes)
+TESTING_REGISTRY_CHECK_INTERVAL = float(os.environ.get("TESTING_REGISTRY_CHECK_INTERVAL", "1"))
+
+# Connexion persistante par thread (et par processus, en cas de fork)
+_local = threading.local()
+
+# Statistiques de durée des requêtes SQL (par worker)
+_query_stats: Dict[str, Dict[str, float]] = {}
+_query_stats_lock = threading.Lock()
+
+
+def _record_query(sql: str, duration: float):
+    """Enregistre la durée d'exécution d'une requête SQL."""
+    key = " ".join(sql.split())[:80]
+    with _query_stats_lock:
+        stats = _query_stats.get(key)
+        if stats is None:
+            stats = _query_stats[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+        duration_ms = duration * 1000
+        stats["count"] += 1
+        stats["total_ms"] += duration_ms
+        stats["max_ms"] = max(stats["max_ms"], duration_ms)
+    DB_QUERY_LATENCY.labels(query_label(sql)).observe(duration)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connexion SQLite qui mesure chaque execute/executemany.
+    Pour un SELECT, seule la première étape est mesurée (le reste du
+    parcours a lieu au fetch).
+    """
+
+    def execute(self, sql, parameters=(), /):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters, /):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        factory=TimedConnection
+    )
+    conn.row_factory = sqlite3.Row
+    # WAL : les lecteurs ne bloquent plus les écrivains (et inversement)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
 
 
-def get_db():
-    """Connexion à la base de données SQLite."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+def get_db() -> sqlite3.Connection:
+    """
+    Connexion persistante du thread courant à la base SQLite.
+    Ne pas la fermer : les écritures utilisent `with conn:` (commit/rollback).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
     return conn
 
 
+def close_db():
+    """Ferme la connexion du thread courant (arrêt du worker, tests)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# Activité en mémoire, écrite par lots (write-behind)
+activity_recorder = ActivityRecorder(get_db, ACTIVITY_FLUSH_INTERVAL)
+
+# Projets testing en mémoire, rechargés quand la génération change
+testing_registry = ProjectRegistry(get_db, TESTING_REGISTRY_CHECK_INTERVAL)
+
+# Journaux (logs, testing_access_logs) écrits par lots en arrière-plan
+audit_writer = AuditLogWriter(get_db, AUDIT_QUEUE_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL)
+
+
+def flush_pending_writes():
+    """Écrit les données en attente (à appeler à l'arrêt du worker)."""
+    activity_recorder.stop()
+    audit_writer.stop()
+
+
+atexit.register(flush_pending_writes)
+
+
+def get_query_stats() -> List[Dict[str, Any]]:
+    """Durées des requêtes SQL du worker courant, les plus coûteuses d'abord."""
+    with _query_stats_lock:
+        stats = [
+            {
+                "query": query,
+                "count": int(s["count"]),
+                "total_ms": round(s["total_ms"], 3),
+                "avg_ms": round(s["total_ms"] / s["count"], 3),
+                "max_ms": round(s["max_ms"], 3),
+            }
+            for query, s in _query_stats.items()
+        ]
+    return sorted(stats, key=lambda s: s["total_ms"], reverse=True)
+
+
 def init_db():
     """Initialisation de la base de données."""
     conn = get_db()
+    with conn:
+        _create_tables(conn)
+
+
+def _create_tables(conn: sqlite3.Connection):
+    """Création des tables (idempotente)."""
     conn.execute("""
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -61,6 +203,9 @@ def init_db():
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Cache des réponses proxy (voir response_cache.py) : activation et génération (purge)
+    _add_column(conn, "testing_projects", "response_cache", "INTEGER DEFAULT 0")
+    _add_column(conn, "testing_projects", "cache_generation", "INTEGER DEFAULT 0")
     # Table pour les logs d'accès testing
     conn.execute("""
         CREATE TABLE IF NOT EXISTS testing_access_logs (
@@ -71,50 +216,112 @@ def init_db():
             action TEXT NOT NULL
         )
     """)
-    conn.commit()
-    conn.close()
+    # Métadonnées partagées entre workers (compteurs de génération)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    """)
+
+    # Traces de démarrage (horodatages epoch) et histogrammes de durées
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS boot_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain TEXT NOT NULL,
+            wol_at REAL NOT NULL,
+            ping_at REAL,
+            healthy_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_boot_events_domain_wol ON boot_events (domain, wol_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS boot_histograms (
+            domain TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (domain, phase, bucket)
+        )
+    """)
+    # Index pour la purge (par date) et la pagination filtrée (par id, comme le tri)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)")
+    conn.execute("DROP INDEX IF EXISTS idx_logs_domain_timestamp")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_domain_id ON logs (domain, id)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_testing_access_logs_timestamp "
+        "ON testing_access_logs (timestamp)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_testing_access_logs_project_timestamp")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_testing_access_logs_project_id "
+        "ON testing_access_logs (project_name, id)"
+    )
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Ajoute une colonne à une table existante si elle manque (base créée avant son ajout)."""
+    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
 
 def update_activity(domain: str):
-    """Met à jour le timestamp de dernière activité."""
-    global _activity_cache
+    """
+    Met à jour le timestamp de dernière activité.
+    Visible immédiatement par tous les workers (état partagé) ; l'écriture
+    en base est différée (voir ActivityRecorder).
+    """
     now = datetime.now()
-    _activity_cache[domain] = now
-
-    conn = get_db()
-    conn.execute("""
-        INSERT INTO activity (domain, last_activity) VALUES (?, ?)
-        ON CONFLICT(domain) DO UPDATE SET last_activity = ?
-    """, (domain, now, now))
-    conn.commit()
-    conn.close()
+    shared_state.record_activity(domain, now.timestamp())
+    activity_recorder.record(domain, now)
 
 
 def get_last_activity(domain: str) -> Optional[datetime]:
-    """Récupère la dernière activité d'un domaine."""
-    if domain in _activity_cache:
-        return _activity_cache[domain]
+    """Récupère la dernière activité d'un domaine, tous workers confondus."""
+    shared = shared_state.activity(domain)
+    if shared is not None:
+        return datetime.fromtimestamp(shared)
+    last_activity = activity_recorder.get(domain)
+    if last_activity is not None:
+        return last_activity
 
     conn = get_db()
     row = conn.execute(
         "SELECT last_activity FROM activity WHERE domain = ?", (domain,)
     ).fetchone()
-    conn.close()
 
     if row:
-        return datetime.fromisoformat(row["last_activity"])
+        last_activity = datetime.fromisoformat(row["last_activity"])
+        activity_recorder.remember(domain, last_activity)
+        shared_state.record_activity(domain, last_activity.timestamp())
+        return last_activity
     return None
 
 
+def recent_activity() -> Dict[str, datetime]:
+    """
+    Activités pas forcément encore écrites en base : celles de tous les
+    workers (état partagé) et celles de ce worker.
+    """
+    latest = activity_recorder.snapshot()
+    for domain, timestamp in shared_state.activities().items():
+        when = datetime.fromtimestamp(timestamp)
+        if when > latest.get(domain, datetime.min):
+            latest[domain] = when
+    return latest
+
+
 def update_wol_activity(domain: str):
     """Met à jour le compteur WoL et le timestamp."""
+    now = datetime.now()
     conn = get_db()
-    conn.execute("""
-        UPDATE activity SET last_wol = ?, boot_count = boot_count + 1
-        WHERE domain = ?
-    """, (datetime.now(), domain))
-    conn.commit()
-    conn.close()
+    with conn:
+        # La ligne d'activité peut ne pas encore être écrite (write-behind)
+        conn.execute("""
+            INSERT INTO activity (domain, last_activity, last_wol, boot_count) VALUES (?, ?, ?, 1)
+            ON CONFLICT(domain) DO UPDATE SET last_wol = excluded.last_wol, boot_count = boot_count + 1
+        """, (domain, now, now))
 
 
 # ============================================
@@ -122,109 +329,207 @@ def update_wol_activity(domain: str):
 # ============================================
 
 def get_testing_project(name: str) -> Optional[Dict[str, Any]]:
-    """Récupère un projet testing par son nom."""
-    conn = get_db()
-    row = conn.execute(
-        "SELECT * FROM testing_projects WHERE name = ? AND active = 1", (name,)
-    ).fetchone()
-    conn.close()
-    if row:
-        return dict(row)
-    return None
+    """Récupère un projet testing actif par son nom (depuis le registre en mémoire)."""
+    return testing_registry.get(name)
 
 
 def get_all_testing_projects() -> List[Dict[str, Any]]:
-    """Récupère tous les projets testing."""
-    conn = get_db()
-    rows = conn.execute(
-        "SELECT * FROM testing_projects ORDER BY name"
-    ).fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    """Récupère tous les projets testing (depuis le registre en mémoire)."""
+    return testing_registry.all()
 
 
-def log_testing_access(project_name: str, action: str):
-    """Log un accès à un projet testing."""
-    client_ip = request.remote_addr if request else None
-    conn = get_db()
-    conn.execute(
-        "INSERT INTO testing_access_logs (project_name, client_ip, action) VALUES (?, ?, ?)",
-        (project_name, client_ip, action)
+def _log_timestamp() -> str:
+    """Horodatage au format de CURRENT_TIMESTAMP (UTC), pris à la mise en file."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _request_ip(client_ip: Optional[str]) -> Optional[str]:
+    if client_ip is None and has_request_context():
+        return request.remote_addr
+    return client_ip
+
+
+def log_testing_access(project_name: str, action: str, client_ip: Optional[str] = None):
+    """
+    Log un accès à un projet testing (IP client déduite de la requête Flask si absente).
+    L'insertion est faite par lots en arrière-plan (voir AuditLogWriter).
+    """
+    audit_writer.write(
+        "testing_access_logs",
+        (_log_timestamp(), project_name, _request_ip(client_ip), action)
     )
-    conn.commit()
-    conn.close()
 
 
-def get_recent_logs(limit: int = 100) -> List[Dict[str, Any]]:
-    """Récupère les logs récents."""
-    conn = get_db()
-    logs = conn.execute(
-        "SELECT * FROM logs ORDER BY timestamp DESC LIMIT ?", (limit,)
-    ).fetchall()
-    conn.close()
-    return [dict(log) for log in logs]
+def log_action(domain: str, action: str, status: Optional[str] = None,
+               details: Optional[str] = None, client_ip: Optional[str] = None):
+    """
+    Ajoute une entrée dans la table logs (tableau de bord admin).
+    L'insertion est faite par lots en arrière-plan (voir AuditLogWriter).
+    """
+    audit_writer.write(
+        "logs",
+        (_log_timestamp(), domain, action, status, details, _request_ip(client_ip))
+    )
+
+
+def get_recent_logs(limit: int = 100, before_id: Optional[int] = None,
+                    domain: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Récupère les logs récents, du plus récent au plus ancien (d'un seul domaine si précisé).
+    Pagination par clé : `before_id` est l'id du dernier log de la page précédente.
+    """
+    return _keyset_page("logs", limit, before_id, "domain", domain)
 
 
 def get_all_activity() -> List[Dict[str, Any]]:
     """Récupère toutes les activités."""
     conn = get_db()
-    activity = conn.execute("SELECT * FROM activity").fetchall()
-    conn.close()
-    return [dict(a) for a in activity]
+    activity = {a["domain"]: dict(a) for a in conn.execute("SELECT * FROM activity").fetchall()}
+
+    # Les activités en mémoire, pas encore écrites, sont plus récentes
+    for domain, last_activity in recent_activity().items():
+        row = activity.setdefault(domain, {"domain": domain, "last_wol": None, "boot_count": 0})
+        if str(last_activity) > str(row.get("last_activity") or ""):
+            row["last_activity"] = str(last_activity)
+    return list(activity.values())
+
+
+def get_testing_access_logs(limit: int = 50, before_id: Optional[int] = None,
+                            project_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Récupère les logs d'accès testing récents (même pagination que get_recent_logs)."""
+    return _keyset_page("testing_access_logs", limit, before_id, "project_name", project_name)
+
+
+def _keyset_page(table: str, limit: int, before_id: Optional[int],
+                 column: str, value: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Page de journaux triée par id décroissant (ordre d'insertion), sans OFFSET.
+    Le filtre éventuel sur `column` suit l'index (column, id) : pas de tri en mémoire.
+    """
+    clauses, params = [], []
+    if value is not None:
+        clauses.append(f"{column} = ?")
+        params.append(value)
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = get_db().execute(
+        f"SELECT * FROM {table}{where} ORDER BY id DESC LIMIT ?", (*params, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
 
 
-def get_testing_access_logs(limit: int = 50) -> List[Dict[str, Any]]:
-    """Récupère les logs d'accès testing récents."""
+# ============================================
+# RÉTENTION DES JOURNAUX
+# ============================================
+
+def purge_old_logs(days: int = LOG_RETENTION_DAYS,
+                   batch_size: int = LOG_RETENTION_BATCH) -> Dict[str, int]:
+    """
+    Supprime les journaux plus anciens que `days` jours.
+    La suppression se fait par lots de `batch_size` lignes, chacun dans sa
+    propre transaction courte, pour ne pas bloquer les autres écritures.
+    Retourne le nombre de lignes supprimées par table.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
     conn = get_db()
-    logs = conn.execute(
-        "SELECT * FROM testing_access_logs ORDER BY timestamp DESC LIMIT ?", (limit,)
-    ).fetchall()
-    conn.close()
-    return [dict(log) for log in logs]
+    deleted = {}
+    for table in ("logs", "testing_access_logs"):
+        deleted[table] = 0
+        while True:
+            with conn:
+                cursor = conn.execute(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"SELECT id FROM {table} WHERE timestamp < ? ORDER BY timestamp LIMIT ?)",
+                    (cutoff, batch_size)
+                )
+            deleted[table] += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+            # Laisse passer les écritures des autres threads entre deux lots
+            time.sleep(0.05)
+    return deleted
+
+
+# Purge périodique, exécutée par un seul worker (verrou fichier)
+log_retention = PeriodicTask(
+    "log-retention",
+    LOG_RETENTION_INTERVAL,
+    purge_old_logs,
+    lock_path=os.path.join(os.path.dirname(DATABASE_PATH) or ".", "hall-retention.lock")
+)
+
+
+def start_log_retention():
+    """Démarre la purge périodique des journaux si une rétention est configurée."""
+    if LOG_RETENTION_DAYS > 0:
+        log_retention.start()
 
 
 def create_testing_project(name: str, display_name: str, port: int, password_hash: str,
-                           description: str, health_check_path: str) -> bool:
+                           description: str, health_check_path: str, response_cache: bool = False) -> bool:
     """Crée un nouveau projet testing."""
     conn = get_db()
     try:
-        conn.execute("""
-            INSERT INTO testing_projects (name, display_name, port, password_hash, description, health_check_path)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (name, display_name, port, password_hash, description, health_check_path))
-        conn.commit()
-        return True
+        with conn:
+            conn.execute("""
+                INSERT INTO testing_projects (name, display_name, port, password_hash, description,
+                                              health_check_path, response_cache)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (name, display_name, port, password_hash, description, health_check_path,
+                  1 if response_cache else 0))
+            bump_generation(conn)
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
+    testing_registry.invalidate()
+    return True
 
 
 def update_testing_project(name: str, display_name: str, port: int, description: str,
-                           health_check_path: str, active: bool, password_hash: Optional[str] = None):
+                           health_check_path: str, active: bool, password_hash: Optional[str] = None,
+                           response_cache: bool = False):
     """Met à jour un projet testing."""
     conn = get_db()
-    if password_hash:
-        conn.execute("""
-            UPDATE testing_projects 
-            SET display_name = ?, port = ?, password_hash = ?, description = ?, 
-                health_check_path = ?, active = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE name = ?
-        """, (display_name, port, password_hash, description, health_check_path, 1 if active else 0, name))
-    else:
-        conn.execute("""
-            UPDATE testing_projects 
-            SET display_name = ?, port = ?, description = ?, 
-                health_check_path = ?, active = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE name = ?
-        """, (display_name, port, description, health_check_path, 1 if active else 0, name))
-    conn.commit()
-    conn.close()
+    with conn:
+        if password_hash:
+            conn.execute("""
+                UPDATE testing_projects 
+                SET display_name = ?, port = ?, password_hash = ?, description = ?, 
+                    health_check_path = ?, active = ?, response_cache = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE name = ?
+            """, (display_name, port, password_hash, description, health_check_path, 1 if active else 0,
+                  1 if response_cache else 0, name))
+        else:
+            conn.execute("""
+                UPDATE testing_projects 
+                SET display_name = ?, port = ?, description = ?, 
+                    health_check_path = ?, active = ?, response_cache = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE name = ?
+            """, (display_name, port, description, health_check_path, 1 if active else 0,
+                  1 if response_cache else 0, name))
+        bump_generation(conn)
+    testing_registry.invalidate()
+
+
+def purge_testing_cache(name: str):
+    """
+    Invalide le cache des réponses proxy d'un projet dans tous les workers
+    (nouvelle génération, vue au prochain rechargement du registre).
+    """
+    conn = get_db()
+    with conn:
+        conn.execute(
+            "UPDATE testing_projects SET cache_generation = cache_generation + 1 WHERE name = ?", (name,)
+        )
+        bump_generation(conn)
+    testing_registry.invalidate()
 
 
 def delete_testing_project(name: str):
     """Supprime un projet testing."""
     conn = get_db()
-    conn.execute("DELETE FROM testing_projects WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("DELETE FROM testing_projects WHERE name = ?", (name,))
+        bump_generation(conn)
+    testing_registry.invalidate()
@@ -0,0 +1,221 @@
+"""
+db_writers.py
+Écritures différées en base SQLite pour Hall - Flask Gateway.
+Sortent les écritures du chemin des requêtes : les données sont gardées en
+mémoire puis écrites par lots, en une transaction, par un thread d'arrière-plan.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+
+class ActivityRecorder:
+    """
+    Enregistreur d'activité à écriture différée (write-behind).
+
+    Garde en mémoire le dernier timestamp d'activité de chaque domaine et
+    écrit tous les domaines modifiés en une seule transaction toutes les
+    `flush_interval` secondes, ainsi qu'à l'arrêt. Au plus un intervalle
+    d'activité peut être perdu en cas d'arrêt brutal.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], flush_interval: float):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self._latest: Dict[str, datetime] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    def record(self, domain: str, when: datetime):
+        """Enregistre une activité (mémoire uniquement, écrite au prochain flush)."""
+        with self._lock:
+            previous = self._latest.get(domain)
+            if previous is None or when > previous:
+                self._latest[domain] = when
+                self._dirty.add(domain)
+        self._ensure_started()
+
+    def get(self, domain: str) -> Optional[datetime]:
+        """Dernière activité connue en mémoire pour ce domaine."""
+        return self._latest.get(domain)
+
+    def remember(self, domain: str, when: datetime):
+        """Mémorise une valeur lue en base, sans la marquer à écrire."""
+        with self._lock:
+            previous = self._latest.get(domain)
+            if previous is None or when > previous:
+                self._latest[domain] = when
+
+    def snapshot(self) -> Dict[str, datetime]:
+        """Copie des dernières activités connues en mémoire."""
+        with self._lock:
+            return dict(self._latest)
+
+    def flush(self):
+        """Écrit tous les domaines modifiés en une transaction."""
+        with self._lock:
+            pending = {domain: self._latest[domain] for domain in self._dirty}
+            self._dirty.clear()
+        if not pending:
+            return
+
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany("""
+                    INSERT INTO activity (domain, last_activity) VALUES (?, ?)
+                    ON CONFLICT(domain) DO UPDATE SET last_activity = excluded.last_activity
+                    WHERE excluded.last_activity > activity.last_activity
+                """, list(pending.items()))
+        except sqlite3.Error:
+            # Nouvel essai au prochain flush
+            with self._lock:
+                self._dirty.update(pending)
+            raise
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            # Après un fork, le thread du parent n'existe pas dans l'enfant
+            self._pid = os.getpid()
+            self._thread = None
+            self._stop = threading.Event()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="activity-recorder", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def stop(self):
+        """Arrête le thread et écrit les activités en attente."""
+        self._stop.set()
+        self.flush()
+
+
+class AuditLogWriter:
+    """
+    Pipeline d'écriture des journaux (tables logs et testing_access_logs).
+
+    Les lignes sont déposées dans une file bornée sans attendre ; un thread
+    les insère par lots avec executemany, en une transaction par lot. File
+    pleine : la ligne est abandonnée et comptée (jamais d'attente dans le
+    chemin de la requête).
+    """
+
+    COLUMNS = {
+        "logs": ("timestamp", "domain", "action", "status", "details", "client_ip"),
+        "testing_access_logs": ("timestamp", "project_name", "client_ip", "action"),
+    }
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_queue: int,
+                 batch_size: int, flush_interval: float):
+        self._connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[tuple[str, tuple]]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self._counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def write(self, table: str, row: tuple) -> bool:
+        """Dépose une ligne à insérer. Retourne False si elle a été abandonnée."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Compteurs du pipeline (worker courant)."""
+        with self._lock:
+            return dict(self._counters, queued=self._queue.qsize())
+
+    def _drain(self, first: Optional[tuple[str, tuple]] = None) -> list:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch: list):
+        by_table: Dict[str, list] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        try:
+            with self._write_lock:
+                conn = self._connect()
+                with conn:
+                    for table, rows in by_table.items():
+                        columns = self.COLUMNS[table]
+                        conn.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) "
+                            f"VALUES ({', '.join('?' * len(columns))})",
+                            rows
+                        )
+        except sqlite3.Error:
+            self._count("failed", len(batch))
+            return
+        self._count("written", len(batch))
+        self._count("batches")
+
+    def flush(self):
+        """Écrit immédiatement tout ce qui est en file."""
+        batch = self._drain()
+        while batch:
+            self._write_batch(batch)
+            batch = self._drain()
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+            self._stop = threading.Event()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write_batch(self._drain(first))
+
+    def stop(self):
+        """Arrête le thread et écrit les lignes en attente."""
+        self._stop.set()
+        self.flush()
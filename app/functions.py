@@ -4,13 +4,12 @@ Fonctions utilitaires pures pour Hall - Flask Gateway.
 Contient les décorateurs, vérifications de sécurité et politiques.
 """
 
-import ipaddress
-from typing import Dict, Any, Callable, TypeVar, Optional
+from typing import Any, Callable, TypeVar, Optional
 from datetime import datetime, timedelta
 from functools import wraps
-from zoneinfo import ZoneInfo
 from flask import session, redirect, url_for, request, abort
 
+from config import DomainSettings
 from database import get_last_activity
 from logging_utils import log_event
 
@@ -28,46 +27,36 @@ def require_admin_login(view_func: F) -> F:
     return wrapped_view  # type: ignore
 
 
-def check_ip_allowed(domain_config: Dict[str, Any], client_ip: str | None) -> bool:
-    """Vérifie si l'IP du client est autorisée."""
-    security = domain_config.get("security", {})
-    allowed_ips = security.get("allowed_ips", [])
-
-    if not allowed_ips:
+def check_ip_allowed(settings: DomainSettings, client_ip: str | None) -> bool:
+    """
+    Vérifie si l'IP du client est autorisée (listes compilées, voir ipmatch).
+    Une IP de denied_ips est toujours refusée ; si allowed_ips est renseigné,
+    seules ses IPs sont acceptées.
+    """
+    if settings.allowed_ips is None and settings.denied_ips is None:
         return True
-
-    try:
-        if client_ip is None:
-            return False
-        client = ipaddress.ip_address(client_ip)
-        for allowed in allowed_ips:
-            if "/" in allowed:
-                if client in ipaddress.ip_network(allowed, strict=False):
-                    return True
-            else:
-                if client == ipaddress.ip_address(allowed):
-                    return True
-    except ValueError:
+    if client_ip is None:
         return False
-
-    return False
+    if settings.denied_ips is not None and client_ip in settings.denied_ips:
+        return False
+    return settings.allowed_ips is None or client_ip in settings.allowed_ips
 
 
-def require_domain_access(get_domain_config_func: Callable[[str], Optional[Dict[str, Any]]]):
+def require_domain_access(get_domain_settings_func: Callable[[str], Optional[DomainSettings]]):
     """
     Fabrique de décorateur pour vérifier l'accès au domaine.
-    Prend en paramètre la fonction get_domain_config pour éviter les imports circulaires.
+    Prend en paramètre la fonction get_domain_settings pour éviter les imports circulaires.
     """
     def decorator(f: F) -> F:
         @wraps(f)
         def decorated_function(domain: str, *args: Any, **kwargs: Any) -> Any:
             from flask import current_app
-            domain_config = get_domain_config_func(domain)
-            if not domain_config:
+            settings = get_domain_settings_func(domain)
+            if not settings:
                 abort(404, description="Domaine non configuré")
 
             client_ip = request.remote_addr
-            if not check_ip_allowed(domain_config, client_ip):
+            if not check_ip_allowed(settings, client_ip):
                 log_event(current_app, f"Accès refusé pour {domain} depuis IP: {client_ip}", level="warning", domain=domain)
                 abort(403, description="Accès non autorisé")
 
@@ -76,59 +65,37 @@ def require_domain_access(get_domain_config_func: Callable[[str], Optional[Dict[
     return decorator
 
 
-def is_within_schedule(domain_config: Dict[str, Any]) -> bool:
-    """Vérifie si on est dans les horaires programmés."""
-    policy = domain_config.get("policy", {})
-
-    if policy.get("type") != "scheduled":
+def is_within_schedule(settings: DomainSettings) -> bool:
+    """Vérifie si on est dans les horaires programmés (planning compilé)."""
+    if settings.policy_type != "scheduled" or settings.schedule is None:
         return True
-
-    schedule = policy.get("schedule", {})
-    tz_name = schedule.get("timezone", "Europe/Paris")
-    tz = ZoneInfo(tz_name)
-    now = datetime.now(tz)
-
-    # Vérifier le jour
-    day_names = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-    current_day = day_names[now.weekday()]
-
-    if current_day not in schedule.get("days", []):
-        return False
-
-    # Vérifier l'heure
-    start_hour = schedule.get("start_hour", 0)
-    end_hour = schedule.get("end_hour", 24)
-
-    return start_hour <= now.hour < end_hour
+    return settings.schedule.is_active()
 
 
-def should_be_awake(domain: str, domain_config: Dict[str, Any]) -> tuple[bool, str]:
+def should_be_awake(settings: DomainSettings) -> tuple[bool, str]:
     """
     Détermine si le serveur devrait être allumé.
     Retourne (should_wake, reason)
     """
-    policy = domain_config.get("policy", {})
-    policy_type = policy.get("type", "on_demand")
+    policy_type = settings.policy_type
 
     if policy_type == "always_on":
         return True, "always_on"
 
     if policy_type == "scheduled":
-        if is_within_schedule(domain_config):
+        if is_within_schedule(settings):
             return True, "within_schedule"
         # Hors horaires : vérifier l'activité récente
-        idle_timeout = policy.get("idle_timeout_minutes", 60)
-        last_activity = get_last_activity(domain)
+        last_activity = get_last_activity(settings.name)
         if last_activity:
-            if datetime.now() - last_activity < timedelta(minutes=idle_timeout):
+            if datetime.now() - last_activity < timedelta(minutes=settings.idle_timeout_minutes):
                 return True, "recent_activity"
         return False, "outside_schedule"
 
     if policy_type == "on_demand":
-        idle_timeout = policy.get("idle_timeout_minutes", 20)
-        last_activity = get_last_activity(domain)
+        last_activity = get_last_activity(settings.name)
         if last_activity:
-            if datetime.now() - last_activity < timedelta(minutes=idle_timeout):
+            if datetime.now() - last_activity < timedelta(minutes=settings.idle_timeout_minutes):
                 return True, "recent_activity"
         # On demand : on réveille sur requête
         return False, "idle_timeout"
@@ -0,0 +1,49 @@
+"""
+gunicorn.conf.py
+Configuration Gunicorn pour Hall - Flask Gateway.
+Le mode de service est choisi au démarrage via HALL_SERVER_MODE :
+- sync (défaut) : workers WSGI threadés, application Flask (app:app)
+- async : workers uvicorn, chemins chauds en asyncio (asgi:app)
+"""
+
+import os
+import shutil
+import tempfile
+
+
+SERVER_MODE = os.environ.get("HALL_SERVER_MODE", "sync").lower()
+
+bind = os.environ.get("HALL_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("HALL_WORKERS", "2"))
+
+# Métriques Prometheus agrégées entre workers (fichiers mmap, voir metrics.py).
+# Défini ici, avant le fork, pour que chaque worker l'hérite.
+METRICS_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "hall-metrics")
+)
+
+if SERVER_MODE == "async":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:app"
+else:
+    wsgi_app = "app:app"
+    # Threads par worker (gthread) : les flux SSE occupent chacun un thread
+    threads = int(os.environ.get("HALL_THREADS", "8"))
+
+
+def on_starting(server):
+    """Repart de compteurs vides à chaque démarrage du serveur."""
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Retire les jauges du worker terminé (ses compteurs restent agrégés)."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    """Écrit les données différées du worker avant son arrêt."""
+    from database import flush_pending_writes
+    flush_pending_writes()
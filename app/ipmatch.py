@@ -0,0 +1,176 @@
+"""
+ipmatch.py
+Correspondance d'adresses IP contre de grandes listes de préfixes pour Hall - Flask Gateway.
+Les préfixes (IPv4 et IPv6) sont compilés une fois en table d'intervalles
+triés et fusionnés ; une recherche est une dichotomie (bisect), donc
+quasiment indépendante du nombre de préfixes.
+
+Microbenchmark : python ipmatch.py
+"""
+
+import ipaddress
+import socket
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+IPAddress = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+def _parse(ip: Union[str, IPAddress]) -> Optional[Tuple[int, int]]:
+    """
+    Retourne (version, valeur entière) d'une adresse, ou None si invalide.
+    inet_pton évite le coût du module ipaddress dans le cas courant ;
+    ::ffff:a.b.c.d est ramené à l'adresse IPv4.
+    """
+    if isinstance(ip, str):
+        try:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError:
+            pass
+        try:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+        except OSError:
+            # Formes non gérées par inet_pton (ex: zone « fe80::1%eth0 »)
+            try:
+                ip = ipaddress.ip_address(ip)
+            except ValueError:
+                return None
+        else:
+            if value >> 32 == 0xFFFF:
+                return 4, value & 0xFFFFFFFF
+            return 6, value
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.version, int(ip)
+
+
+# Adresses IPv4 mappées (::ffff:a.b.c.d), ramenées à l'IPv4 par _parse
+_MAPPED = ipaddress.IPv6Network("::ffff:0:0/96")
+
+
+def _intervals(network: Union[ipaddress.IPv4Network, ipaddress.IPv6Network]) -> List[Tuple[int, int, int]]:
+    """
+    Intervalles (version, début, fin) couverts par un réseau. La partie
+    ::ffff:0:0/96 d'un réseau IPv6 est rangée en IPv4, comme les adresses
+    recherchées.
+    """
+    if network.version == 4:
+        return [(4, int(network.network_address), int(network.broadcast_address))]
+    if network.subnet_of(_MAPPED):
+        return [(4, int(network.network_address) & 0xFFFFFFFF, int(network.broadcast_address) & 0xFFFFFFFF)]
+    intervals = [(6, int(network.network_address), int(network.broadcast_address))]
+    if _MAPPED.subnet_of(network):
+        intervals.append((4, 0, 0xFFFFFFFF))
+    return intervals
+
+
+class IPMatcher:
+    """
+    Ensemble de préfixes IP compilé, interrogé avec `ip in matcher`.
+    Les entrées invalides sont ignorées et listées dans `invalid` : à
+    l'appelant de les refuser ou de les signaler.
+    """
+
+    __slots__ = ("_tables", "size", "invalid")
+
+    def __init__(self, prefixes: Iterable[str]):
+        intervals: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        invalid = []
+        size = 0
+        for prefix in prefixes:
+            try:
+                network = ipaddress.ip_network(prefix.strip(), strict=False)
+            except (ValueError, AttributeError):
+                invalid.append(prefix)
+                continue
+            for version, start, end in _intervals(network):
+                intervals[version].append((start, end))
+            size += 1
+
+        self._tables = {version: self._merge(items) for version, items in intervals.items()}
+        self.size = size
+        self.invalid = tuple(invalid)
+
+    @staticmethod
+    def _merge(intervals: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+        """Trie et fusionne les intervalles qui se chevauchent ou se touchent."""
+        starts: List[int] = []
+        ends: List[int] = []
+        for start, end in sorted(intervals):
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    def __contains__(self, ip: Union[str, IPAddress]) -> bool:
+        parsed = _parse(ip)
+        if parsed is None:
+            return False
+        version, value = parsed
+        starts, ends = self._tables[version]
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"IPMatcher({self.size} préfixes)"
+
+
+# ============================================
+# MICROBENCHMARK
+# ============================================
+
+def _random_prefixes(count: int, seed: int = 42) -> List[str]:
+    import random
+    rng = random.Random(seed)
+    prefixes = []
+    for i in range(count):
+        if i % 4 == 3:
+            length = rng.randint(32, 64)
+            network = ipaddress.IPv6Network((rng.getrandbits(128) >> (128 - length) << (128 - length), length))
+        else:
+            length = rng.randint(8, 32)
+            network = ipaddress.IPv4Network((rng.getrandbits(32) >> (32 - length) << (32 - length), length))
+        prefixes.append(str(network))
+    return prefixes
+
+
+def _benchmark():
+    import random
+    import timeit
+
+    rng = random.Random(7)
+    probes = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(500)]
+    probes += [str(ipaddress.IPv6Address(rng.getrandbits(128))) for _ in range(100)]
+
+    print(f"{'préfixes':>10} {'compilation':>12} {'IPMatcher':>12} {'scan linéaire':>14}")
+    for count in (10, 1_000, 100_000):
+        prefixes = _random_prefixes(count)
+
+        start = timeit.default_timer()
+        matcher = IPMatcher(prefixes)
+        build = timeit.default_timer() - start
+
+        rounds = 20
+        lookup = timeit.timeit(lambda: [ip in matcher for ip in probes], number=rounds)
+        lookup_ns = lookup / (rounds * len(probes)) * 1e9
+
+        # Référence : l'ancienne vérification (liste de réseaux parcourue à chaque requête)
+        networks = [ipaddress.ip_network(p) for p in prefixes]
+        sample = probes[:50] if count > 1_000 else probes
+        def linear_scan(ip: str) -> bool:
+            address = ipaddress.ip_address(ip)
+            return any(address in network for network in networks)
+        scan = timeit.timeit(lambda: [linear_scan(ip) for ip in sample], number=1)
+        scan_ns = scan / len(sample) * 1e9
+
+        print(f"{count:>10} {build * 1e3:>10.1f}ms {lookup_ns:>10.0f}ns {scan_ns / 1e3:>12.1f}µs")
+
+
+if __name__ == "__main__":
+    _benchmark()
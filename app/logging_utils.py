@@ -2,59 +2,271 @@
 logging_utils.py
 Module utilitaire pour la gestion centralisée du logging Flask.
 Peut être importé et utilisé dans d'autres modules de l'application.
+
+Les requêtes n'écrivent jamais dans un fichier : chaque logger dépose ses
+enregistrements dans une file bornée (QueueHandler), et un thread par worker
+(QueueListener) les écrit dans le fichier de destination (global ou propre au
+domaine). La rotation est protégée par un flock : plusieurs workers gunicorn
+peuvent écrire et faire tourner le même fichier.
 """
 
+import atexit
+import fcntl
+import json
 import os
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import re
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
 from flask import Flask
 
+from config import get_snapshot
+
+
+# Répertoire des logs (un sous-répertoire par domaine) et fichier global
+FLASK_LOG_PATH = os.environ.get('FLASK_LOG_PATH', '/app/logs/flask.log')
+LOG_DIR = os.environ.get('LOG_DIR') or os.path.dirname(FLASK_LOG_PATH)
+# Format des fichiers : text ou json (une ligne JSON par enregistrement)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '2'))
+# Enregistrements en attente d'écriture par worker (au-delà : abandonnés et comptés)
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+
+_TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# Domaines journalisés à part même hors configuration (proxy des projets testing)
+_BUILTIN_LOG_DOMAINS = {"testing"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement (horodatage ISO, niveau, domaine, message)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "domain": getattr(record, "domain", None),
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == 'json':
+        return JsonLinesFormatter()
+    return logging.Formatter(_TEXT_FORMAT)
+
+
+class LockedRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler partagé entre processus : chaque écriture (et la
+    rotation éventuelle) se fait sous un flock sur `<fichier>.lock`, et le
+    fichier est rouvert s'il a été tourné par un autre worker.
+    """
+
+    def __init__(self, filename: str, maxBytes: int, backupCount: int):
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, delay=True)
+        self.lock_path = self.baseFilename + ".lock"
+        self._lock_fd: Optional[int] = None
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self._lock_fd is None:
+                self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rotated()
+                super().emit(record)
+                if self.stream is not None:
+                    self.stream.flush()
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class _RoutedQueueHandler(QueueHandler):
+    """Dépose l'enregistrement dans la file, avec son fichier de destination."""
+
+    def __init__(self, pipeline: "LogPipeline", path: str):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.path = path
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.hall_log_path = self.path
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.pipeline.ensure_started()
+        try:
+            self.pipeline.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class _Router(logging.Handler):
+    """Handler du QueueListener : transmet chaque enregistrement au fichier de sa destination."""
+
+    def __init__(self, pipeline: "LogPipeline"):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def handle(self, record: logging.LogRecord):
+        handler = self.pipeline.file_handler(getattr(record, "hall_log_path", FLASK_LOG_PATH))
+        if record.levelno >= handler.level:
+            handler.handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        self.handle(record)
+
+
+class LogPipeline:
+    """File d'écriture des logs du worker et fichiers de destination."""
+
+    def __init__(self, queue_size: int):
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self._files: Dict[str, LockedRotatingFileHandler] = {}
+        self._queue_handlers: Dict[str, _RoutedQueueHandler] = {}
+        self._listener: Optional[QueueListener] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def file_handler(self, path: str) -> LockedRotatingFileHandler:
+        """Handler fichier d'une destination (créé au premier usage)."""
+        handler = self._files.get(path)
+        if handler is None:
+            with self._lock:
+                handler = self._files.get(path)
+                if handler is None:
+                    handler = LockedRotatingFileHandler(path, LOG_MAX_BYTES, LOG_BACKUP_COUNT)
+                    handler.setLevel(logging.INFO)
+                    handler.setFormatter(_formatter())
+                    self._files[path] = handler
+        return handler
+
+    def queue_handler(self, path: str) -> _RoutedQueueHandler:
+        """Handler à attacher à un logger pour écrire (via la file) dans `path`."""
+        handler = self._queue_handlers.get(path)
+        if handler is None:
+            with self._lock:
+                handler = self._queue_handlers.setdefault(path, _RoutedQueueHandler(self, path))
+        self.ensure_started()
+        return handler
+
+    def ensure_started(self):
+        """Démarre le thread d'écriture (un par processus, relancé après un fork)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # File et fichiers hérités du parent : son thread d'écriture n'existe
+                # pas ici (et a pu être interrompu en pleine écriture)
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._files = {}
+            self._listener = QueueListener(self.queue, _Router(self))
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Écrit les enregistrements en attente et arrête le thread."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+        for handler in list(self._files.values()):
+            handler.close()
+
+    def stats(self) -> Dict[str, int]:
+        """État de la file du worker courant."""
+        return {"queued": self.queue.qsize(), "dropped": self.dropped}
+
+
+# File de logs du worker
+log_pipeline = LogPipeline(LOG_QUEUE_SIZE)
+atexit.register(log_pipeline.stop)
+
+
+def has_domain_log(domain: str) -> bool:
+    """
+    Indique si le domaine a son propre fichier de log : seuls les domaines
+    configurés en ont un (un nom tiré d'une requête ne crée pas de répertoire).
+    """
+    if domain in _BUILTIN_LOG_DOMAINS:
+        return True
+    try:
+        return get_snapshot().domain(domain) is not None
+    except (OSError, ValueError):
+        return False
+
+
 def get_log_path_for_domain(domain: str) -> str:
     """
-    Retourne le chemin du fichier de log pour un domaine donné.
+    Retourne le chemin du fichier de log pour un domaine donné
+    (fichier global pour un domaine non configuré).
     """
-    if domain == "testing":
-        return "/app/logs/testing/flask.log"
-    elif domain == "erp":
-        return "/app/logs/erp/flask.log"
-    else:
-        return "/app/logs/flask.log"
+    if not has_domain_log(domain):
+        return FLASK_LOG_PATH
+    return os.path.join(LOG_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", domain), "flask.log")
 
-_domain_handlers = {}
 
-def get_domain_logger(app: Flask, domain: str):
+def get_domain_logger(app: Flask, domain: str) -> logging.Logger:
     """
-    Retourne un logger Flask configuré pour le domaine (handler rotatif par domaine).
+    Retourne le logger du domaine : il écrit uniquement dans le fichier du
+    domaine (sans remonter au logger de l'application).
     """
-    global _domain_handlers
-    log_path = get_log_path_for_domain(domain)
-    if domain not in _domain_handlers:
-        log_dir = os.path.dirname(log_path)
-        os.makedirs(log_dir, exist_ok=True)
-        handler = RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=2)
-        handler.setLevel(logging.INFO)
-        formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-        handler.setFormatter(formatter)
-        _domain_handlers[domain] = handler
-        app.logger.addHandler(handler)
-    return app.logger
+    logger = logging.getLogger(f"{app.logger.name}.domain.{domain}")
+    if not logger.handlers:
+        logger.addHandler(log_pipeline.queue_handler(get_log_path_for_domain(domain)))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
 
 def setup_logging(app: Flask, log_path: str = None):
     """
     Configure le logging Flask pour écrire dans un fichier rotatif global (fallback).
     À appeler au démarrage de l'application.
     :param app: instance Flask
-    :param log_path: chemin du fichier de log (défaut: /app/logs/flask.log)
+    :param log_path: chemin du fichier de log (défaut: FLASK_LOG_PATH)
     """
     if log_path is None:
-        log_path = os.environ.get('FLASK_LOG_PATH', '/app/logs/flask.log')
-    log_dir = os.path.dirname(log_path)
-    os.makedirs(log_dir, exist_ok=True)
-    handler = RotatingFileHandler(log_path, maxBytes=5*1024*1024, backupCount=2)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-    handler.setFormatter(formatter)
-    app.logger.addHandler(handler)
+        log_path = FLASK_LOG_PATH
+    handler = log_pipeline.queue_handler(log_path)
+    if handler not in app.logger.handlers:
+        app.logger.addHandler(handler)
     app.logger.setLevel(logging.INFO)
 
 
@@ -67,13 +279,16 @@ def log_event(app: Flask, message: str, level: str = "info", domain: str = None)
     :param domain: domaine (testing, erp, etc.)
     """
     logger = app.logger
+    extra = None
     if domain:
-        logger = get_domain_logger(app, domain)
+        if has_domain_log(domain):
+            logger = get_domain_logger(app, domain)
+        extra = {"domain": domain}
     if level == "debug":
-        logger.debug(message)
+        logger.debug(message, extra=extra, stacklevel=2)
     elif level == "warning":
-        logger.warning(message)
+        logger.warning(message, extra=extra, stacklevel=2)
     elif level == "error":
-        logger.error(message)
+        logger.error(message, extra=extra, stacklevel=2)
     else:
-        logger.info(message)
+        logger.info(message, extra=extra, stacklevel=2)
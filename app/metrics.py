@@ -0,0 +1,179 @@
+"""
+metrics.py
+Métriques Prometheus pour Hall - Flask Gateway (endpoint /metrics).
+Requêtes HTTP par route, sondes (ping / health check) par domaine, proxy
+testing par projet, requêtes SQLite, rendu des templates et envois WoL.
+
+Sous gunicorn, gunicorn.conf.py définit PROMETHEUS_MULTIPROC_DIR : chaque
+worker écrit ses valeurs dans des fichiers mmap de ce répertoire, agrégés à
+chaque lecture de /metrics. Sans cette variable (python app.py), les
+métriques restent dans le registre du processus.
+"""
+
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+from flask import Flask, Response, g, request, before_render_template, template_rendered
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client import multiprocess
+
+from ipmatch import IPMatcher
+
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# IPs / CIDR autorisées à lire /metrics sans session admin (vide : admin uniquement)
+METRICS_ALLOWED_IPS = IPMatcher(
+    p for p in os.environ.get("METRICS_ALLOWED_IPS", "").split(",") if p.strip()
+)
+if METRICS_ALLOWED_IPS.invalid:
+    logging.getLogger("app").warning(
+        f"METRICS_ALLOWED_IPS : entrées invalides ignorées {list(METRICS_ALLOWED_IPS.invalid)}"
+    )
+
+# Seaux des durées courtes (requêtes SQLite, rendu de templates)
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+# ============================================
+# DÉFINITION DES MÉTRIQUES
+# ============================================
+
+HTTP_REQUESTS = Counter(
+    "hall_http_requests_total", "Requêtes HTTP servies",
+    ["endpoint", "method", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "hall_http_request_duration_seconds",
+    "Durée de traitement d'une requête HTTP (jusqu'aux en-têtes pour les flux)",
+    ["endpoint", "method"]
+)
+PROBE_LATENCY = Histogram(
+    "hall_probe_duration_seconds", "Durée des sondes par domaine",
+    ["domain", "check"]
+)
+PROBE_RESULTS = Counter(
+    "hall_probe_results_total", "Résultats des sondes par domaine (offline, booting, ready)",
+    ["domain", "state"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "hall_upstream_response_seconds",
+    "Délai de réponse des projets testing (jusqu'aux en-têtes)",
+    ["project"]
+)
+UPSTREAM_RESPONSES = Counter(
+    "hall_upstream_responses_total",
+    "Réponses des projets testing par statut (code HTTP, connect_error, timeout, error)",
+    ["project", "status"]
+)
+DB_QUERY_LATENCY = Histogram(
+    "hall_db_query_duration_seconds", "Durée des requêtes SQLite par type d'opération",
+    ["operation"], buckets=_FAST_BUCKETS
+)
+TEMPLATE_LATENCY = Histogram(
+    "hall_template_render_seconds", "Durée de rendu des templates",
+    ["template"], buckets=_FAST_BUCKETS
+)
+WOL_SENT = Counter(
+    "hall_wol_sent_total", "Paquets Wake-on-LAN demandés, par domaine et résultat",
+    ["domain", "result"]
+)
+
+
+# ============================================
+# ENREGISTREMENT
+# ============================================
+
+@lru_cache(maxsize=512)
+def query_label(sql: str) -> str:
+    """Libellé peu cardinal d'une requête SQL : verbe et table (ex: « SELECT logs »)."""
+    words = sql.replace("(", " ").split()
+    if not words:
+        return "EMPTY"
+    verb = words[0].upper()
+    if verb in ("CREATE", "DROP", "PRAGMA"):
+        return verb
+    upper = [w.upper() for w in words]
+    for keyword in ("FROM", "INTO", "UPDATE"):
+        if keyword in upper[1:]:
+            index = upper.index(keyword, 1) + 1
+            if index < len(words):
+                return f"{verb} {words[index].strip(';,')}"
+    return verb
+
+
+def record_probe(domain: str, result) -> None:
+    """Observateur du StatusProber : compte l'état obtenu par chaque sonde."""
+    if result.service_ready:
+        state = "ready"
+    elif result.server_online:
+        state = "booting"
+    else:
+        state = "offline"
+    PROBE_RESULTS.labels(domain, state).inc()
+
+
+def record_upstream(project: str, status: str, started: float) -> None:
+    """Enregistre une réponse (ou une erreur) d'un projet testing."""
+    UPSTREAM_LATENCY.labels(project).observe(time.perf_counter() - started)
+    UPSTREAM_RESPONSES.labels(project, status).inc()
+
+
+def record_request(endpoint: Optional[str], method: str, status: int, started: float) -> None:
+    """Enregistre une requête HTTP (Flask ou chemin chaud ASGI)."""
+    endpoint = endpoint or "unmatched"
+    HTTP_LATENCY.labels(endpoint, method).observe(time.perf_counter() - started)
+    HTTP_REQUESTS.labels(endpoint, method, str(status)).inc()
+
+
+def _request_started():
+    g.hall_request_started = time.perf_counter()
+
+
+def _request_finished(response: Response) -> Response:
+    started = g.pop("hall_request_started", None)
+    if started is not None:
+        record_request(request.endpoint, request.method, response.status_code, started)
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault("hall_template_started", {})[template.name] = time.perf_counter()
+
+
+def _template_finished(sender, template, context, **extra):
+    started = g.get("hall_template_started", {}).pop(template.name, None)
+    if started is not None:
+        TEMPLATE_LATENCY.labels(template.name or "-").observe(time.perf_counter() - started)
+
+
+def init_metrics(app: Flask):
+    """Branche la mesure des requêtes et du rendu des templates sur l'application."""
+    app.before_request(_request_started)
+    app.after_request(_request_finished)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+
+# ============================================
+# EXPOSITION
+# ============================================
+
+def metrics_allowed(client_ip: Optional[str], is_admin: bool) -> bool:
+    """Accès à /metrics : session admin, ou IP de METRICS_ALLOWED_IPS."""
+    return is_admin or (client_ip is not None and client_ip in METRICS_ALLOWED_IPS)
+
+
+def render_metrics() -> Response:
+    """Réponse au format texte Prometheus, agrégée sur tous les workers."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
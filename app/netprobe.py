@@ -0,0 +1,321 @@
+"""
+netprobe.py
+Sondes d'accessibilité réseau natives pour Hall - Flask Gateway.
+Ping ICMP via un socket datagramme non privilégié (plusieurs IPs sur un seul
+socket, réponses associées par identifiant/séquence), avec repli sur une
+connexion TCP vers un port configurable. Aucun processus n'est lancé.
+"""
+
+import asyncio
+import errno
+import ipaddress
+import os
+import random
+import select
+import selectors
+import socket
+import struct
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+# Variables d'environnement
+# auto : ICMP si disponible, sinon TCP | icmp : ICMP uniquement | tcp : TCP uniquement
+PING_METHOD = os.environ.get("PING_METHOD", "auto").lower()
+PING_TCP_PORT = int(os.environ.get("PING_TCP_PORT", "22"))
+
+# Types ICMP (requête, réponse) par famille d'adresses
+_ECHO_TYPES = {
+    socket.AF_INET: (8, 0),
+    socket.AF_INET6: (128, 129),
+}
+_ICMP_PROTO = {
+    socket.AF_INET: socket.IPPROTO_ICMP,
+    socket.AF_INET6: socket.IPPROTO_ICMPV6,
+}
+
+# Mémorise les familles pour lesquelles le socket ICMP est refusé
+# (net.ipv4.ping_group_range), afin de ne pas retenter à chaque sonde.
+_icmp_unavailable: set[int] = set()
+
+
+def _checksum(data: bytes) -> int:
+    """Somme de contrôle Internet (RFC 1071)."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(family: int, ident: int, seq: int) -> bytes:
+    """Construit un paquet ICMP echo request."""
+    request_type, _ = _ECHO_TYPES[family]
+    payload = b"hall-probe"
+    header = struct.pack("!BBHHH", request_type, 0, 0, ident, seq)
+    checksum = _checksum(header + payload) if family == socket.AF_INET else 0
+    return struct.pack("!BBHHH", request_type, 0, checksum, ident, seq) + payload
+
+
+def _parse_reply(family: int, data: bytes) -> Optional[tuple[int, int]]:
+    """Retourne (identifiant, séquence) d'un echo reply, ou None."""
+    # Certains systèmes renvoient l'en-tête IPv4 devant le paquet ICMP
+    if family == socket.AF_INET and len(data) >= 20 and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+    reply_type, _, _, reply_ident, reply_seq = struct.unpack("!BBHHH", data[:8])
+    if reply_type != _ECHO_TYPES[family][1]:
+        return None
+    return reply_ident, reply_seq
+
+
+def _same_ip(a: str, b: str) -> bool:
+    return ipaddress.ip_address(a) == ipaddress.ip_address(b)
+
+
+def _icmp_socket(family: int) -> socket.socket:
+    """Ouvre un socket ICMP datagramme non bloquant (non privilégié)."""
+    if family in _icmp_unavailable:
+        raise PermissionError(errno.EACCES, "Socket ICMP non autorisé")
+    try:
+        sock = socket.socket(family, socket.SOCK_DGRAM, _ICMP_PROTO[family])
+    except PermissionError:
+        _icmp_unavailable.add(family)
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+def _group_by_family(ips: Iterable[str], results: Dict[str, bool]) -> Dict[int, List[str]]:
+    """Regroupe les IPs par famille ; les adresses invalides sont marquées injoignables."""
+    by_family: Dict[int, List[str]] = {}
+    for ip in ips:
+        results[ip] = False
+        family = _family(ip)
+        if family is not None:
+            by_family.setdefault(family, []).append(ip)
+    return by_family
+
+
+def _family(ip: str) -> Optional[int]:
+    try:
+        return socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+    except ValueError:
+        return None
+
+
+def icmp_ping_many(ips: Iterable[str], timeout: float) -> Dict[str, bool]:
+    """
+    Envoie un echo ICMP à chaque IP sur un seul socket par famille et attend
+    les réponses jusqu'au délai.
+
+    :raises OSError: si le socket ICMP non privilégié n'est pas autorisé
+    """
+    results: Dict[str, bool] = {}
+    by_family = _group_by_family(ips, results)
+
+    deadline = time.monotonic() + timeout
+    sockets: Dict[socket.socket, tuple[int, int, Dict[int, str]]] = {}
+    try:
+        for family, family_ips in by_family.items():
+            sock = _icmp_socket(family)
+            ident = random.randint(0, 0xFFFF)
+            base_seq = random.randint(0, 0xFFFF)
+            expected: Dict[int, str] = {}
+            # Socket enregistré avant l'envoi pour être fermé en cas d'erreur
+            sockets[sock] = (family, ident, expected)
+            for offset, ip in enumerate(family_ips):
+                seq = (base_seq + offset) & 0xFFFF
+                try:
+                    sock.sendto(_echo_request(family, ident, seq), (ip, 0))
+                    expected[seq] = ip
+                except OSError:
+                    pass
+            # Le noyau remplace l'identifiant par le port local du socket
+            sockets[sock] = (family, sock.getsockname()[1], expected)
+
+        while any(expected for _, _, expected in sockets.values()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(sockets), [], [], remaining)
+            for sock in readable:
+                family, ident, expected = sockets[sock]
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except OSError:
+                    continue
+                reply = _parse_reply(family, data)
+                if reply is None or reply[0] != ident:
+                    continue
+                ip = expected.get(reply[1])
+                if ip is not None and _same_ip(addr[0], ip):
+                    results[ip] = True
+                    del expected[reply[1]]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    return results
+
+
+def tcp_probe_many(ips: Iterable[str], port: int, timeout: float) -> Dict[str, bool]:
+    """
+    Tente une connexion TCP non bloquante vers chaque IP, en parallèle.
+    Une connexion acceptée ou refusée (RST) prouve que l'hôte est joignable.
+    """
+    results: Dict[str, bool] = {}
+    selector = selectors.DefaultSelector()
+    deadline = time.monotonic() + timeout
+    try:
+        for ip in ips:
+            results[ip] = False
+            family = _family(ip)
+            if family is None:
+                continue
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            code = sock.connect_ex((ip, port))
+            if code in (0, errno.ECONNREFUSED):
+                results[ip] = True
+                sock.close()
+            elif code in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE, ip)
+            else:
+                sock.close()
+
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                results[key.data] = code in (0, errno.ECONNREFUSED)
+                selector.unregister(sock)
+                sock.close()
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    return results
+
+
+def ping_many(ips: Iterable[str], timeout: float, tcp_port: Optional[int] = None) -> Dict[str, bool]:
+    """
+    Sonde plusieurs IPs en parallèle selon PING_METHOD.
+
+    :param ips: Adresses IP à sonder
+    :param timeout: Délai global en secondes
+    :param tcp_port: Port TCP utilisé en repli (défaut: PING_TCP_PORT)
+    :return: Dictionnaire {ip: joignable}
+    """
+    ips = [ip for ip in dict.fromkeys(ips) if ip]
+    if not ips:
+        return {}
+    port = tcp_port or PING_TCP_PORT
+
+    if PING_METHOD == "tcp":
+        return tcp_probe_many(ips, port, timeout)
+    try:
+        return icmp_ping_many(ips, timeout)
+    except OSError:
+        if PING_METHOD == "icmp":
+            return {ip: False for ip in ips}
+        return tcp_probe_many(ips, port, timeout)
+
+
+# ============================================
+# VARIANTES ASYNCIO (mode ASGI)
+# ============================================
+
+async def _async_icmp_family(family: int, ips: List[str], deadline: float,
+                             results: Dict[str, bool]):
+    """Sonde ICMP d'une famille d'adresses sur un socket, sans bloquer la boucle."""
+    loop = asyncio.get_running_loop()
+    sock = _icmp_socket(family)
+    try:
+        ident = random.randint(0, 0xFFFF)
+        base_seq = random.randint(0, 0xFFFF)
+        expected: Dict[int, str] = {}
+        for offset, ip in enumerate(ips):
+            seq = (base_seq + offset) & 0xFFFF
+            try:
+                await loop.sock_sendto(sock, _echo_request(family, ident, seq), (ip, 0))
+                expected[seq] = ip
+            except OSError:
+                pass
+        ident = sock.getsockname()[1]
+
+        while expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                data, addr = await asyncio.wait_for(loop.sock_recvfrom(sock, 1024), remaining)
+            except (asyncio.TimeoutError, OSError):
+                break
+            reply = _parse_reply(family, data)
+            if reply is None or reply[0] != ident:
+                continue
+            ip = expected.get(reply[1])
+            if ip is not None and _same_ip(addr[0], ip):
+                results[ip] = True
+                del expected[reply[1]]
+    finally:
+        sock.close()
+
+
+async def async_icmp_ping_many(ips: Iterable[str], timeout: float) -> Dict[str, bool]:
+    """
+    Équivalent asyncio de icmp_ping_many.
+
+    :raises OSError: si le socket ICMP non privilégié n'est pas autorisé
+    """
+    results: Dict[str, bool] = {}
+    by_family = _group_by_family(ips, results)
+    deadline = time.monotonic() + timeout
+    await asyncio.gather(*(
+        _async_icmp_family(family, family_ips, deadline, results)
+        for family, family_ips in by_family.items()
+    ))
+    return results
+
+
+async def _async_tcp_probe(ip: str, port: int, timeout: float) -> bool:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except ConnectionRefusedError:
+        return True
+    except (asyncio.TimeoutError, OSError):
+        return False
+    writer.close()
+    return True
+
+
+async def async_tcp_probe_many(ips: Iterable[str], port: int, timeout: float) -> Dict[str, bool]:
+    """Équivalent asyncio de tcp_probe_many."""
+    ips = list(ips)
+    outcomes = await asyncio.gather(*(_async_tcp_probe(ip, port, timeout) for ip in ips))
+    return dict(zip(ips, outcomes))
+
+
+async def async_ping_many(ips: Iterable[str], timeout: float,
+                          tcp_port: Optional[int] = None) -> Dict[str, bool]:
+    """Équivalent asyncio de ping_many."""
+    ips = [ip for ip in dict.fromkeys(ips) if ip]
+    if not ips:
+        return {}
+    port = tcp_port or PING_TCP_PORT
+
+    if PING_METHOD == "tcp":
+        return await async_tcp_probe_many(ips, port, timeout)
+    try:
+        return await async_icmp_ping_many(ips, timeout)
+    except OSError:
+        if PING_METHOD == "icmp":
+            return {ip: False for ip in ips}
+        return await async_tcp_probe_many(ips, port, timeout)
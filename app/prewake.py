@@ -0,0 +1,237 @@
+"""
+prewake.py
+Réveil anticipé des domaines « scheduled » pour Hall - Flask Gateway.
+Un thread garde une file de minuteries (tas) : pour chaque domaine, la
+prochaine ouverture de plage du planning compilé, moins le délai de
+démarrage du serveur. Le thread dort jusqu'à la première échéance, envoie
+le WoL, puis programme l'ouverture suivante. Les échéances simultanées
+(ex: toute une flotte le matin) partent en un seul lot. Un seul worker
+gunicorn l'exécute (verrou fichier).
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from flask import Flask
+
+from background import LeaderLock
+from boot_telemetry import boot_telemetry
+from config import get_snapshot, ConfigSnapshot, DomainSettings
+from database import DATABASE_PATH, update_wol_activity, log_action
+from logging_utils import log_event
+from wake_state import wake_states
+from netprobe import ping_many
+from wol import send_wol_batch
+
+
+# Délai d'anticipation par défaut (minutes), si aucune mesure de démarrage n'est disponible
+DEFAULT_LEAD_MINUTES = 10
+
+# Échéance : (instant d'envoi, domaine, ouverture de plage visée)
+_Timer = Tuple[float, str, datetime]
+
+
+class PrewakeScheduler:
+    """File de minuteries de réveil anticipé, reconstruite à chaque version de configuration."""
+
+    def __init__(self, lock_path: str, recheck_seconds: float = 60.0):
+        self.recheck_seconds = recheck_seconds
+        self.lock = LeaderLock(lock_path)
+        # Estimation du temps de démarrage mesuré d'un domaine (secondes), ou None
+        self.boot_estimate: Callable[[str], Optional[float]] = lambda domain: None
+        self._timers: List[_Timer] = []
+        # Dernière ouverture de plage traitée par domaine (pas de second envoi après un rebuild)
+        self._fired: Dict[str, datetime] = {}
+        self._version: Optional[int] = None
+        self._app: Optional[Flask] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    @staticmethod
+    def eligible(settings: DomainSettings) -> bool:
+        """Domaine planifié, avec WoL et réveil anticipé actifs."""
+        return (
+            settings.policy_type == "scheduled"
+            and settings.schedule is not None
+            and settings.wol_enabled
+            and settings.prewake
+            and bool(settings.mac)
+        )
+
+    def lead_seconds(self, settings: DomainSettings, global_config: Dict[str, Any]) -> float:
+        """Avance du réveil : le plus grand du délai configuré et du démarrage mesuré."""
+        minutes = settings.prewake_lead_minutes
+        if minutes is None:
+            minutes = global_config.get("prewake_lead_minutes", DEFAULT_LEAD_MINUTES)
+        measured = self.boot_estimate(settings.name) or 0.0
+        return max(float(minutes) * 60, measured)
+
+    def _plan(self, settings: DomainSettings, global_config: Dict[str, Any],
+              after: datetime) -> Optional[_Timer]:
+        # Plage déjà traitée (rebuild entre l'envoi et l'ouverture) : la suivante
+        fired = self._fired.get(settings.name)
+        if fired is not None and fired >= after:
+            after = fired + timedelta(minutes=1)
+        start = settings.schedule.next_start(after)
+        if start is None:
+            return None
+        return start.timestamp() - self.lead_seconds(settings, global_config), settings.name, start
+
+    def _rebuild(self, snapshot: ConfigSnapshot):
+        """Recalcule toutes les échéances (démarrage ou nouvelle configuration)."""
+        now = datetime.now().astimezone()
+        timers = []
+        for settings in snapshot.domains.values():
+            if not self.eligible(settings):
+                continue
+            try:
+                timer = self._plan(settings, snapshot.global_config, now)
+            except Exception:
+                # Un planning en erreur n'empêche pas les réveils des autres domaines
+                self._app.logger.exception(f"[PREWAKE] Planning de {settings.name} ignoré")
+                continue
+            if timer is not None:
+                timers.append(timer)
+        heapq.heapify(timers)
+        with self._lock:
+            self._timers = timers
+            self._version = snapshot.version
+
+    def planned(self, domain: str) -> Optional[datetime]:
+        """
+        Prochain réveil anticipé d'un domaine. Le worker leader lit sa file ;
+        les autres le recalculent depuis le planning (même règle de calcul).
+        """
+        with self._lock:
+            if self._version is not None:
+                for fire_at, name, _ in self._timers:
+                    if name == domain:
+                        return datetime.fromtimestamp(fire_at).astimezone()
+                return None
+        snapshot = get_snapshot()
+        settings = snapshot.domain(domain)
+        if settings is None or not self.eligible(settings):
+            return None
+        timer = self._plan(settings, snapshot.global_config, datetime.now().astimezone())
+        return datetime.fromtimestamp(timer[0]).astimezone() if timer is not None else None
+
+    def _fire(self, snapshot: ConfigSnapshot, timers: List[_Timer]):
+        """Réveille les domaines d'échéances simultanées : un ping groupé, un seul lot WoL."""
+        due: Dict[str, Tuple[DomainSettings, datetime]] = {}
+        for _, domain, window_start in timers:
+            settings = snapshot.domain(domain)
+            if settings is not None and self.eligible(settings):
+                due[domain] = (settings, window_start)
+        if not due:
+            return
+
+        # Déjà allumés (ex: réveil déjà envoyé par un worker précédent) : ignorés
+        ips = [settings.server_ip for settings, _ in due.values() if settings.server_ip]
+        online = ping_many(ips, snapshot.global_config.get("ping_timeout_seconds", 2)) if ips else {}
+        # Un réveil déjà en cours (ex: demandé par un visiteur) n'est pas renvoyé ;
+        # le ping vient de trouver le serveur éteint : un état online est périmé
+        targets = {
+            domain: settings.mac for domain, (settings, _) in due.items()
+            if not online.get(settings.server_ip, False)
+            and wake_states.claim(domain, observed_offline=True)[0]
+        }
+
+        results = send_wol_batch(self._app, targets)
+        for domain, success in results.items():
+            window_start = due[domain][1]
+            if success:
+                update_wol_activity(domain)
+                boot_telemetry.wol_sent(domain)
+            else:
+                wake_states.release(domain)
+            log_action(
+                domain, "prewake", "success" if success else "failed",
+                f"Ouverture de plage {window_start.isoformat()}"
+            )
+            log_event(
+                self._app,
+                f"[PREWAKE] Domaine: {domain} | Plage: {window_start.isoformat()} | Success: {success}",
+                domain=domain
+            )
+
+    def _tick(self) -> float:
+        """Un passage : relit la configuration, réveille les échéances dues. Retourne l'attente."""
+        snapshot = get_snapshot()
+        if snapshot.version != self._version:
+            self._rebuild(snapshot)
+
+        with self._lock:
+            now = time.time()
+            due = []
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers))
+            next_at = self._timers[0][0] if self._timers else None
+
+        if due:
+            try:
+                self._fire(snapshot, due)
+            except Exception as e:
+                log_event(self._app, f"[PREWAKE] Erreur: {e}", level="error")
+            for _, domain, window_start in due:
+                self._fired[domain] = window_start
+                settings = snapshot.domain(domain)
+                if settings is not None and self.eligible(settings):
+                    following = self._plan(
+                        settings, snapshot.global_config, window_start + timedelta(minutes=1)
+                    )
+                    if following is not None:
+                        with self._lock:
+                            heapq.heappush(self._timers, following)
+            return 0
+
+        # Attente jusqu'à la prochaine échéance (bornée pour suivre la configuration)
+        timeout = self.recheck_seconds
+        if next_at is not None:
+            timeout = min(max(next_at - time.time(), 0), timeout)
+        return timeout
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.lock.acquire():
+                self._stop.wait(self.recheck_seconds)
+                continue
+            try:
+                timeout = self._tick()
+            except Exception:
+                # Configuration ou planning en erreur : le thread (et le verrou) restent
+                # en place, nouvel essai au prochain passage
+                self._app.logger.exception("[PREWAKE] Erreur du planificateur")
+                timeout = self.recheck_seconds
+            if timeout:
+                self._stop.wait(timeout)
+
+    def start(self, app: Flask):
+        """Démarre le thread du planificateur (idempotent, sûr après un fork)."""
+        self._app = app
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+            self._stop = threading.Event()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="prewake", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le thread et libère le verrou."""
+        self._stop.set()
+        self.lock.release()
+
+
+# Planificateur partagé (actif dans un seul worker à la fois)
+prewake_scheduler = PrewakeScheduler(
+    os.path.join(os.path.dirname(DATABASE_PATH) or ".", "hall-prewake.lock")
+)
+# Avance calée sur le p95 des démarrages mesurés
+prewake_scheduler.boot_estimate = boot_telemetry.estimate
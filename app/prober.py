@@ -0,0 +1,275 @@
+"""
+prober.py
+Sondeur de statut partagé pour Hall - Flask Gateway.
+Rafraîchit en arrière-plan l'état de chaque domaine (ping + health check),
+garde le dernier résultat en cache avec un TTL et fusionne les sondes
+concurrentes en une seule (single-flight). Les résultats sont publiés dans
+l'état partagé : un worker reprend la sonde récente d'un autre au lieu de
+sonder à son tour.
+"""
+
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional
+
+from config import get_domain_config, get_global_config, get_snapshot
+from metrics import PROBE_LATENCY, record_probe
+from shared_state import shared_state
+from wol import ping_server, check_health
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    """Résultat d'une sonde de domaine."""
+    server_online: bool
+    service_ready: bool
+    checked_at: float  # time.monotonic()
+
+
+@dataclass
+class _DomainState:
+    """État interne du sondeur pour un domaine."""
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    result: Optional[ProbeResult] = None
+    inflight: Optional[threading.Event] = None
+    last_access: float = 0.0
+    # Surveillance sans visiteur (watch) : arrêtée dès que ce test est vrai
+    watch_done: Optional[Callable[[ProbeResult], bool]] = None
+    refresher: Optional[threading.Thread] = None
+    # Incrémenté à chaque changement d'état (en ligne / service prêt)
+    version: int = 0
+    changed: threading.Condition = field(init=False)
+
+    def __post_init__(self):
+        self.changed = threading.Condition(self.lock)
+
+    def set_result(self, result: ProbeResult):
+        """Enregistre un résultat (verrou tenu) et notifie les changements d'état."""
+        previous = self.result
+        self.result = result
+        if previous is None or (previous.server_online, previous.service_ready) != \
+                (result.server_online, result.service_ready):
+            self.version += 1
+            self.changed.notify_all()
+
+
+class StatusProber:
+    """
+    Sondeur par domaine avec cache TTL et single-flight.
+
+    Tant qu'un domaine est consulté, un thread d'arrière-plan le sonde à
+    intervalle régulier ; les requêtes lisent le dernier résultat en mémoire.
+    Un domaine qui n'est plus consulté pendant `idle_after` secondes n'est
+    plus sondé.
+    """
+
+    def __init__(self, idle_after: float = 60.0):
+        self.idle_after = idle_after
+        self._states: Dict[str, _DomainState] = {}
+        self._states_lock = threading.Lock()
+        # Fonctions appelées avec (domaine, résultat) après chaque sonde
+        self.observers: List[Callable[[str, ProbeResult], None]] = []
+
+    def _state(self, domain: str) -> _DomainState:
+        state = self._states.get(domain)
+        if state is None:
+            with self._states_lock:
+                state = self._states.setdefault(domain, _DomainState())
+        return state
+
+    @staticmethod
+    def _timings(global_config: Dict[str, Any]) -> tuple[float, float]:
+        """Retourne (intervalle de rafraîchissement, TTL) en secondes."""
+        refresh = float(global_config.get(
+            "status_refresh_seconds",
+            global_config.get("polling_interval_seconds", 3)
+        ))
+        ttl = float(global_config.get("status_cache_ttl_seconds", refresh * 2))
+        return refresh, ttl
+
+    def get_status(self, domain: str) -> ProbeResult:
+        """
+        Retourne le statut d'un domaine, depuis le cache s'il est frais.
+        En cas d'absence ou d'expiration, une seule sonde est lancée et les
+        appels concurrents attendent son résultat.
+        """
+        self.touch(domain)
+        result = self.fresh(domain)
+        if result is not None:
+            return result
+        return self._probe_once(domain, self._state(domain))
+
+    def touch(self, domain: str):
+        """Signale que le domaine est consulté (maintient le rafraîchissement)."""
+        state = self._state(domain)
+        state.last_access = max(state.last_access, time.monotonic())
+        self._ensure_refresher(domain, state)
+
+    def watch(self, domain: str, duration: float,
+              until: Optional[Callable[[ProbeResult], bool]] = None):
+        """
+        Maintient le rafraîchissement pendant `duration` secondes, même sans
+        visiteur, ou jusqu'à ce qu'un résultat vérifie `until`.
+        """
+        state = self._state(domain)
+        state.watch_done = until
+        state.last_access = max(state.last_access, time.monotonic() + duration - self.idle_after)
+        self._ensure_refresher(domain, state)
+
+    def _end_watch(self, state: _DomainState, result: Optional[ProbeResult]):
+        """Fin de surveillance : seuls les visiteurs (touch) maintiennent ensuite les sondes."""
+        done = state.watch_done
+        if done is not None and result is not None and done(result):
+            state.watch_done = None
+            state.last_access = min(state.last_access, time.monotonic())
+
+    def _notify(self, domain: str, result: ProbeResult):
+        shared_state.store_probe(domain, result.server_online, result.service_ready, result.checked_at)
+        for observer in self.observers:
+            try:
+                observer(domain, result)
+            except Exception:
+                pass
+
+    def fresh(self, domain: str) -> Optional[ProbeResult]:
+        """Retourne le résultat en cache s'il est encore valide, sinon None."""
+        result = self.peek(domain)
+        _, ttl = self._timings(get_global_config())
+        if result is not None and time.monotonic() - result.checked_at <= ttl:
+            return result
+        return None
+
+    def peek(self, domain: str) -> Optional[ProbeResult]:
+        """
+        Retourne le dernier résultat connu, sans sonder. Un résultat plus
+        récent publié par un autre worker est adopté (et notifié aux flux).
+        """
+        state = self._states.get(domain)
+        local = state.result if state else None
+        published = shared_state.probe(domain)
+        if published is None or (local is not None and local.checked_at >= published[2]):
+            return local
+
+        result = ProbeResult(*published)
+        state = self._state(domain)
+        with state.lock:
+            if state.result is None or state.result.checked_at < result.checked_at:
+                state.set_result(result)
+            return state.result
+
+    def store(self, domain: str, result: ProbeResult):
+        """Enregistre un résultat obtenu hors du sondeur (ex: mode asynchrone)."""
+        state = self._state(domain)
+        with state.lock:
+            state.set_result(result)
+        self._notify(domain, result)
+
+    def version(self, domain: str) -> int:
+        """Numéro de version de l'état du domaine (change à chaque transition)."""
+        return self._state(domain).version
+
+    def wait_for_change(self, domain: str, version: int, timeout: float) -> int:
+        """
+        Attend que l'état du domaine change par rapport à `version`.
+        Retourne la version courante (inchangée si le délai a expiré).
+        """
+        state = self._state(domain)
+        with state.lock:
+            state.changed.wait_for(lambda: state.version != version, timeout)
+            return state.version
+
+    def _probe_once(self, domain: str, state: _DomainState) -> ProbeResult:
+        """Lance une sonde, ou attend celle déjà en cours (single-flight)."""
+        with state.lock:
+            event = state.inflight
+            leader = event is None
+            if leader:
+                event = state.inflight = threading.Event()
+
+        if not leader:
+            global_config = get_global_config()
+            event.wait(
+                global_config.get("ping_timeout_seconds", 2)
+                + global_config.get("health_check_timeout_seconds", 5)
+            )
+            if state.result is not None:
+                return state.result
+            return ProbeResult(False, False, time.monotonic())
+
+        result = ProbeResult(False, False, time.monotonic())
+        try:
+            result = self._probe(domain)
+        finally:
+            with state.lock:
+                state.set_result(result)
+                state.inflight = None
+            event.set()
+        self._notify(domain, result)
+        return result
+
+    @staticmethod
+    def _probe(domain: str) -> ProbeResult:
+        """Exécute réellement le ping et le health check d'un domaine."""
+        config = get_snapshot()
+        settings = config.domain(domain)
+        global_config = config.global_config
+        if settings is None:
+            return ProbeResult(False, False, time.monotonic())
+
+        with PROBE_LATENCY.labels(domain, "ping").time():
+            server_online = ping_server(
+                settings.server_ip,
+                global_config.get("ping_timeout_seconds", 2)
+            )
+
+        service_ready = False
+        if server_online and settings.health_check:
+            with PROBE_LATENCY.labels(domain, "health").time():
+                service_ready = check_health(
+                    settings.redirect_url,
+                    settings.health_check,
+                    global_config.get("health_check_timeout_seconds", 5)
+                )
+
+        return ProbeResult(server_online, service_ready, time.monotonic())
+
+    def _ensure_refresher(self, domain: str, state: _DomainState):
+        """Démarre le thread de rafraîchissement du domaine si besoin."""
+        if state.refresher is not None and state.refresher.is_alive():
+            return
+        with state.lock:
+            if state.refresher is not None and state.refresher.is_alive():
+                return
+            state.refresher = threading.Thread(
+                target=self._refresh_loop,
+                args=(domain, state),
+                name=f"prober-{domain}",
+                daemon=True
+            )
+            state.refresher.start()
+
+    def _refresh_loop(self, domain: str, state: _DomainState):
+        """Boucle de rafraîchissement, tant que le domaine est consulté."""
+        while time.monotonic() - state.last_access < self.idle_after:
+            if get_domain_config(domain) is None:
+                break
+            refresh, _ = self._timings(get_global_config())
+            # Sonde récente d'un autre worker : reprise sans nouvelle sonde
+            result = self.peek(domain)
+            age = time.monotonic() - result.checked_at if result is not None else refresh
+            if age >= refresh:
+                age = 0.0
+                try:
+                    result = self._probe_once(domain, state)
+                except Exception:
+                    pass
+            self._end_watch(state, result)
+            # Un intervalle après la dernière sonde, décalé au hasard entre workers
+            time.sleep(refresh - age + random.uniform(0, refresh / 4))
+
+
+# Instance partagée par les blueprints (une par worker)
+status_prober = StatusProber()
+status_prober.observers.append(record_probe)
@@ -0,0 +1,74 @@
+"""
+project_registry.py
+Registre en mémoire des projets testing pour Hall - Flask Gateway.
+La table testing_projects est chargée en mémoire et les recherches se font
+dans un dictionnaire. Chaque modification incrémente un compteur de
+génération en base (table meta) ; les workers le relisent au plus une fois
+par `check_interval` secondes et rechargent le registre s'il a changé.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+
+GENERATION_KEY = "testing_projects_generation"
+
+
+def bump_generation(conn: sqlite3.Connection):
+    """Incrémente la génération (à appeler dans la transaction qui modifie les projets)."""
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """, (GENERATION_KEY,))
+
+
+class ProjectRegistry:
+    """Cache des projets testing, invalidé par compteur de génération."""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], check_interval: float):
+        self._connect = connect
+        self.check_interval = check_interval
+        self._projects: Optional[Dict[str, Dict[str, Any]]] = None
+        self._generation: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _read_generation(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (GENERATION_KEY,)).fetchone()
+        return row[0] if row else 0
+
+    def _projects_map(self) -> Dict[str, Dict[str, Any]]:
+        projects = self._projects
+        if projects is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return projects
+
+        with self._lock:
+            if self._projects is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._projects
+            conn = self._connect()
+            # Génération lue avant les lignes : au pire, un rechargement de trop
+            generation = self._read_generation(conn)
+            if self._projects is None or generation != self._generation:
+                rows = conn.execute("SELECT * FROM testing_projects").fetchall()
+                self._projects = {row["name"]: dict(row) for row in rows}
+                self._generation = generation
+            self._checked_at = time.monotonic()
+            return self._projects
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Projet actif par son nom (copie), ou None."""
+        project = self._projects_map().get(name)
+        if project is None or not project["active"]:
+            return None
+        return dict(project)
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Tous les projets (actifs ou non), triés par nom."""
+        return [dict(p) for _, p in sorted(self._projects_map().items())]
+
+    def invalidate(self):
+        """Force le rechargement à la prochaine lecture (modification dans ce worker)."""
+        with self._lock:
+            self._projects = None
@@ -0,0 +1,291 @@
+"""
+reaper.py
+Extinction automatique des serveurs inactifs pour Hall - Flask Gateway.
+Chaque domaine avec `policy.auto_shutdown` a une échéance d'inactivité
+(dernière activité + idle_timeout, repoussée à la fin de la plage en cours
+pour un domaine planifié, ou de la prochaine plage si le réveil anticipé
+l'a déjà allumé), gardée dans une file de minuteries (tas). Le
+thread ne relit que les activités modifiées depuis son dernier passage et ne
+recalcule que les échéances concernées. À expiration, les serveurs encore
+allumés sont éteints en parallèle via leur shutdown_endpoint ; chaque
+décision est tracée dans `logs`. Un seul worker gunicorn l'exécute (verrou
+fichier).
+"""
+
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Flask
+
+from background import LeaderLock
+from config import get_snapshot, ConfigSnapshot, DomainSettings
+from database import DATABASE_PATH, get_db, log_action, recent_activity
+from logging_utils import log_event
+from netprobe import ping_many
+from prewake import prewake_scheduler
+from wake_state import wake_states
+from wol import request_shutdown
+
+
+# Mode simulation : les décisions sont tracées, aucun serveur n'est éteint
+REAPER_DRY_RUN = os.environ.get("REAPER_DRY_RUN", "false").lower() in ("1", "true", "yes")
+# Intervalle max entre deux lectures des activités (secondes)
+REAPER_RECHECK_SECONDS = float(os.environ.get("REAPER_RECHECK_SECONDS", "30"))
+# Extinctions simultanées max
+REAPER_MAX_PARALLEL = int(os.environ.get("REAPER_MAX_PARALLEL", "8"))
+
+# Échéance : (instant d'extinction, domaine)
+_Timer = Tuple[float, str]
+
+
+class IdleReaper:
+    """File des échéances d'inactivité, mise à jour par les activités."""
+
+    def __init__(self, lock_path: str, recheck_seconds: float, dry_run: bool, max_parallel: int):
+        self.recheck_seconds = recheck_seconds
+        self.dry_run = dry_run
+        self.max_parallel = max_parallel
+        self.lock = LeaderLock(lock_path)
+        # Avance du réveil anticipé d'un domaine (secondes), ou None s'il n'en a pas
+        self.prewake_lead: Callable[[DomainSettings], Optional[float]] = lambda settings: None
+        self._timers: List[_Timer] = []
+        # Échéance courante par domaine (les entrées du tas qui diffèrent sont périmées)
+        self._deadlines: Dict[str, float] = {}
+        self._activity: Dict[str, datetime] = {}
+        # Dernier passage à échéance : le délai d'inactivité repart de là
+        self._checked: Dict[str, datetime] = {}
+        self._activity_mark = ""
+        self._started_at = datetime.now()
+        self._version: Optional[int] = None
+        self._app: Optional[Flask] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    @staticmethod
+    def eligible(settings: DomainSettings) -> bool:
+        """Domaine à extinction automatique, avec un endpoint d'extinction."""
+        return (
+            settings.auto_shutdown
+            and settings.shutdown_endpoint is not None
+            and settings.policy_type != "always_on"
+        )
+
+    def deadline(self, settings: DomainSettings, last_activity: Optional[datetime]) -> Optional[datetime]:
+        """Premier instant où le domaine peut être éteint (None : jamais)."""
+        if not self.eligible(settings):
+            return None
+        # Sans activité récente, le délai court depuis le démarrage du reaper ou le dernier passage
+        since = max(last_activity or self._started_at, self._checked.get(settings.name, self._started_at))
+        deadline = since + timedelta(minutes=settings.idle_timeout_minutes)
+        if settings.schedule is not None:
+            # Une échéance passée s'applique maintenant : la plage est vérifiée à cet instant
+            local = max(deadline, datetime.now()).astimezone()
+            if not settings.schedule.is_active(local):
+                # Serveur réveillé en avance pour la prochaine plage : pas d'extinction avant
+                lead = self.prewake_lead(settings)
+                start = settings.schedule.next_start(local) if lead else None
+                if start is not None and (start - local).total_seconds() <= lead:
+                    local = start
+            if settings.schedule.is_active(local):
+                end = settings.schedule.next_end(local)
+                if end is None:
+                    return None
+                return end.astimezone().replace(tzinfo=None)
+        return deadline
+
+    def _set_timer(self, settings: DomainSettings):
+        domain = settings.name
+        due = self.deadline(settings, self._activity.get(domain))
+        with self._lock:
+            if due is None:
+                self._deadlines.pop(domain, None)
+                return
+            fire_at = due.timestamp()
+            if self._deadlines.get(domain) != fire_at:
+                self._deadlines[domain] = fire_at
+                heapq.heappush(self._timers, (fire_at, domain))
+
+    def _read_activity(self) -> List[str]:
+        """
+        Fusionne les activités modifiées depuis le dernier passage (base, et
+        activités pas encore écrites de tous les workers). Retourne les domaines changés.
+        """
+        rows = get_db().execute(
+            "SELECT domain, last_activity FROM activity WHERE last_activity > ?",
+            (self._activity_mark,)
+        ).fetchall()
+        updates = {}
+        for row in rows:
+            updates[row["domain"]] = datetime.fromisoformat(row["last_activity"])
+            self._activity_mark = max(self._activity_mark, row["last_activity"])
+        for domain, when in recent_activity().items():
+            if when > updates.get(domain, datetime.min):
+                updates[domain] = when
+
+        changed = []
+        for domain, when in updates.items():
+            if when > self._activity.get(domain, datetime.min):
+                self._activity[domain] = when
+                changed.append(domain)
+        return changed
+
+    def _rebuild(self, snapshot: ConfigSnapshot):
+        """Recalcule toutes les échéances (démarrage ou nouvelle configuration)."""
+        with self._lock:
+            self._timers = []
+            self._deadlines = {}
+            self._version = snapshot.version
+        for settings in snapshot.domains.values():
+            try:
+                self._set_timer(settings)
+            except Exception:
+                # Un planning en erreur n'empêche pas les extinctions des autres domaines
+                self._app.logger.exception(f"[REAPER] Échéance de {settings.name} ignorée")
+
+    def planned(self, domain: str) -> Optional[datetime]:
+        """Prochaine extinction programmée pour un domaine (worker leader uniquement)."""
+        fire_at = self._deadlines.get(domain)
+        return datetime.fromtimestamp(fire_at).astimezone() if fire_at is not None else None
+
+    def _pop_due(self) -> Tuple[List[str], Optional[float]]:
+        with self._lock:
+            now = time.time()
+            due = []
+            while self._timers and self._timers[0][0] <= now:
+                fire_at, domain = heapq.heappop(self._timers)
+                if self._deadlines.get(domain) == fire_at:
+                    del self._deadlines[domain]
+                    due.append(domain)
+            next_at = self._timers[0][0] if self._timers else None
+        return due, next_at
+
+    def _shutdown(self, settings: DomainSettings) -> Tuple[str, str]:
+        domain = settings.name
+        idle = self._activity.get(domain)
+        details = f"Inactif depuis {idle.isoformat(timespec='seconds') if idle else 'le démarrage'}"
+        if self.dry_run:
+            return "dry_run", details
+        success, detail = request_shutdown(settings.shutdown_endpoint)
+        if success:
+            wake_states.shut_down(domain)
+        return ("success" if success else "failed"), f"{details} | {detail}"
+
+    def _reap(self, snapshot: ConfigSnapshot, domains: List[str]):
+        """Éteint en parallèle les domaines arrivés à échéance et encore allumés."""
+        expired: Dict[str, DomainSettings] = {}
+        for domain in domains:
+            settings = snapshot.domain(domain)
+            if settings is None:
+                continue
+            due = self.deadline(settings, self._activity.get(domain))
+            if due is not None and due <= datetime.now():
+                expired[domain] = settings
+            else:
+                # Activité entre-temps (ou nouvelle plage) : échéance repoussée
+                self._set_timer(settings)
+        if not expired:
+            return
+
+        ips = [settings.server_ip for settings in expired.values() if settings.server_ip]
+        online = ping_many(ips, snapshot.global_config.get("ping_timeout_seconds", 2)) if ips else {}
+        targets = [s for s in expired.values() if online.get(s.server_ip, False)]
+
+        results = []
+        if targets:
+            with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(targets))) as pool:
+                results = list(pool.map(self._shutdown, targets))
+
+        # Prochain passage après un nouveau délai (serveur rallumé sans activité, échec...)
+        now = datetime.now()
+        for settings in expired.values():
+            self._checked[settings.name] = now
+            self._set_timer(settings)
+
+        for settings, (status, details) in zip(targets, results):
+            log_action(settings.name, "auto_shutdown", status, details)
+            log_event(
+                self._app,
+                f"[REAPER] Domaine: {settings.name} | {status} | {details}",
+                level="error" if status == "failed" else "info",
+                domain=settings.name
+            )
+
+    def _tick(self) -> float:
+        """Un passage : relit configuration et activités, éteint les domaines dus. Retourne l'attente."""
+        snapshot = get_snapshot()
+        changed = self._read_activity()
+        if snapshot.version != self._version:
+            self._rebuild(snapshot)
+        else:
+            for domain in changed:
+                settings = snapshot.domain(domain)
+                if settings is not None:
+                    self._set_timer(settings)
+
+        due, next_at = self._pop_due()
+        if due:
+            try:
+                self._reap(snapshot, due)
+            except Exception as e:
+                log_event(self._app, f"[REAPER] Erreur: {e}", level="error")
+                # Échéances retirées du tas sans être reprogrammées : tout est recalculé
+                self._version = None
+            return 0
+
+        # Attente jusqu'à la prochaine échéance (bornée pour relire les activités)
+        timeout = self.recheck_seconds
+        if next_at is not None:
+            timeout = min(max(next_at - time.time(), 0), timeout)
+        return timeout
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.lock.acquire():
+                self._stop.wait(self.recheck_seconds)
+                continue
+            try:
+                timeout = self._tick()
+            except Exception:
+                # Configuration ou base en erreur : le thread (et le verrou) restent
+                # en place, file recalculée au prochain passage
+                self._app.logger.exception("[REAPER] Erreur du reaper")
+                self._version = None
+                timeout = self.recheck_seconds
+            if timeout:
+                self._stop.wait(timeout)
+
+    def start(self, app: Flask):
+        """Démarre le thread du reaper (idempotent, sûr après un fork)."""
+        self._app = app
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = None
+            self._stop = threading.Event()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="idle-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête le thread et libère le verrou."""
+        self._stop.set()
+        self.lock.release()
+
+
+# Reaper partagé (actif dans un seul worker à la fois)
+idle_reaper = IdleReaper(
+    os.path.join(os.path.dirname(DATABASE_PATH) or ".", "hall-reaper.lock"),
+    REAPER_RECHECK_SECONDS, REAPER_DRY_RUN, REAPER_MAX_PARALLEL
+)
+# Pas d'extinction pendant l'avance du réveil anticipé (délai configuré ou démarrage mesuré)
+idle_reaper.prewake_lead = lambda settings: (
+    prewake_scheduler.lead_seconds(settings, get_snapshot().global_config)
+    if prewake_scheduler.eligible(settings) else None
+)
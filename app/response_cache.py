@@ -0,0 +1,358 @@
+"""
+response_cache.py
+Cache HTTP en mémoire pour le proxy des projets testing de Hall - Flask Gateway.
+
+Activé par projet (colonne response_cache). Seuls les GET sans Authorization
+sont concernés ; une réponse est gardée selon les règles d'un cache partagé :
+
+- jamais si Cache-Control contient no-store ou private, si elle pose un
+  cookie ou si Vary vaut « * » ;
+- fraîche pendant s-maxage, max-age ou jusqu'à Expires (moins Age) ;
+  no-cache, ou l'absence de durée, impose une revalidation ;
+- une fois périmée, elle est revalidée auprès du projet (If-None-Match /
+  If-Modified-Since) : un 304 la rafraîchit sans retransférer le corps ;
+- les validateurs envoyés au projet sont ceux du cache, jamais ceux du
+  navigateur : le client est ensuite servi depuis la copie (304 si son
+  If-None-Match correspond). Sans copie, la requête part sans condition
+  pour remplir le cache ;
+- les variantes sont distinguées par les en-têtes de requête listés dans Vary.
+
+Les entrées sont rangées dans une LRU bornée en octets (par worker). Les clés
+contiennent le projet et sa génération de cache : la purge depuis l'admin
+incrémente la génération en base, et chaque worker oublie les anciennes
+entrées dès qu'il voit la nouvelle.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Iterable, List, Mapping, Optional, Tuple
+
+
+# Taille totale du cache et taille maximale d'une réponse gardée (octets, par worker)
+PROXY_CACHE_MAX_BYTES = int(os.environ.get("PROXY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+PROXY_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("PROXY_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+
+# Statuts qu'un cache peut garder
+_CACHEABLE_STATUS = {200, 203, 204, 300, 301, 308, 404, 410}
+# En-têtes recalculés à chaque réponse servie depuis le cache
+_SERVED_HEADERS = {"age", "date", "x-hall-cache"}
+# Conditions du navigateur, remplacées par les validateurs du cache
+_CLIENT_CONDITIONAL = {"if-none-match", "if-modified-since"}
+
+Headers = List[Tuple[str, str]]
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Directives Cache-Control en minuscules : {"max-age": "60", "no-cache": None, ...}."""
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(int(value), 0) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _header(headers: Headers, name: str) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def freshness(headers: Headers, now: float) -> Optional[float]:
+    """
+    Durée de fraîcheur d'une réponse (secondes, 0 : à revalider), ou None si
+    elle ne doit pas être gardée.
+    """
+    directives = parse_cache_control(_header(headers, "cache-control"))
+    if "no-store" in directives or "private" in directives:
+        return None
+    if _header(headers, "set-cookie") is not None or (_header(headers, "vary") or "").strip() == "*":
+        return None
+
+    lifetime = _seconds(directives.get("s-maxage")) if "s-maxage" in directives else None
+    if lifetime is None and "max-age" in directives:
+        lifetime = _seconds(directives.get("max-age"))
+    if lifetime is None:
+        expires = _header(headers, "expires")
+        if expires:
+            try:
+                date = _header(headers, "date")
+                origin = parsedate_to_datetime(date).timestamp() if date else now
+                lifetime = max(parsedate_to_datetime(expires).timestamp() - origin, 0)
+            except (TypeError, ValueError):
+                lifetime = 0
+    if "no-cache" in directives or lifetime is None:
+        lifetime = 0
+    lifetime -= _seconds(_header(headers, "age")) or 0
+
+    has_validator = _header(headers, "etag") is not None or _header(headers, "last-modified") is not None
+    if lifetime <= 0 and not has_validator:
+        # Ni durée ni validateur : inutile de la garder
+        return None
+    return max(lifetime, 0)
+
+
+@dataclass
+class CachedResponse:
+    """Réponse gardée en cache."""
+    status: int
+    headers: Headers
+    body: bytes
+    stored_at: float
+    fresh_until: float
+    size: int = field(init=False)
+
+    def __post_init__(self):
+        self.size = len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+    def fresh(self, now: float) -> bool:
+        return now < self.fresh_until
+
+    @property
+    def etag(self) -> Optional[str]:
+        return _header(self.headers, "etag")
+
+    def validators(self) -> Dict[str, str]:
+        """En-têtes de revalidation conditionnelle pour cette réponse."""
+        conditional = {}
+        if self.etag is not None:
+            conditional["If-None-Match"] = self.etag
+        last_modified = _header(self.headers, "last-modified")
+        if last_modified is not None:
+            conditional["If-Modified-Since"] = last_modified
+        return conditional
+
+    def served_headers(self, now: float, state: str) -> Headers:
+        """En-têtes envoyés au client (Age recalculé, état du cache)."""
+        headers = [(k, v) for k, v in self.headers if k.lower() not in _SERVED_HEADERS]
+        headers.append(("Age", str(int(now - self.stored_at))))
+        headers.append(("X-Hall-Cache", state))
+        return headers
+
+    def not_modified_for(self, if_none_match: Optional[str]) -> bool:
+        """Le client possède déjà cette version (If-None-Match)."""
+        etag = self.etag
+        if not if_none_match or etag is None:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class CacheRequest:
+    """Requête proxy éligible au cache : recherche, revalidation et enregistrement."""
+
+    def __init__(self, cache: "ResponseCache", project: str, generation: int,
+                 url: str, headers: Mapping[str, str]):
+        self.cache = cache
+        self.project = project
+        self.generation = generation
+        self.url = url
+        self.headers = headers
+        directives = parse_cache_control(headers.get("cache-control"))
+        # no-cache / max-age=0 côté client : la copie doit être revalidée
+        self.revalidate = "no-cache" in directives or directives.get("max-age") == "0" \
+            or "no-cache" in headers.get("pragma", "").lower()
+        # Requête conditionnelle du navigateur : remplacée par celle du cache en amont
+        self.client_conditional = "if-none-match" in headers or "if-modified-since" in headers
+        self.entry = cache.lookup(project, generation, url, headers)
+
+    def hit(self, now: float) -> Optional[CachedResponse]:
+        """Réponse fraîche utilisable sans contacter le projet."""
+        if self.entry is not None and not self.revalidate and self.entry.fresh(now):
+            self.cache.count("hits")
+            return self.entry
+        self.cache.count("misses")
+        return None
+
+    def upstream_headers(self, headers: Iterable[Tuple[str, str]]) -> Headers:
+        """
+        En-têtes de la requête vers le projet : conditions du navigateur
+        retirées, validateurs de la copie en cache ajoutés (s'il y en a une).
+        """
+        upstream = [(k, v) for k, v in headers if k.lower() not in _CLIENT_CONDITIONAL]
+        if self.entry is not None:
+            upstream.extend(self.entry.validators().items())
+        return upstream
+
+    def revalidated(self, status: int, headers: Headers) -> Optional[CachedResponse]:
+        """Sur un 304 en réponse à nos validateurs, rafraîchit et retourne la copie."""
+        if status != 304 or self.entry is None:
+            return None
+        return self.cache.refresh(self.project, self.generation, self.url, self.headers, self.entry, headers)
+
+    def storable(self, status: int, headers: Headers) -> bool:
+        """La réponse du projet peut être gardée (décision avant de lire le corps)."""
+        if status not in _CACHEABLE_STATUS or freshness(headers, time.time()) is None:
+            return False
+        length = _seconds(_header(headers, "content-length"))
+        return length is None or length <= self.cache.max_entry_bytes
+
+    def answer_from_cache(self, status: int, headers: Headers) -> bool:
+        """
+        Le navigateur avait envoyé une requête conditionnelle : la réponse
+        (de taille connue) est lue en entier et gardée, puis le client est
+        servi depuis la copie, en 304 si sa version est la bonne.
+        """
+        return self.client_conditional and self.storable(status, headers) \
+            and _header(headers, "content-length") is not None
+
+    def store(self, status: int, headers: Headers, body: bytes) -> Optional[CachedResponse]:
+        """Garde la réponse complète (corps entièrement lu). Retourne la copie, ou None."""
+        return self.cache.store(self.project, self.generation, self.url, self.headers, status, headers, body)
+
+
+class ResponseCache:
+    """LRU de réponses proxy, bornée en octets, clés préfixées par projet."""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[Tuple[Any, ...], CachedResponse]" = OrderedDict()
+        # En-têtes de requête listés par Vary, par (projet, génération, URL)
+        self._vary: Dict[Tuple[str, int, str], Tuple[str, ...]] = {}
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0, "purged": 0}
+        self._evictions_by_project: Dict[str, int] = {}
+
+    def begin(self, project: Dict[str, Any], method: str, url: str,
+              headers: Iterable[Tuple[str, str]]) -> Optional[CacheRequest]:
+        """Prépare une requête proxy si elle relève du cache (projet, méthode, en-têtes)."""
+        if not project.get("response_cache") or method != "GET":
+            return None
+        request_headers = {key.lower(): value for key, value in headers}
+        if "authorization" in request_headers or \
+                "no-store" in parse_cache_control(request_headers.get("cache-control")):
+            return None
+        generation = project.get("cache_generation") or 0
+        self._check_generation(project["name"], generation)
+        return CacheRequest(self, project["name"], generation, url, request_headers)
+
+    def _check_generation(self, project: str, generation: int):
+        if self._generations.get(project) == generation:
+            return
+        with self._lock:
+            previous = self._generations.get(project)
+            self._generations[project] = generation
+            if previous is not None and previous != generation:
+                self._purge_locked(project)
+
+    @staticmethod
+    def _vary_names(headers: Headers) -> Tuple[str, ...]:
+        vary = _header(headers, "vary") or ""
+        return tuple(sorted({name.strip().lower() for name in vary.split(",") if name.strip()}))
+
+    def lookup(self, project: str, generation: int, url: str,
+               headers: Mapping[str, str]) -> Optional[CachedResponse]:
+        """Copie en cache pour cette requête (fraîche ou non), ou None."""
+        primary = (project, generation, url)
+        with self._lock:
+            names = self._vary.get(primary)
+            entry = None
+            if names is not None:
+                key = primary + tuple(headers.get(name, "") for name in names)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            return entry
+
+    def count(self, counter: str):
+        """Incrémente un compteur (hits, misses...)."""
+        with self._lock:
+            self._counters[counter] += 1
+
+    def store(self, project: str, generation: int, url: str, headers: Mapping[str, str],
+              status: int, response_headers: Headers, body: bytes) -> Optional[CachedResponse]:
+        """Ajoute une réponse (ignorée si elle dépasse max_entry_bytes). Retourne la copie, ou None."""
+        now = time.time()
+        lifetime = freshness(response_headers, now)
+        if lifetime is None or status not in _CACHEABLE_STATUS:
+            return None
+        entry = CachedResponse(status, list(response_headers), body, now, now + lifetime)
+        if entry.size > self.max_entry_bytes:
+            return None
+        primary = (project, generation, url)
+        names = self._vary_names(response_headers)
+        key = primary + tuple(headers.get(name, "") for name in names)
+        with self._lock:
+            if self._generations.get(project, generation) != generation:
+                return None
+            self._vary[primary] = names
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._counters["stores"] += 1
+            self._evict_locked()
+        return entry
+
+    def refresh(self, project: str, generation: int, url: str, headers: Mapping[str, str],
+                entry: CachedResponse, response_headers: Headers) -> CachedResponse:
+        """Met à jour une copie revalidée (304) : en-têtes de fraîcheur et date de stockage."""
+        updates = {k.lower(): (k, v) for k, v in response_headers
+                   if k.lower() in ("cache-control", "expires", "etag", "last-modified", "date", "vary")}
+        merged = [(k, v) for k, v in entry.headers if k.lower() not in updates] + list(updates.values())
+        now = time.time()
+        lifetime = freshness(merged, now) or 0
+        refreshed = CachedResponse(entry.status, merged, entry.body, now, now + lifetime)
+        self.count("revalidated")
+        self.store(project, generation, url, headers, entry.status, merged, entry.body)
+        return refreshed
+
+    def _evict_locked(self):
+        while self._bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._counters["evictions"] += 1
+            self._evictions_by_project[key[0]] = self._evictions_by_project.get(key[0], 0) + 1
+
+    def _purge_locked(self, project: str) -> int:
+        keys = [key for key in self._entries if key[0] == project]
+        for key in keys:
+            self._bytes -= self._entries.pop(key).size
+        for primary in [p for p in self._vary if p[0] == project]:
+            del self._vary[primary]
+        self._counters["purged"] += len(keys)
+        return len(keys)
+
+    def purge(self, project: str) -> int:
+        """Vide le cache d'un projet dans ce worker. Retourne le nombre d'entrées supprimées."""
+        with self._lock:
+            return self._purge_locked(project)
+
+    def stats(self) -> Dict[str, Any]:
+        """Compteurs du worker courant et occupation par projet."""
+        with self._lock:
+            projects: Dict[str, Dict[str, int]] = {}
+            for key, entry in self._entries.items():
+                usage = projects.setdefault(key[0], {"entries": 0, "bytes": 0, "evictions": 0})
+                usage["entries"] += 1
+                usage["bytes"] += entry.size
+            for project, evictions in self._evictions_by_project.items():
+                projects.setdefault(project, {"entries": 0, "bytes": 0, "evictions": 0})["evictions"] = evictions
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                **self._counters,
+                "projects": projects,
+            }
+
+
+# Cache partagé par les threads du worker
+response_cache = ResponseCache(PROXY_CACHE_MAX_BYTES, PROXY_CACHE_MAX_ENTRY_BYTES)
@@ -0,0 +1,244 @@
+"""
+schedule.py
+Moteur de plages horaires pour Hall - Flask Gateway.
+La section `policy.schedule` d'un domaine est compilée en un masque
+hebdomadaire de 10080 bits (un bit par minute de la semaine, lundi 00:00 =
+bit 0) et en un dictionnaire d'exceptions par date (jours fériés, horaires
+particuliers). L'appartenance est un test de bit ; la prochaine transition
+est trouvée jour par jour par opérations sur les bits, sans parcourir les
+minutes une à une.
+
+Format (l'ancien format days/start_hour/end_hour reste accepté) :
+
+    "schedule": {
+        "timezone": "Europe/Paris",
+        "windows": [
+            {"days": ["monday", "tuesday"], "start": "08:00", "end": "12:30"},
+            {"days": ["friday"], "start": "22:00", "end": "02:00"}
+        ],
+        "exclusions": ["2026-12-25"],
+        "overrides": {"2026-12-24": [{"start": "08:00", "end": "12:00"}]}
+    }
+
+Une plage dont la fin précède le début se prolonge le lendemain, sauf si
+son jour de départ est une exclusion ou un override (la suite du lendemain
+tombe avec elle). Une plage de 24 h s'écrit "00:00" → "24:00" : un début
+égal à la fin est refusé. Dans `overrides`, les plages remplacent celles de
+la semaine pour ce jour-là (liste vide = fermé ; une plage qui passe minuit
+est coupée à minuit) ; `exclusions` ferme la journée entière. Une plage
+qui commence dans l'heure sautée au passage à l'heure d'été s'ouvre au
+changement d'heure (ex: 02:30 → 03:00 heure d'été).
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+_DAY_FULL = (1 << MINUTES_PER_DAY) - 1
+
+# Horizon de recherche des transitions (jours)
+DEFAULT_HORIZON_DAYS = 400
+
+
+def _parse_minute(value: Any) -> int:
+    """Convertit "HH:MM" (ou un nombre d'heures) en minute de la journée (0..1440)."""
+    if isinstance(value, int):
+        minute = value * 60
+    else:
+        hours, _, minutes = str(value).partition(":")
+        minute = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= minute <= MINUTES_PER_DAY:
+        raise ValueError(f"Heure invalide dans le planning: {value!r}")
+    return minute
+
+
+def _range_mask(start: int, end: int) -> int:
+    """Masque des bits [start, end)."""
+    return ((1 << (end - start)) - 1) << start if end > start else 0
+
+
+def _lowest_bit(value: int) -> int:
+    """Position du bit à 1 le plus faible (value > 0)."""
+    return (value & -value).bit_length() - 1
+
+
+def _day_windows_mask(windows: Iterable[Dict[str, Any]]) -> int:
+    """Masque d'une journée (overrides) ; une plage qui passe minuit est coupée à minuit."""
+    mask = 0
+    for window in windows:
+        start = _parse_minute(window.get("start", 0))
+        end = _parse_minute(window.get("end", 24))
+        mask |= _range_mask(start, end if end > start else MINUTES_PER_DAY)
+    return mask
+
+
+class CompiledSchedule:
+    """Planning compilé d'un domaine (immuable après construction)."""
+
+    __slots__ = ("timezone", "weekly", "carry", "exceptions")
+
+    def __init__(self, timezone: ZoneInfo, weekly: int, carry: int, exceptions: Dict[date, int]):
+        self.timezone = timezone
+        # Minutes actives de chaque jour, plages commencées ce jour-là
+        self.weekly = weekly
+        # Suite au lendemain des plages qui passent minuit, rangée au jour de départ
+        self.carry = carry
+        self.exceptions = exceptions
+
+    def _day_mask(self, day: date) -> int:
+        """Masque des minutes actives d'une date locale."""
+        mask = self.exceptions.get(day)
+        if mask is not None:
+            return mask
+        mask = (self.weekly >> (day.weekday() * MINUTES_PER_DAY)) & _DAY_FULL
+        previous = day - timedelta(days=1)
+        if previous not in self.exceptions:
+            # Plages de la veille qui passent minuit (sauf veille exclue ou remplacée)
+            mask |= (self.carry >> (previous.weekday() * MINUTES_PER_DAY)) & _DAY_FULL
+        return mask
+
+    def _local(self, when: Optional[datetime]) -> datetime:
+        if when is None:
+            return datetime.now(self.timezone)
+        return when.astimezone(self.timezone)
+
+    def is_active(self, when: Optional[datetime] = None) -> bool:
+        """Indique si `when` (défaut: maintenant) est dans une plage active."""
+        local = self._local(when)
+        return bool((self._day_mask(local.date()) >> (local.hour * 60 + local.minute)) & 1)
+
+    def _find(self, day: date, minute: int, active: bool,
+              horizon_days: int) -> Optional[Tuple[date, int]]:
+        """Première minute >= (day, minute) dont l'état vaut `active`."""
+        for _ in range(horizon_days):
+            mask = self._day_mask(day)
+            candidates = (mask if active else ~mask & _DAY_FULL) >> minute
+            if candidates:
+                return day, minute + _lowest_bit(candidates)
+            day += timedelta(days=1)
+            minute = 0
+        return None
+
+    def _to_datetime(self, day: date, minute: int) -> datetime:
+        local = datetime.combine(day, time(minute // 60, minute % 60), tzinfo=self.timezone)
+        converted = local.astimezone(timezone.utc).astimezone(self.timezone)
+        if converted.replace(tzinfo=None) == local.replace(tzinfo=None):
+            return converted
+        # Heure sautée (passage à l'heure d'été) : la plage est active dès la
+        # première minute qui existe, c'est-à-dire l'instant du changement d'heure
+        # (même minute que celle où is_active devient vrai)
+        low = int(local.replace(fold=1).timestamp()) // 60
+        high = int(local.timestamp()) // 60
+        after = converted.utcoffset()
+        while high - low > 1:
+            middle = (low + high) // 2
+            if datetime.fromtimestamp(middle * 60, self.timezone).utcoffset() == after:
+                high = middle
+            else:
+                low = middle
+        return datetime.fromtimestamp(high * 60, self.timezone)
+
+    def next_transition(self, when: Optional[datetime] = None,
+                        horizon_days: int = DEFAULT_HORIZON_DAYS) -> Optional[Tuple[datetime, bool]]:
+        """
+        Prochain changement d'état après `when`.
+        Retourne (instant, actif après le changement), ou None si aucun
+        changement dans l'horizon.
+        """
+        local = self._local(when)
+        minute = local.hour * 60 + local.minute
+        active = self.is_active(local)
+        found = self._find(local.date(), minute, not active, horizon_days)
+        if found is None:
+            return None
+        return self._to_datetime(*found), not active
+
+    def next_start(self, when: Optional[datetime] = None,
+                   horizon_days: int = DEFAULT_HORIZON_DAYS) -> Optional[datetime]:
+        """Prochain début de plage active (strictement après `when`)."""
+        local = self._local(when)
+        day, minute = local.date(), local.hour * 60 + local.minute
+        if self.is_active(local):
+            found = self._find(day, minute, False, horizon_days)
+            if found is None:
+                return None
+            day, minute = found
+        found = self._find(day, minute, True, horizon_days)
+        return self._to_datetime(*found) if found else None
+
+    def next_end(self, when: Optional[datetime] = None,
+                 horizon_days: int = DEFAULT_HORIZON_DAYS) -> Optional[datetime]:
+        """Prochaine fin de plage active (strictement après `when`)."""
+        local = self._local(when)
+        day, minute = local.date(), local.hour * 60 + local.minute
+        if not self.is_active(local):
+            found = self._find(day, minute, True, horizon_days)
+            if found is None:
+                return None
+            day, minute = found
+        found = self._find(day, minute, False, horizon_days)
+        return self._to_datetime(*found) if found else None
+
+    def windows_for(self, day: date) -> List[Tuple[str, str]]:
+        """Plages actives d'une date locale, sous forme [("HH:MM", "HH:MM"), ...]."""
+        mask = self._day_mask(day)
+        windows = []
+        minute = 0
+        while mask >> minute:
+            start = minute + _lowest_bit(mask >> minute)
+            rest = ~(mask >> start)
+            end = start + _lowest_bit(rest)
+            end = min(end, MINUTES_PER_DAY)
+            windows.append((f"{start // 60:02d}:{start % 60:02d}", f"{end // 60:02d}:{end % 60:02d}"))
+            minute = end
+        return windows
+
+
+def compile_schedule(config: Dict[str, Any]) -> CompiledSchedule:
+    """
+    Compile une section `policy.schedule`.
+
+    :raises ValueError: si un jour, une heure ou une date est invalide, ou si
+        une plage commence et finit à la même heure
+    """
+    tz = ZoneInfo(config.get("timezone", "Europe/Paris"))
+
+    windows = list(config.get("windows", []))
+    if not windows and ("days" in config or "start_hour" in config or "end_hour" in config):
+        # Ancien format : une seule plage, sans passage de minuit
+        start_hour = config.get("start_hour", 0)
+        end_hour = config.get("end_hour", 24)
+        if end_hour > start_hour:
+            windows.append({"days": config.get("days", []), "start": start_hour, "end": end_hour})
+
+    weekly = 0
+    carry = 0
+    for window in windows:
+        start = _parse_minute(window.get("start", 0))
+        end = _parse_minute(window.get("end", 24))
+        if start == end:
+            raise ValueError(
+                f"Plage vide dans le planning: {window.get('start')!r} → {window.get('end')!r} "
+                "(24 h : \"00:00\" → \"24:00\")"
+            )
+        # Fin avant le début : la plage se termine le lendemain à `end`
+        spill = end if end < start else 0
+        for day_name in window.get("days", DAY_NAMES):
+            if day_name not in DAY_NAMES:
+                raise ValueError(f"Jour invalide dans le planning: {day_name!r}")
+            offset = DAY_NAMES.index(day_name) * MINUTES_PER_DAY
+            weekly |= _range_mask(offset + start, offset + (end if end > start else MINUTES_PER_DAY))
+            carry |= _range_mask(offset, offset + spill)
+
+    exceptions: Dict[date, int] = {}
+    for day, day_windows in config.get("overrides", {}).items():
+        exceptions[date.fromisoformat(day)] = _day_windows_mask(day_windows)
+    for day in config.get("exclusions", []):
+        exceptions[date.fromisoformat(day)] = 0
+
+    return CompiledSchedule(tz, weekly, carry, exceptions)
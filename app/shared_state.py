@@ -0,0 +1,314 @@
+"""
+shared_state.py
+État partagé entre les workers gunicorn de Hall - Flask Gateway.
+Un fichier projeté en mémoire (mmap, à disposition fixe) contient, par
+domaine : la dernière activité, le dernier résultat de sonde et l'état de
+réveil ; l'en-tête porte la génération de configuration. Tous les workers
+voient la même mémoire : une lecture ne coûte que quelques microsecondes,
+sans connexion SQLite.
+
+Disposition :
+    en-tête (64 octets) : magic, version, nombre d'emplacements, génération config
+    emplacement (168 octets) : séquence, nom, activité, sonde, réveil
+
+Les lectures sont sans verrou (seqlock : la séquence est impaire pendant une
+écriture, et relue pour détecter une écriture concurrente). Les écritures
+sont sérialisées par un verrou de thread et un flock sur le fichier. Les
+emplacements sont attribués par hachage (crc32, sondage linéaire) et ne sont
+jamais libérés. Si le fichier est inutilisable ou plein, les lectures
+retournent None et les appelants gardent leur comportement local.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+
+# Fichier partagé (défaut : à côté de la base SQLite)
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH") or os.path.join(
+    os.path.dirname(os.environ.get("DATABASE_PATH", "/data/hall.db")) or ".", "hall-state.mmap"
+)
+# Nombre de domaines suivis (changer la valeur réinitialise le fichier)
+SHARED_STATE_SLOTS = int(os.environ.get("SHARED_STATE_SLOTS", "256"))
+
+_MAGIC = b"HALLSHM1"
+_LAYOUT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQ")  # magic, version, emplacements, génération config
+_HEADER_SIZE = 64
+_GENERATION_OFFSET = 16
+_SEQ = struct.Struct("<Q")
+# nom, activité (epoch), sonde (monotonic), réveil (epoch), en ligne, service prêt, état de réveil
+_FIELDS = struct.Struct("<128sdddBBB5x")
+_SLOT_SIZE = _SEQ.size + _FIELDS.size
+_NAME_SIZE = 128
+# Tentatives de lecture sans verrou avant de lire sous verrou
+_READ_SPINS = 100
+
+# Contenu d'un emplacement : (nom, activité, sonde, réveil, en ligne, service prêt, état)
+_Slot = Tuple[bytes, float, float, float, int, int, int]
+
+
+class SharedState:
+    """Segment mmap partagé entre processus, à emplacements fixes par domaine."""
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self.size = _HEADER_SIZE + slots * _SLOT_SIZE
+        self._mm: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        # Index des emplacements déjà trouvés (ils ne changent jamais de domaine)
+        self._index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    # ============================================
+    # OUVERTURE ET VERROUILLAGE
+    # ============================================
+
+    def _segment(self) -> Optional[mmap.mmap]:
+        """Projection du fichier pour le processus courant (rouverte après un fork)."""
+        if self._pid == os.getpid():
+            return self._mm
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+        return self._mm
+
+    def _open(self):
+        # Le flock hérité du parent serait partagé avec lui : nouveau descripteur
+        self._mm, self._fd, self._index = None, None, {}
+        fd = None
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, _HEADER.size, 0)
+                expected = (_MAGIC, _LAYOUT_VERSION, self.slots)
+                if len(header) < _HEADER.size or _HEADER.unpack(header)[:3] != expected \
+                        or os.fstat(fd).st_size != self.size:
+                    # Fichier neuf ou d'une autre disposition : remis à zéro
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, _HEADER.pack(_MAGIC, _LAYOUT_VERSION, self.slots, 0), 0)
+                self._mm = mmap.mmap(fd, self.size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd = fd
+        except (OSError, ValueError):
+            if fd is not None:
+                os.close(fd)
+        # Pas de nouvel essai dans ce processus : les appelants restent en local
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        """Verrou d'écriture : threads du worker puis processus (flock)."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def available(self) -> bool:
+        """Segment ouvert et utilisable dans ce processus."""
+        return self._segment() is not None
+
+    # ============================================
+    # EMPLACEMENTS
+    # ============================================
+
+    @staticmethod
+    def _offset(index: int) -> int:
+        return _HEADER_SIZE + index * _SLOT_SIZE
+
+    def _read(self, mm: mmap.mmap, index: int) -> _Slot:
+        """Lit un emplacement sans verrou (relu si une écriture l'a traversé)."""
+        offset = self._offset(index)
+        for _ in range(_READ_SPINS):
+            before = _SEQ.unpack_from(mm, offset)[0]
+            if not before & 1:
+                fields = _FIELDS.unpack_from(mm, offset + _SEQ.size)
+                if _SEQ.unpack_from(mm, offset)[0] == before:
+                    return fields
+        # Écrivain interrompu ou très actif : lecture sous verrou
+        with self._locked():
+            return _FIELDS.unpack_from(mm, offset + _SEQ.size)
+
+    def _write(self, mm: mmap.mmap, index: int, fields: _Slot):
+        """Écrit un emplacement (verrou d'écriture tenu)."""
+        offset = self._offset(index)
+        # Séquence impaire pendant l'écriture (déjà impaire si un écrivain est mort)
+        odd = _SEQ.unpack_from(mm, offset)[0] | 1
+        _SEQ.pack_into(mm, offset, odd)
+        _FIELDS.pack_into(mm, offset + _SEQ.size, *fields)
+        _SEQ.pack_into(mm, offset, odd + 1)
+
+    def _find(self, mm: mmap.mmap, domain: str, create: bool) -> Optional[int]:
+        """Emplacement d'un domaine ; attribué sous verrou si `create` et absent."""
+        index = self._index.get(domain)
+        if index is not None:
+            return index
+        name = domain.encode("utf-8")
+        if not name or len(name) > _NAME_SIZE:
+            return None
+
+        index = self._probe_slots(mm, name)
+        if index is None and create:
+            with self._locked():
+                # Un autre processus a pu l'attribuer entre-temps
+                index = self._probe_slots(mm, name, claim=True)
+        if index is not None:
+            self._index[domain] = index
+        return index
+
+    def _probe_slots(self, mm: mmap.mmap, name: bytes, claim: bool = False) -> Optional[int]:
+        padded = name.ljust(_NAME_SIZE, b"\0")
+        start = zlib.crc32(name) % self.slots
+        for step in range(self.slots):
+            index = (start + step) % self.slots
+            slot_name = self._read(mm, index)[0] if not claim else \
+                _FIELDS.unpack_from(mm, self._offset(index) + _SEQ.size)[0]
+            if slot_name == padded:
+                return index
+            if slot_name[0] == 0:
+                if claim:
+                    self._write(mm, index, (name, 0.0, 0.0, 0.0, 0, 0, 0))
+                    return index
+                return None
+        return None
+
+    def _get(self, domain: str) -> Optional[_Slot]:
+        mm = self._segment()
+        if mm is None:
+            return None
+        index = self._find(mm, domain, create=False)
+        return self._read(mm, index) if index is not None else None
+
+    def update(self, domain: str, change: Callable[[_Slot], Optional[_Slot]]) -> Optional[_Slot]:
+        """
+        Modifie l'emplacement d'un domaine de façon atomique entre processus.
+        `change` reçoit le contenu courant et retourne le nouveau (None : inchangé).
+        Retourne le contenu après l'appel, ou None si le segment est indisponible.
+        """
+        mm = self._segment()
+        if mm is None:
+            return None
+        index = self._find(mm, domain, create=True)
+        if index is None:
+            return None
+        with self._locked():
+            current = _FIELDS.unpack_from(mm, self._offset(index) + _SEQ.size)
+            updated = change(current)
+            if updated is None:
+                return current
+            self._write(mm, index, updated)
+            return updated
+
+    # ============================================
+    # ACTIVITÉ
+    # ============================================
+
+    def record_activity(self, domain: str, timestamp: float):
+        """Enregistre une activité (epoch), si elle est plus récente que la valeur partagée."""
+        slot = self._get(domain)
+        if slot is not None and slot[1] >= timestamp:
+            return
+        self.update(domain, lambda s: s[:1] + (timestamp,) + s[2:] if timestamp > s[1] else None)
+
+    def activity(self, domain: str) -> Optional[float]:
+        """Dernière activité (epoch) tous workers confondus, ou None."""
+        slot = self._get(domain)
+        return slot[1] if slot is not None and slot[1] > 0 else None
+
+    def activities(self) -> Dict[str, float]:
+        """Dernières activités de tous les domaines suivis."""
+        mm = self._segment()
+        if mm is None:
+            return {}
+        result = {}
+        for index in range(self.slots):
+            slot = self._read(mm, index)
+            if slot[0][0] != 0 and slot[1] > 0:
+                result[slot[0].rstrip(b"\0").decode("utf-8")] = slot[1]
+        return result
+
+    # ============================================
+    # SONDES
+    # ============================================
+
+    def store_probe(self, domain: str, server_online: bool, service_ready: bool, checked_at: float):
+        """Publie un résultat de sonde (checked_at : time.monotonic(), commun aux processus)."""
+        self.update(domain, lambda s: s[:2] + (checked_at, s[3], int(server_online), int(service_ready), s[6])
+                    if checked_at > s[2] else None)
+
+    def probe(self, domain: str) -> Optional[Tuple[bool, bool, float]]:
+        """Dernier résultat publié : (en ligne, service prêt, checked_at), ou None."""
+        slot = self._get(domain)
+        # Horloge monotone antérieure (redémarrage de la machine) : résultat ignoré
+        if slot is None or slot[2] <= 0 or slot[2] > time.monotonic():
+            return None
+        return bool(slot[4]), bool(slot[5]), slot[2]
+
+    # ============================================
+    # RÉVEIL
+    # ============================================
+
+    def wake(self, domain: str) -> Optional[Tuple[int, float]]:
+        """État de réveil : (code, depuis (epoch)), ou None si indisponible."""
+        slot = self._get(domain)
+        if slot is None:
+            return (0, 0.0) if self.available else None
+        return slot[6], slot[3]
+
+    def transition_wake(self, domain: str,
+                        decide: Callable[[int, float], Optional[int]]) -> Optional[Tuple[bool, int, float]]:
+        """
+        Transition d'état de réveil atomique entre processus. `decide` reçoit
+        (code, depuis) et retourne le nouveau code, ou None pour ne rien changer.
+        Retourne (transition faite, code, depuis), ou None si indisponible.
+        """
+        changed = []
+
+        def change(slot: _Slot) -> Optional[_Slot]:
+            state = decide(slot[6], slot[3])
+            if state is None:
+                return None
+            changed.append(True)
+            return slot[:3] + (time.time(),) + slot[4:6] + (state,)
+
+        slot = self.update(domain, change)
+        if slot is None:
+            return None
+        return bool(changed), slot[6], slot[3]
+
+    # ============================================
+    # CONFIGURATION
+    # ============================================
+
+    def config_generation(self) -> int:
+        """Génération de configuration (incrémentée par chaque rechargement forcé)."""
+        mm = self._segment()
+        return _SEQ.unpack_from(mm, _GENERATION_OFFSET)[0] if mm is not None else 0
+
+    def bump_config_generation(self) -> int:
+        """Demande à tous les workers de recharger la configuration."""
+        mm = self._segment()
+        if mm is None:
+            return 0
+        with self._locked():
+            generation = _SEQ.unpack_from(mm, _GENERATION_OFFSET)[0] + 1
+            _SEQ.pack_into(mm, _GENERATION_OFFSET, generation)
+        return generation
+
+
+# Segment partagé par tous les workers
+shared_state = SharedState(SHARED_STATE_PATH, SHARED_STATE_SLOTS)
@@ -1,6 +1,35 @@
-// Script page d'attente - polling du statut
+// Script page d'attente - flux SSE du statut, polling en repli
 let wakeRequested = false;
+let redirecting = false;
 let checkCount = 0;
+let pollingTimer = null;
+
+// Nombre d'échecs de connexion consécutifs du flux SSE avant de passer au polling
+// (la fin normale du flux après sse_max_duration n'est pas un échec)
+const MAX_STREAM_ERRORS = 3;
+
+async function handleStatus(data) {
+    // Mise à jour des statuts visuels
+    updateStatus('status-server', data.server_online);
+    updateStatus('status-service', data.service_ready);
+
+    // Afficher les infos de politique
+    updatePolicyInfo(data.policy);
+
+    // Si le serveur n'est pas en ligne et WoL pas encore envoyé
+    if (!data.server_online && !wakeRequested) {
+        wakeRequested = true;
+        await fetch(`/api/wake/${DOMAIN_NAME}`, { method: 'POST' });
+    }
+
+    // Si tout est prêt, rediriger
+    if (data.ready && data.redirect_url && !redirecting) {
+        redirecting = true;
+        // Signaler l'activité avant de rediriger
+        await fetch(`/api/activity/${DOMAIN_NAME}`, { method: 'POST' });
+        window.location.href = data.redirect_url;
+    }
+}
 
 async function checkStatus() {
     checkCount++;
@@ -8,29 +37,50 @@ async function checkStatus() {
     try {
         const response = await fetch(`/api/status/${DOMAIN_NAME}`);
         const data = await response.json();
+        await handleStatus(data);
+    } catch (error) {
+        console.error('Erreur lors de la vérification:', error);
+    }
+}
 
-        // Mise à jour des statuts visuels
-        updateStatus('status-server', data.server_online);
-        updateStatus('status-service', data.service_ready);
+function startPolling() {
+    if (pollingTimer) return;
+    // Vérification initiale puis polling selon l'intervalle configuré
+    checkStatus();
+    pollingTimer = setInterval(checkStatus, POLLING_INTERVAL);
+}
 
-        // Afficher les infos de politique
-        updatePolicyInfo(data.policy);
+function startStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
 
-        // Si le serveur n'est pas en ligne et WoL pas encore envoyé
-        if (!data.server_online && !wakeRequested) {
-            wakeRequested = true;
-            await fetch(`/api/wake/${DOMAIN_NAME}`, { method: 'POST' });
-        }
+    const source = new EventSource(`/api/status/${DOMAIN_NAME}/stream`);
+    let errors = 0;
+
+    // Connexion (ou reconnexion après une fin normale du flux) réussie
+    source.onopen = () => {
+        errors = 0;
+    };
 
-        // Si tout est prêt, rediriger
-        if (data.ready && data.redirect_url) {
-            // Signaler l'activité avant de rediriger
-            await fetch(`/api/activity/${DOMAIN_NAME}`, { method: 'POST' });
-            window.location.href = data.redirect_url;
+    source.addEventListener('status', (event) => {
+        errors = 0;
+        checkCount++;
+        const data = JSON.parse(event.data);
+        if (data.state === 'ready') source.close();
+        handleStatus(data);
+    });
+
+    source.onerror = () => {
+        if (redirecting) return;
+        errors++;
+        // Flux refusé ou instable : repli sur le polling
+        if (source.readyState === EventSource.CLOSED || errors >= MAX_STREAM_ERRORS) {
+            source.close();
+            startPolling();
         }
-    } catch (error) {
-        console.error('Erreur lors de la vérification:', error);
-    }
+    };
 }
 
 function updateStatus(elementId, isReady) {
@@ -73,8 +123,5 @@ function updatePolicyInfo(policy) {
     el.textContent = message;
 }
 
-// Vérification initiale
-checkStatus();
-
-// Polling selon l'intervalle configuré
-setInterval(checkStatus, POLLING_INTERVAL);
+// Suivi du statut en temps réel (SSE), polling en repli
+startStream();
@@ -4,7 +4,8 @@ Blueprint pour les routes des projets testing de Hall - Flask Gateway.
 Routes publiques pour l'accès aux projets testing avec authentification.
 """
 
-import os
+import time
+
 import httpx
 
 from flask import (
@@ -13,13 +14,50 @@ from flask import (
 )
 from werkzeug.security import check_password_hash
 
-from config import TESTING_SERVER_IP, PROXY_TIMEOUT
+from config import TESTING_SERVER_IP, PROXY_CHUNK_SIZE
 from database import get_testing_project, log_testing_access
 from logging_utils import log_event
+from metrics import record_upstream
+from response_cache import response_cache, CachedResponse
+from upstream_pool import upstream_pool
 
 
 testing_bp = Blueprint('testing_bp', __name__, url_prefix='/testing')
 
+# En-têtes hop-by-hop, propres à chaque connexion : jamais relayés
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade"
+}
+
+# Méthodes relayées vers les projets testing
+PROXY_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+def _has_request_body() -> bool:
+    """Indique si la requête entrante porte un corps à relayer."""
+    if request.content_length:
+        return True
+    return "chunked" in request.headers.get("Transfer-Encoding", "").lower()
+
+
+def _cached_response(entry: CachedResponse, state: str) -> Response:
+    """Réponse servie depuis le cache (304 si le client a déjà cette version)."""
+    now = time.time()
+    if entry.not_modified_for(request.headers.get("If-None-Match")):
+        return Response(status=304, headers=entry.served_headers(now, state))
+    return Response(entry.body, status=entry.status, headers=entry.served_headers(now, state))
+
+
+def _iter_request_body():
+    """Lit le corps de la requête entrante par blocs, au fil de l'eau."""
+    stream = request.stream
+    while True:
+        chunk = stream.read(PROXY_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 
 @testing_bp.route("/<project_name>/login", methods=["GET", "POST"])
 def testing_login(project_name: str):
@@ -61,8 +99,8 @@ def testing_logout(project_name: str):
     return redirect(url_for("api_bp.index"))
 
 
-@testing_bp.route("/<project_name>/", defaults={"path": ""})
-@testing_bp.route("/<project_name>/<path:path>")
+@testing_bp.route("/<project_name>/", defaults={"path": ""}, methods=PROXY_METHODS)
+@testing_bp.route("/<project_name>/<path:path>", methods=PROXY_METHODS)
 def testing_proxy(project_name: str, path: str):
     """Proxy vers le projet testing après authentification."""
     project = get_testing_project(project_name)
@@ -86,42 +124,103 @@ def testing_proxy(project_name: str, path: str):
     # Préparer les headers
     headers = {
         key: value for key, value in request.headers
-        if key.lower() not in ["host", "cookie", "connection"]
+        if key.lower() not in HOP_BY_HOP_HEADERS | {"host", "cookie"}
     }
     headers["X-Forwarded-For"] = request.remote_addr or ""
     headers["X-Forwarded-Proto"] = request.scheme
     headers["X-Project-Name"] = project_name
 
+    # Cache des réponses GET (si activé pour le projet)
+    cached = response_cache.begin(project, request.method, target_url, headers.items())
+    if cached is not None:
+        entry = cached.hit(time.time())
+        if entry is not None:
+            return _cached_response(entry, "HIT")
+        headers = dict(cached.upstream_headers(headers.items()))
+
+    port = project["port"]
+    started = time.perf_counter()
     try:
-        with httpx.Client(timeout=PROXY_TIMEOUT) as client:
-            resp = client.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                content=request.get_data(),
-            )
-
-        # Filtrer les headers de réponse
-        excluded_headers = ["content-encoding", "transfer-encoding", "connection"]
-        response_headers = [
-            (name, value) for name, value in resp.headers.items()
-            if name.lower() not in excluded_headers
-        ]
-
-        return Response(
-            resp.content,
-            status=resp.status_code,
-            headers=response_headers
+        # Le corps est transmis en flux : ni la requête ni la réponse
+        # ne sont chargées entièrement en mémoire.
+        upstream_request = upstream_pool.build_request(
+            port,
+            method=request.method,
+            url=target_url,
+            headers=headers,
+            content=_iter_request_body() if _has_request_body() else None,
         )
+        resp = upstream_pool.send(port, upstream_request, stream=True)
 
     except httpx.ConnectError:
+        record_upstream(project_name, "connect_error", started)
         log_testing_access(project_name, "proxy_error_connect")
         log_event(current_app, f"Erreur connexion proxy vers {project_name}", level="error", domain="testing")
         abort(503, description="Service temporairement indisponible")
     except httpx.TimeoutException:
+        record_upstream(project_name, "timeout", started)
         log_testing_access(project_name, "proxy_error_timeout")
         log_event(current_app, f"Timeout proxy vers {project_name}", level="error", domain="testing")
         abort(504, description="Le service met trop de temps à répondre")
     except Exception as e:
+        record_upstream(project_name, "error", started)
         current_app.logger.error(f"Erreur proxy vers {project_name}: {e}")
         abort(500, description="Erreur interne")
+    record_upstream(project_name, str(resp.status_code), started)
+
+    # Le corps brut est relayé tel quel : Content-Encoding et Content-Length
+    # restent valides, seuls les en-têtes hop-by-hop sont retirés.
+    response_headers = [
+        (name, value) for name, value in resp.headers.multi_items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    ]
+
+    if cached is not None:
+        entry = cached.revalidated(resp.status_code, response_headers)
+        if entry is not None:
+            resp.close()
+            return _cached_response(entry, "REVALIDATED")
+        if cached.answer_from_cache(resp.status_code, response_headers):
+            # Le navigateur a peut-être déjà cette version : corps lu en entier
+            # (taille connue et bornée) pour remplir le cache, puis réponse depuis la copie
+            try:
+                body = b"".join(resp.iter_raw(PROXY_CHUNK_SIZE))
+            except httpx.HTTPError as e:
+                current_app.logger.error(f"Lecture proxy interrompue pour {project_name}: {e}")
+                abort(502, description="Réponse du service incomplète")
+            finally:
+                resp.close()
+            entry = cached.store(resp.status_code, response_headers, body)
+            if entry is not None:
+                return _cached_response(entry, "MISS")
+            return Response(body, status=resp.status_code,
+                            headers=response_headers + [("X-Hall-Cache", "MISS")])
+    # Corps copié au passage pour le cache (abandonné au-delà de la taille max)
+    store = cached is not None and cached.storable(resp.status_code, response_headers)
+
+    logger = current_app.logger
+
+    def generate():
+        body = bytearray() if store else None
+        try:
+            for chunk in resp.iter_raw(PROXY_CHUNK_SIZE):
+                if body is not None:
+                    body += chunk
+                    if len(body) > response_cache.max_entry_bytes:
+                        body = None
+                yield chunk
+            if body is not None:
+                cached.store(resp.status_code, response_headers, bytes(body))
+        except httpx.HTTPError as e:
+            logger.error(f"Flux proxy interrompu pour {project_name}: {e}")
+
+    response = Response(
+        generate(),
+        status=resp.status_code,
+        headers=response_headers + ([("X-Hall-Cache", "MISS")] if cached is not None else []),
+        direct_passthrough=True
+    )
+    # Fermeture à la fin de la réponse WSGI, même si le corps n'est jamais lu
+    # (HEAD, 1xx/204/304) : sinon la connexion resterait prise dans le pool
+    response.call_on_close(resp.close)
+    return response
@@ -0,0 +1,141 @@
+"""
+upstream_pool.py
+Pool de clients HTTP persistants pour le reverse proxy testing de Hall - Flask Gateway.
+Un client httpx (keep-alive) par upstream, partagé par les threads du worker.
+"""
+
+import os
+import threading
+from typing import Dict, Any, List
+
+import httpx
+
+from config import (
+    PROXY_TIMEOUT, PROXY_MAX_CONNECTIONS, PROXY_MAX_KEEPALIVE, PROXY_KEEPALIVE_EXPIRY
+)
+
+
+class UpstreamPool:
+    """
+    Clients httpx longue durée, indexés par upstream (port du projet testing).
+
+    Les compteurs reposent sur l'extension « trace » de httpcore : chaque
+    ouverture de connexion TCP est comptée, et une requête dont les en-têtes
+    partent sans ouverture préalable a réutilisé une connexion keep-alive.
+    """
+
+    def __init__(self, timeout: float, max_connections: int,
+                 max_keepalive: int, keepalive_expiry: float):
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._clients: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._requests = 0
+        self._new_connections = 0
+        self._reused_connections = 0
+
+    def client(self, port: int) -> httpx.Client:
+        """Retourne le client associé à un upstream, créé à la demande."""
+        if self._pid != os.getpid():
+            # Après un fork, les sockets hérités ne doivent pas être partagés
+            with self._lock:
+                self._clients = {}
+                self._pid = os.getpid()
+        client = self._clients.get(port)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(port)
+                if client is None:
+                    client = httpx.Client(timeout=self.timeout, limits=self.limits)
+                    self._clients[port] = client
+        return client
+
+    def _on_trace(self, event_name: str, connected: List[bool]):
+        """Compte une connexion ouverte ou réutilisée (`connected` : état de la requête)."""
+        if event_name == "connection.connect_tcp.complete":
+            connected.append(True)
+            with self._lock:
+                self._new_connections += 1
+        elif event_name.endswith(".send_request_headers.started") and not connected:
+            with self._lock:
+                self._reused_connections += 1
+
+    def _tracer(self):
+        connected: List[bool] = []
+        return lambda event_name, info: self._on_trace(event_name, connected)
+
+    def send(self, port: int, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        """Envoie une requête via le client de l'upstream."""
+        request.extensions["trace"] = self._tracer()
+        with self._lock:
+            self._requests += 1
+        return self.client(port).send(request, stream=stream)
+
+    def build_request(self, port: int, **kwargs: Any) -> httpx.Request:
+        """Construit une requête avec la configuration du client de l'upstream."""
+        return self.client(port).build_request(**kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistiques du pool (par worker)."""
+        return {
+            "pid": os.getpid(),
+            "requests": self._requests,
+            "new_connections": self._new_connections,
+            "reused_connections": self._reused_connections,
+            "upstreams": sorted(self._clients),
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+            },
+        }
+
+
+class AsyncUpstreamPool(UpstreamPool):
+    """Variante asyncio du pool (mode ASGI), avec des httpx.AsyncClient."""
+
+    def client(self, port: int) -> httpx.AsyncClient:  # type: ignore[override]
+        client = self._clients.get(port)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(port)
+                if client is None:
+                    client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+                    self._clients[port] = client
+        return client
+
+    def _tracer(self):
+        connected: List[bool] = []
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            self._on_trace(event_name, connected)
+        return trace
+
+    async def send(self, port: int, request: httpx.Request,  # type: ignore[override]
+                   stream: bool = False) -> httpx.Response:
+        request.extensions["trace"] = self._tracer()
+        with self._lock:
+            self._requests += 1
+        return await self.client(port).send(request, stream=stream)
+
+    async def aclose(self):
+        """Ferme tous les clients (arrêt du worker)."""
+        for client in list(self._clients.values()):
+            await client.aclose()
+        self._clients = {}
+
+
+# Pool partagé par les requêtes proxy (un par worker)
+upstream_pool = UpstreamPool(
+    PROXY_TIMEOUT, PROXY_MAX_CONNECTIONS, PROXY_MAX_KEEPALIVE, PROXY_KEEPALIVE_EXPIRY
+)
+
+# Pool asynchrone utilisé par le point d'entrée ASGI (un par worker)
+async_upstream_pool = AsyncUpstreamPool(
+    PROXY_TIMEOUT, PROXY_MAX_CONNECTIONS, PROXY_MAX_KEEPALIVE, PROXY_KEEPALIVE_EXPIRY
+)
@@ -0,0 +1,125 @@
+"""
+wake_state.py
+Machine d'état des réveils pour Hall - Flask Gateway, partagée entre les
+workers gunicorn via l'état partagé (voir shared_state.py).
+
+    idle ──claim()──▶ waking ──sonde: serveur joignable──▶ online
+      ▲                 │  ▲                                 │
+      │                 │  └── claim(observed_offline=True) ─┤
+      └── échec WoL / fenêtre de démarrage expirée ◀─────────┘ sonde: serveur injoignable,
+                                                               shut_down() (extinction)
+
+Un réveil n'est envoyé que par l'appelant qui réussit la transition
+idle → waking (transition sous verrou, atomique entre processus) : N onglets
+qui demandent le réveil en même temps produisent un seul paquet magique.
+Les autres reçoivent l'état courant. Les transitions vers online et idle
+suivent les sondes du StatusProber. Un domaine n'est plus sondé sans
+visiteur : un appelant qui vient lui-même de trouver le serveur éteint
+(ex: ping du réveil anticipé) peut donc réclamer le réveil depuis online.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, Optional, Tuple
+
+from boot_telemetry import boot_telemetry
+from prober import status_prober, ProbeResult
+from shared_state import SharedState, shared_state
+
+
+# Durée minimale pendant laquelle un réveil en cours bloque les suivants (secondes)
+WAKE_BOOT_WINDOW = float(os.environ.get("WAKE_BOOT_WINDOW", "180"))
+
+IDLE = "idle"
+WAKING = "waking"
+ONLINE = "online"
+
+# Codes des états dans l'état partagé
+_CODES = {IDLE: 0, WAKING: 1, ONLINE: 2}
+_STATES = {code: state for state, code in _CODES.items()}
+
+
+class WakeStateMachine:
+    """État de réveil par domaine, avec transitions atomiques entre workers."""
+
+    def __init__(self, shared: SharedState, boot_window: float):
+        self._shared = shared
+        self.boot_window = boot_window
+        # Temps de démarrage mesuré d'un domaine (secondes), ou None
+        self.boot_estimate: Callable[[str], Optional[float]] = lambda domain: None
+        # Repli local si l'état partagé est indisponible : {domaine: (code, depuis)}
+        self._local: Dict[str, Tuple[int, float]] = {}
+        self._local_lock = threading.Lock()
+
+    def window(self, domain: str) -> float:
+        """Fenêtre de démarrage : la valeur configurée, ou le démarrage mesuré s'il est plus long."""
+        return max(self.boot_window, self.boot_estimate(domain) or 0.0)
+
+    def _transition(self, domain: str,
+                    decide: Callable[[int, float], Optional[int]]) -> Tuple[bool, int, float]:
+        result = self._shared.transition_wake(domain, decide)
+        if result is not None:
+            return result
+        with self._local_lock:
+            code, since = self._local.get(domain, (0, 0.0))
+            new = decide(code, since)
+            if new is None:
+                return False, code, since
+            self._local[domain] = (new, time.time())
+            return (True,) + self._local[domain]
+
+    @staticmethod
+    def _describe(code: int, since: float) -> Dict[str, Any]:
+        return {"state": _STATES.get(code, IDLE), "since": since or None}
+
+    def get(self, domain: str) -> Dict[str, Any]:
+        """État courant d'un domaine : {"state", "since"} (idle si jamais réveillé)."""
+        wake = self._shared.wake(domain)
+        if wake is None:
+            wake = self._local.get(domain, (0, 0.0))
+        return self._describe(*wake)
+
+    def claim(self, domain: str, observed_offline: bool = False) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Tente la transition vers waking.
+        Retourne (True, état) si l'appelant doit envoyer le WoL, sinon
+        (False, état courant) : réveil déjà en cours ou serveur en ligne.
+        `observed_offline` : l'appelant vient de constater le serveur éteint,
+        l'état online (dernière sonde, peut-être ancienne) est alors périmé.
+        """
+        expired = time.time() - self.window(domain)
+
+        def decide(code: int, since: float) -> Optional[int]:
+            if code == _CODES[IDLE] or (code == _CODES[WAKING] and since < expired) \
+                    or (code == _CODES[ONLINE] and observed_offline):
+                return _CODES[WAKING]
+            return None
+
+        claimed, code, since = self._transition(domain, decide)
+        return claimed, self._describe(code, since)
+
+    def release(self, domain: str):
+        """Annule un réveil dont l'envoi a échoué (waking → idle)."""
+        self._transition(domain, lambda code, since: _CODES[IDLE] if code == _CODES[WAKING] else None)
+
+    def shut_down(self, domain: str):
+        """Extinction demandée avec succès : retour à idle (le prochain réveil sera envoyé)."""
+        self._transition(domain, lambda code, since: _CODES[IDLE] if code != _CODES[IDLE] else None)
+
+    def observe(self, domain: str, result: ProbeResult):
+        """
+        Observateur du StatusProber. La lecture précède l'écriture : seules
+        les sondes qui changent l'état prennent le verrou d'écriture.
+        """
+        state = self.get(domain)["state"]
+        if result.server_online and state != ONLINE:
+            self._transition(domain, lambda code, since: _CODES[ONLINE] if code != _CODES[ONLINE] else None)
+        elif not result.server_online and state == ONLINE:
+            self._transition(domain, lambda code, since: _CODES[IDLE] if code == _CODES[ONLINE] else None)
+
+
+# Machine d'état partagée, alimentée par les sondes du StatusProber
+wake_states = WakeStateMachine(shared_state, WAKE_BOOT_WINDOW)
+wake_states.boot_estimate = lambda domain: boot_telemetry.estimate(domain, 0.99)
+status_prober.observers.append(wake_states.observe)
@@ -3,14 +3,41 @@ wol.py
 Fonctions Wake-on-LAN et vérifications réseau pour Hall - Flask Gateway.
 """
 
-import subprocess
 import os
+import threading
+import httpx
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlparse, urlunparse
 
 from flask import Flask
 
 from logging_utils import log_event
+from metrics import WOL_SENT
+from netprobe import ping_many
+
+
+# API WoL dédiée (conteneur hall-wol)
+WOL_API_URL = os.environ.get("WOL_API_URL", "http://hall-wol:5001/wol")
+WOL_API_KEY = os.environ.get("WOL_API_KEY", "change-me")
+WOL_BROADCAST = os.environ.get("WOL_BROADCAST", "192.168.1.255")
+WOL_API_TIMEOUT = 5
+
+# Session HTTP persistante vers l'API WoL (keep-alive), recréée après un fork
+_wol_session: Optional[requests.Session] = None
+_wol_session_pid: Optional[int] = None
+_wol_session_lock = threading.Lock()
+
+
+def _get_wol_session() -> requests.Session:
+    global _wol_session, _wol_session_pid
+    if _wol_session is None or _wol_session_pid != os.getpid():
+        with _wol_session_lock:
+            if _wol_session is None or _wol_session_pid != os.getpid():
+                session = requests.Session()
+                session.headers["X-API-KEY"] = WOL_API_KEY
+                _wol_session, _wol_session_pid = session, os.getpid()
+    return _wol_session
 
 
 def send_wol(app: Flask, mac_address: str, domain: str = None) -> bool:
@@ -22,17 +49,13 @@ def send_wol(app: Flask, mac_address: str, domain: str = None) -> bool:
     :param domain: Domaine associé (pour le logging par domaine)
     :return: True si succès, False sinon
     """
-    # Appel à l'API WoL dédiée (dans le conteneur hall-wol)
-    WOL_API_URL = os.environ.get("WOL_API_URL", "http://hall-wol:5001/wol")
-    WOL_API_KEY = os.environ.get("WOL_API_KEY", "change-me")
-    WOL_BROADCAST = os.environ.get("WOL_BROADCAST", "192.168.1.255")
     try:
-        response = requests.post(
+        response = _get_wol_session().post(
             WOL_API_URL,
             json={"mac": mac_address, "broadcast": WOL_BROADCAST},
-            headers={"X-API-KEY": WOL_API_KEY},
-            timeout=5
+            timeout=WOL_API_TIMEOUT
         )
+        WOL_SENT.labels(domain or "", "success" if response.status_code == 200 else "failed").inc()
         if response.status_code == 200:
             log_event(
                 app,
@@ -49,6 +72,7 @@ def send_wol(app: Flask, mac_address: str, domain: str = None) -> bool:
             )
             return False
     except Exception as e:
+        WOL_SENT.labels(domain or "", "error").inc()
         log_event(
             app,
             f"Erreur lors de l'appel à l'API WoL: {e}",
@@ -58,21 +82,85 @@ def send_wol(app: Flask, mac_address: str, domain: str = None) -> bool:
         return False
 
 
+def send_wol_batch(app: Flask, targets: Dict[str, str]) -> Dict[str, bool]:
+    """
+    Réveille plusieurs serveurs en un seul appel à l'API WoL (/wol/batch).
+    
+    :param app: Instance Flask pour le logging
+    :param targets: Adresse MAC par domaine {domaine: mac}
+    :return: Succès par domaine {domaine: bool}
+    """
+    if not targets:
+        return {}
+    domains = list(targets)
+    results = {domain: False for domain in domains}
+    try:
+        response = _get_wol_session().post(
+            f"{WOL_API_URL.rstrip('/')}/batch",
+            json={
+                "targets": [{"mac": targets[domain]} for domain in domains],
+                "broadcast": WOL_BROADCAST,
+            },
+            timeout=WOL_API_TIMEOUT
+        )
+        if response.status_code == 200:
+            # Les résultats suivent l'ordre des cibles envoyées
+            for domain, item in zip(domains, response.json().get("results", [])):
+                results[domain] = item.get("result") == "sent"
+        else:
+            log_event(
+                app,
+                f"Erreur WoL API (lot de {len(domains)}) | status: {response.status_code} | body: {response.text}",
+                level="error"
+            )
+    except Exception as e:
+        log_event(app, f"Erreur lors de l'appel à l'API WoL (lot): {e}", level="error")
+
+    for domain, success in results.items():
+        WOL_SENT.labels(domain, "success" if success else "failed").inc()
+        log_event(
+            app,
+            f"WoL {'envoyé' if success else 'non envoyé'} à {targets[domain]} via API (lot)",
+            level="info" if success else "error",
+            domain=domain
+        )
+    return results
+
+
+def request_shutdown(endpoint: Dict[str, Any], timeout: float = 5) -> Tuple[bool, str]:
+    """
+    Demande l'extinction d'un serveur via son shutdown_endpoint.
+    
+    :param endpoint: Section shutdown_endpoint du domaine (url, method, port)
+    :param timeout: Timeout en secondes
+    :return: (succès, détail : code HTTP ou erreur)
+    """
+    url = endpoint.get("url", "")
+    method = endpoint.get("method", "POST").upper()
+    port = endpoint.get("port")
+    try:
+        parsed = urlparse(url)
+        if port and parsed.port is None:
+            # Ajoute le port si non présent dans l'URL (hôte IPv6 « [::1] » compris)
+            url = urlunparse(parsed._replace(netloc=f"{parsed.netloc}:{port}"))
+        resp = requests.request(method, url, timeout=timeout)
+    except Exception as e:
+        return False, str(e)
+    if resp.status_code in (200, 202, 204):
+        return True, f"HTTP {resp.status_code}"
+    return False, f"HTTP {resp.status_code}: {resp.text[:200]}"
+
+
 def ping_server(ip_address: str, timeout: int = 2) -> bool:
     """
-    Vérifie si le serveur répond au ping.
+    Vérifie si le serveur répond au ping (sonde native, sans processus).
     
     :param ip_address: Adresse IP du serveur
     :param timeout: Timeout en secondes
     :return: True si le serveur répond, False sinon
     """
     try:
-        result = subprocess.run(
-            ["ping", "-c", "1", "-W", str(timeout), ip_address],
-            capture_output=True,
-            check=False
-        )
-        return result.returncode == 0
+        return ping_many([ip_address], timeout).get(ip_address, False)
     except Exception:
         return False
 
@@ -94,6 +182,24 @@ def check_health(url: str, endpoint: str, timeout: int = 5) -> bool:
         return False
 
 
+async def async_check_health(client: httpx.AsyncClient, url: str, endpoint: str, timeout: int = 5) -> bool:
+    """
+    Équivalent asynchrone de check_health (mode ASGI).
+    
+    :param client: Client httpx asynchrone partagé (verify=False)
+    :param url: URL de base du service
+    :param endpoint: Endpoint de health check (ex: /health)
+    :param timeout: Timeout en secondes
+    :return: True si le service répond avec un status 200
+    """
+    try:
+        health_url = f"{url.rstrip('/')}{endpoint}"
+        response = await client.get(health_url, timeout=timeout)
+        return response.status_code == 200
+    except Exception:
+        return False
+
+
 def check_testing_project_health(project: Dict[str, Any], testing_server_ip: str) -> bool:
     """
     Vérifie si un projet testing est accessible.
@@ -1,26 +1,202 @@
+"""
+wol_api.py
+Micro-service Wake-on-LAN de Hall (conteneur hall-wol, réseau macvlan).
+Les paquets magiques sont construits ici et envoyés par un socket UDP
+broadcast unique, réutilisé par toutes les requêtes. Chaque paquet est
+répété `repeat` fois (rafales espacées de WOL_REPEAT_INTERVAL secondes) pour
+résister aux pertes UDP.
+
+- POST /wol       : {"mac", "broadcast"?, "password"?, "repeat"?}
+- POST /wol/batch : {"targets": [{"mac", "broadcast"?, "password"?}, ...],
+                     "broadcast"?, "repeat"?}
+
+Lancement : gunicorn, un worker threadé (voir Dockerfile)
+"""
+
 from flask import Flask, request, jsonify
-import subprocess
 import os
+import re
+import socket
+import threading
+import time
 
 app = Flask(__name__)
 
 API_KEY = os.environ.get("WOL_API_KEY", "change-me")
+DEFAULT_BROADCAST = os.environ.get("WOL_BROADCAST", "192.168.1.255")  # Valeur par défaut adaptée au LAN
+WOL_PORT = int(os.environ.get("WOL_PORT", "9"))
+# Nombre d'envois de chaque paquet et délai entre deux rafales (secondes)
+WOL_REPEAT = int(os.environ.get("WOL_REPEAT", "3"))
+WOL_REPEAT_INTERVAL = float(os.environ.get("WOL_REPEAT_INTERVAL", "0.1"))
+# Mot de passe SecureOn par défaut (6 octets, ex: "01:02:03:04:05:06"), vide = aucun
+WOL_SECUREON = os.environ.get("WOL_SECUREON", "")
+# Nombre maximal de MAC par appel à /wol/batch
+WOL_BATCH_MAX = int(os.environ.get("WOL_BATCH_MAX", "256"))
+MAX_REPEAT = 10
+
+_HEX_PAIRS = re.compile(r"^[0-9a-fA-F]{12}$")
+
+# Socket UDP broadcast partagé (recréé après un fork)
+_socket = None
+_socket_pid = None
+_socket_lock = threading.Lock()
+
+
+def parse_mac(value: str) -> bytes:
+    """
+    Convertit une adresse MAC (séparateurs « : », « - », « . » ou aucun) en 6 octets.
+    Le même format sert au mot de passe SecureOn.
+    """
+    digits = re.sub(r"[:\-.]", "", str(value).strip())
+    if not _HEX_PAIRS.match(digits):
+        raise ValueError(f"adresse invalide: {value}")
+    return bytes.fromhex(digits)
+
+
+def build_magic_packet(mac: str, password: str = "") -> bytes:
+    """Paquet magique : 6 × 0xFF, 16 × la MAC, puis le mot de passe SecureOn éventuel."""
+    packet = b"\xff" * 6 + parse_mac(mac) * 16
+    if password:
+        packet += parse_mac(password)
+    return packet
+
+
+def resolve_broadcast(value) -> str:
+    """Adresse IPv4 de diffusion (nom résolu) ; ValueError si elle est invalide ou introuvable."""
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"broadcast invalide: {value!r}")
+    try:
+        return socket.getaddrinfo(value.strip(), WOL_PORT, socket.AF_INET, socket.SOCK_DGRAM)[0][4][0]
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"broadcast invalide: {value} ({e})") from None
+
+
+def _get_socket() -> socket.socket:
+    global _socket, _socket_pid
+    if _socket is None or _socket_pid != os.getpid():
+        with _socket_lock:
+            if _socket is None or _socket_pid != os.getpid():
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                _socket, _socket_pid = sock, os.getpid()
+    return _socket
+
+
+def send_packets(packets, repeat: int):
+    """
+    Envoie des paquets [(paquet, broadcast), ...] en `repeat` rafales.
+    Une rafale contient un exemplaire de chaque paquet : un lot entier part
+    en quelques millisecondes, même répété. Un échec n'interrompt pas le lot.
+    Retourne, par paquet, None s'il est parti au moins une fois, sinon l'erreur.
+    """
+    sock = _get_socket()
+    errors = [None] * len(packets)
+    sent = [False] * len(packets)
+    for burst in range(repeat):
+        if burst:
+            time.sleep(WOL_REPEAT_INTERVAL)
+        for index, (packet, broadcast) in enumerate(packets):
+            try:
+                sock.sendto(packet, (broadcast, WOL_PORT))
+                sent[index] = True
+            except OSError as e:
+                errors[index] = str(e)
+    return [None if ok else error for ok, error in zip(sent, errors)]
+
+
+def _authorized() -> bool:
+    return request.headers.get("X-API-KEY") == API_KEY
+
+
+def _repeat(data) -> int:
+    value = data.get("repeat")
+    if value is None:
+        return WOL_REPEAT
+    try:
+        return max(1, min(int(value), MAX_REPEAT))
+    except (TypeError, ValueError):
+        raise ValueError(f"repeat invalide: {value!r}") from None
+
 
 @app.route("/wol", methods=["POST"])
 def wol():
-    if request.headers.get("X-API-KEY") != API_KEY:
+    if not _authorized():
         return jsonify({"error": "unauthorized"}), 403
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
     mac = data.get("mac")
-    broadcast = data.get("broadcast", "192.168.1.255")  # Valeur par défaut adaptée au LAN
+    broadcast = data.get("broadcast", DEFAULT_BROADCAST)
     if not mac:
         return jsonify({"error": "missing mac"}), 400
     try:
-        # Utilisation de l'option -i pour forcer le broadcast sur le LAN physique
-        result = subprocess.run(["wakeonlan", "-i", broadcast, mac], capture_output=True, text=True, check=True)
-        return jsonify({"result": "sent", "stdout": result.stdout.strip()}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        packet = build_magic_packet(mac, data.get("password", WOL_SECUREON))
+        address = resolve_broadcast(broadcast)
+        repeat = _repeat(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        error = send_packets([(packet, address)], repeat)[0]
+    except OSError as e:
+        error = str(e)
+    if error is not None:
+        return jsonify({"error": error}), 500
+    return jsonify({"result": "sent", "mac": mac, "broadcast": broadcast, "repeat": repeat}), 200
+
+
+@app.route("/wol/batch", methods=["POST"])
+def wol_batch():
+    if not _authorized():
+        return jsonify({"error": "unauthorized"}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    targets = data.get("targets")
+    if not isinstance(targets, list) or not targets:
+        return jsonify({"error": "missing targets"}), 400
+    if len(targets) > WOL_BATCH_MAX:
+        return jsonify({"error": f"too many targets (max {WOL_BATCH_MAX})"}), 400
+    try:
+        repeat = _repeat(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    default_broadcast = data.get("broadcast", DEFAULT_BROADCAST)
+    packets = []
+    # Résultat par cible, dans l'ordre reçu ; les cibles valides partent ensemble
+    results = []
+    queued = []
+    addresses = {}
+    for target in targets:
+        if isinstance(target, str):
+            target = {"mac": target}
+        if not isinstance(target, dict):
+            results.append({"mac": None, "error": f"cible invalide: {target!r}"})
+            continue
+        mac = target.get("mac", "")
+        broadcast = target.get("broadcast", default_broadcast)
+        try:
+            packet = build_magic_packet(mac, target.get("password", WOL_SECUREON))
+            address = addresses.get(broadcast) if isinstance(broadcast, str) else None
+            if address is None:
+                address = addresses[broadcast] = resolve_broadcast(broadcast)
+            packets.append((packet, address))
+            results.append({"mac": mac, "result": "sent"})
+            queued.append(results[-1])
+        except ValueError as e:
+            results.append({"mac": mac, "error": str(e)})
+
+    try:
+        errors = send_packets(packets, repeat) if packets else []
+    except OSError as e:
+        errors = [str(e)] * len(packets)
+    for result, error in zip(queued, errors):
+        if error is not None:
+            del result["result"]
+            result["error"] = error
+    sent = sum(1 for error in errors if error is None)
+    return jsonify({"sent": sent, "repeat": repeat, "results": results}), 200
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001)
+    app.run(host="0.0.0.0", port=5001, threaded=True)